@@ -0,0 +1,380 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from PIL import Image
+import Dataset
+from Data import Data
+from Streets import Streets
+from PostalAreas import PostalAreas
+from parseXML_singleRun import ENGINES, _ENGINE_READERS, collect_data
+
+STREET_TYPES = ['residential', 'service', 'footway', 'tertiary', 'secondary', 'primary', 'motorway']
+# share of each street type in the synthetic extracts (roughly the one of a city)
+STREET_TYPE_WEIGHTS = {'residential': 0.35, 'service': 0.25, 'footway': 0.2, 'tertiary': 0.08, 'secondary': 0.06, 'primary': 0.04, 'motorway': 0.02}
+BOUNDS = {'minlat': 52.3, 'minlon': 13.0, 'maxlat': 52.7, 'maxlon': 13.8}
+# sizes of the synthetic extracts of the stage benchmark
+SIZE_TIERS = {
+    'small': {'node_count': 20000, 'street_count': 2000, 'camera_count': 200, 'postal_count': 16, 'postal_vertices': 50},
+    'medium': {'node_count': 200000, 'street_count': 20000, 'camera_count': 2000, 'postal_count': 64, 'postal_vertices': 200},
+    'large': {'node_count': 1000000, 'street_count': 100000, 'camera_count': 10000, 'postal_count': 190, 'postal_vertices': 500},
+}
+STAGES = ['parse', 'csv write', 'csv load', 'Streets', 'analyze_street_lengths', 'get_oneway_quota', 'PostalAreas', 'get_camera_counts', 'plot']
+REGRESSION_THRESHOLD = 0.2      # a stage is flagged if it takes more than 20 % longer than in the reference run
+MIN_SECONDS = 0.05              # stages faster than this in both runs are not flagged (timer noise)
+
+def synthetic_streets(street_count, points_per_street = 8, seed = 0):
+    '''
+    Create bounds, streets and node_coords (in the layout of Data.get_streets) of street_count random streets
+    inside a map excerpt of the size of Berlin. Every street is a random walk of points_per_street nodes.
+    '''
+    rng = np.random.RandomState(seed)
+    bounds = {'minlat': 52.3, 'minlon': 13.0, 'maxlat': 52.7, 'maxlon': 13.8}
+    start_lats = rng.uniform(bounds['minlat'], bounds['maxlat'], street_count)
+    start_lons = rng.uniform(bounds['minlon'], bounds['maxlon'], street_count)
+    steps = rng.normal(0, 0.0005, (street_count, points_per_street, 2))
+    steps[:, 0] = 0
+    lats = np.clip(start_lats[:, np.newaxis] + np.cumsum(steps[:, :, 0], axis = 1), bounds['minlat'], bounds['maxlat'])
+    lons = np.clip(start_lons[:, np.newaxis] + np.cumsum(steps[:, :, 1], axis = 1), bounds['minlon'], bounds['maxlon'])
+    node_ids = np.arange(street_count * points_per_street).reshape(street_count, points_per_street) + 1
+    node_coords = dict(zip(node_ids.ravel().astype(str).tolist(), zip(lats.ravel().tolist(), lons.ravel().tolist())))
+    types = rng.choice(STREET_TYPES, street_count)
+    streets = {}
+    for k in range(street_count):
+        streets[str(k + 1)] = [types[k], int(rng.randint(2)), '', ''] + node_ids[k].astype(str).tolist()
+    return bounds, streets, node_coords
+
+def write_synthetic_osm(FILE, node_count = 20000, street_count = 2000, camera_count = 200, postal_count = 16, postal_vertices = 50,
+                        street_types = None, oneway_share = 0.3, seed = 0):
+    '''
+    Write a deterministic synthetic OpenStreetMap xml extract to **FILE** (the same arguments always give the same file):
+        - **street_count** streets (ways with highway, name, postal_code and oneway for a share of **oneway_share**) that are
+          random walks over their own nodes, **node_count** street nodes in total
+        - **camera_count** camera nodes (man_made=surveillance) at random positions
+        - **postal_count** postal areas on a grid over the map excerpt, each a relation of two ways forming a closed ring
+          of **postal_vertices** nodes (a jittered circle inside its grid cell)
+    **street_types** {street_type: weight} gives the distribution of the street types (default STREET_TYPE_WEIGHTS).
+    Returns the counts of the written nodes, ways and relations.
+    '''
+    rng = np.random.RandomState(seed)
+    street_types = street_types or STREET_TYPE_WEIGHTS
+    type_names = sorted(street_types)
+    weights = np.array([street_types[name] for name in type_names], dtype = np.float64)
+    lat_span, lon_span = BOUNDS['maxlat'] - BOUNDS['minlat'], BOUNDS['maxlon'] - BOUNDS['minlon']
+    # postal areas: one grid cell each
+    columns = int(np.ceil(np.sqrt(postal_count)))
+    rows = int(np.ceil(postal_count / float(columns)))
+    cell_lat, cell_lon = lat_span / rows, lon_span / columns
+    # streets: every street gets node_count // street_count nodes (at least 2), the remaining ones go to the first streets
+    nodes_per_street = np.full(street_count, max(node_count // max(street_count, 1), 2), dtype = np.int64)
+    nodes_per_street[:max(node_count - nodes_per_street.sum(), 0)] += 1
+    street_offsets = np.concatenate([[0], np.cumsum(nodes_per_street)])
+    steps = rng.normal(0, 0.0004, (street_offsets[-1], 2))
+    steps[street_offsets[:-1]] = np.column_stack([rng.uniform(BOUNDS['minlat'], BOUNDS['maxlat'], street_count),
+                                                  rng.uniform(BOUNDS['minlon'], BOUNDS['maxlon'], street_count)])
+    walk = np.cumsum(steps, axis = 0)
+    # restart the cumulative sum at the start of each street
+    walk -= np.repeat(walk[street_offsets[:-1]] - steps[street_offsets[:-1]], nodes_per_street, axis = 0)
+    street_lats = np.clip(walk[:, 0], BOUNDS['minlat'], BOUNDS['maxlat'])
+    street_lons = np.clip(walk[:, 1], BOUNDS['minlon'], BOUNDS['maxlon'])
+    types = np.array(type_names)[rng.choice(len(type_names), street_count, p = weights / weights.sum())]
+    oneways = rng.uniform(size = street_count) < oneway_share
+    start_cells = (np.minimum(((street_lats[street_offsets[:-1]] - BOUNDS['minlat']) / cell_lat).astype(int), rows - 1) * columns
+                   + np.minimum(((street_lons[street_offsets[:-1]] - BOUNDS['minlon']) / cell_lon).astype(int), columns - 1))
+    camera_lats = rng.uniform(BOUNDS['minlat'], BOUNDS['maxlat'], camera_count)
+    camera_lons = rng.uniform(BOUNDS['minlon'], BOUNDS['maxlon'], camera_count)
+    angles = np.linspace(0, 2 * np.pi, postal_vertices, endpoint = False)
+    radii = 0.45 * rng.uniform(0.8, 1.0, (postal_count, postal_vertices))
+
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6" generator="Benchmark.py">',
+             ' <bounds minlat="%s" minlon="%s" maxlat="%s" maxlon="%s"/>' % (BOUNDS['minlat'], BOUNDS['minlon'], BOUNDS['maxlat'], BOUNDS['maxlon'])]
+    node_id = 0
+    for (lat, lon) in zip(street_lats.tolist(), street_lons.tolist()):
+        node_id += 1
+        lines.append(' <node id="%d" lat="%.7f" lon="%.7f" version="1"/>' % (node_id, lat, lon))
+    for (lat, lon) in zip(camera_lats.tolist(), camera_lons.tolist()):
+        node_id += 1
+        lines.append(' <node id="%d" lat="%.7f" lon="%.7f" version="1">\n  <tag k="man_made" v="surveillance"/>\n </node>' % (node_id, lat, lon))
+    area_rings = []
+    for area in range(postal_count):
+        center_lat = BOUNDS['minlat'] + (area // columns + 0.5) * cell_lat
+        center_lon = BOUNDS['minlon'] + (area % columns + 0.5) * cell_lon
+        ring = []
+        for (angle, radius) in zip(angles.tolist(), radii[area].tolist()):
+            node_id += 1
+            ring.append(node_id)
+            lines.append(' <node id="%d" lat="%.7f" lon="%.7f" version="1"/>' % (node_id, center_lat + radius * cell_lat * np.sin(angle),
+                                                                                center_lon + radius * cell_lon * np.cos(angle)))
+        area_rings.append(ring)
+    way_id = 0
+    for street in range(street_count):
+        way_id += 1
+        lines.append(' <way id="%d" version="1">' % way_id)
+        lines.extend('  <nd ref="%d"/>' % ref for ref in range(street_offsets[street] + 1, street_offsets[street + 1] + 1))
+        lines.append('  <tag k="highway" v="%s"/>' % types[street])
+        lines.append('  <tag k="name" v="Street %d"/>' % way_id)
+        lines.append('  <tag k="postal_code" v="%d"/>' % (10000 + start_cells[street]))
+        if oneways[street]:
+            lines.append('  <tag k="oneway" v="yes"/>')
+        lines.append(' </way>')
+    area_ways = []
+    for ring in area_rings:
+        # split each ring into two ways that share their end nodes
+        half = len(ring) // 2
+        area_ways.append([way_id + 1, way_id + 2])
+        for refs in [ring[:half + 1], ring[half:] + ring[:1]]:
+            way_id += 1
+            lines.append(' <way id="%d" version="1">' % way_id)
+            lines.extend('  <nd ref="%d"/>' % ref for ref in refs)
+            lines.append(' </way>')
+    for (area, ways) in enumerate(area_ways):
+        lines.append(' <relation id="%d" version="1">' % (area + 1))
+        lines.extend('  <member type="way" ref="%d" role="outer"/>' % way for way in ways)
+        lines.append('  <tag k="boundary" v="postal_code"/>\n  <tag k="postal_code" v="%d"/>\n  <tag k="type" v="boundary"/>' % (10000 + area))
+        lines.append(' </relation>')
+    lines.append('</osm>\n')
+    with open(FILE, 'w') as write_file:
+        write_file.write('\n'.join(lines))
+    return node_id, way_id, postal_count
+
+def _timed(function, *args, **kwargs):
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+def plot_layers(streets, street_type = None, dpi = 200):
+    '''
+    Previous plotting method of Streets: plot each street of **streets** with its own matplotlib call into layers of
+    10000 streets, save the layers as temporary png files and merge them. Only kept to compare it with Streets.plot.
+    '''
+    print('\nPlotting streets...')
+    counter = 0
+    count_file = 0
+    plt.rc('lines', linewidth=0.1, color='black')
+    fig = plt.figure()
+    fig_plot = fig.add_subplot(1, 1, 1)
+    fig_plot.axis([0, 0.5, 0, 0.2])
+    fig_plot.axis('off')
+    if street_type:
+        assert(street_type in streets.street_types)
+        street_ids = list(streets.street_data.loc[ streets.street_data['type'] == street_type ].index)
+        street_nodes = { id: streets.street_nodes[id] for id in street_ids }
+    else:
+        street_nodes = streets.street_nodes
+    street_total = len(street_nodes)
+    # get current time
+    time_now = time.strftime('%d.%m.%Y_%H.%M.%S')
+    # set paths of the temporary directory to store single images
+    out_dir = os.path.join('./', 'images/')
+    print('outdir:\t %s' % out_dir)
+    if not os.path.isdir(out_dir):
+        os.mkdir(out_dir)
+    for street_id in street_nodes:
+        counter += 1
+        x_coords = []
+        y_coords = []
+        for (lat, lon) in streets.get_street_coords(street_id):
+            (y_0, x_0) = (np.float_(lat) - streets.minlat, np.float_(lon) - streets.minlon)
+            x_coords.append(x_0)
+            y_coords.append(y_0)
+        fig_plot.plot(x_coords , y_coords, color = 'k')
+        if counter >= 10000:
+            plt.savefig( (os.path.join('./images/', 'street-layer_%s_%s.png' % (time_now, count_file))),
+                            dpi = dpi, transparent = True)
+            plt.close()
+            fig = plt.figure()
+            fig_plot = fig.add_subplot(1, 1, 1)
+            fig_plot.axis('off')
+            fig_plot.axis([0, 0.5, 0, 0.2])
+            count_file +=1
+            counter = 0
+        processed_streets_count = counter + (count_file * 10000)
+        if processed_streets_count == street_total:
+            fig.savefig( (os.path.join('./images/','street-layer_%s_%s.png' % (time_now, count_file))),
+                            dpi = dpi, transparent = False )   # bbox_inches='tight'
+            plt.close()
+            break
+    merge_plots(time_now, count_file)
+    print("Saving street image to file 'Streets_%s.png'..." % time_now)
+    for k in range(count_file + 1):
+        current_file = os.path.join('./images/','street-layer_%s_%s.png' % (time_now, k))
+        if os.path.exists(current_file):
+            os.remove(current_file)
+    print('Done.')
+    return os.path.join('./images/', 'Streets_%s.png' % time_now)
+
+def merge_plots(time_now, count_file):
+    # open images
+    src0 = Image.open(os.path.join('./images/','street-layer_%s_%s.png' % (time_now, count_file)))
+    for k in range(count_file):
+        src1 = Image.open(os.path.join('./images/','street-layer_%s_%s.png' % (time_now, k)))
+        src0.paste(src1, (0, 0), src1)
+    src0.save(os.path.join('./images/', 'Streets_%s.png' % time_now))
+
+def benchmark_plot(street_counts = (1000, 10000, 50000), dpi = 200, layered = True):
+    '''
+    Compare the single-pass renderer (Streets.plot) with the previous layered matplotlib plot (plot_layers)
+    for synthetic street sets of the given sizes. The images are written to a temporary directory.
+    Returns a list of (street_count, seconds single-pass, seconds layered).
+    '''
+    results = []
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp()
+    try:
+        os.chdir(work_dir)
+        for street_count in street_counts:
+            new_streets = Streets(*synthetic_streets(street_count), add_length = False)
+            single_pass = _timed(new_streets.plot, dpi = dpi)
+            layers = _timed(plot_layers, new_streets, dpi = dpi) if layered else float('nan')
+            results.append( (street_count, single_pass, layers) )
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+    print('\n%10s %14s %14s %10s' % ('streets', 'single-pass s', 'layered s', 'speedup'))
+    for (street_count, single_pass, layers) in results:
+        print('%10d %14.3f %14.3f %9.1fx' % (street_count, single_pass, layers, layers / single_pass))
+    return results
+
+def benchmark_parse(FILE, engines = ENGINES, max_size = 1000000):
+    '''
+    Parse the xml file **FILE** serially with each of the parse **engines** (only the extraction, without storing the data)
+    and print the number of parsed elements per second.
+    Returns a list of (engine, element count, seconds).
+    '''
+    results = []
+    for engine in engines:
+        start = time.time()
+        with open(FILE, 'r') as read_file:
+            element_count = sum(1 for element in _ENGINE_READERS[engine](read_file, max_size))
+        results.append( (engine, element_count, time.time() - start) )
+    print('\n%10s %12s %10s %14s' % ('engine', 'elements', 'seconds', 'elements/s'))
+    for (engine, element_count, seconds) in results:
+        print('%10s %12d %10.3f %14.0f' % (engine, element_count, seconds, element_count / seconds))
+    return results
+
+def _run_stages(FILE, work_dir, dpi):
+    # run all stages once on the xml file FILE, their output goes to work_dir, returns {stage: seconds}
+    seconds = {}
+    def stage(name, function, *args, **kwargs):
+        start = time.time()
+        result = function(*args, **kwargs)
+        seconds[name] = time.time() - start
+        return result
+    os.mkdir(work_dir)
+    dicts = stage('parse', collect_data, FILE, csv_output = False)
+    csv_dir = os.path.join(work_dir, 'csv')
+    stage('csv write', Dataset.write_csv, csv_dir, *dicts)
+    new_data = stage('csv load', Data, csv_dir = csv_dir)
+    new_streets = stage('Streets', Streets, *new_data.get_streets())
+    stage('analyze_street_lengths', lambda: [new_streets.analyze_street_lengths(stat) for stat in ['min', 'max', 'median', 'average']])
+    stage('get_oneway_quota', new_streets.get_oneway_quota)
+    bounds, areas, area_nodes, area_lats, area_lons = new_data.get_areas()
+    new_postals = stage('PostalAreas', PostalAreas, bounds, areas, area_nodes, area_lats, area_lons, new_data.get_cameras())
+    stage('get_camera_counts', new_postals.get_camera_counts)
+    stage('plot', new_streets.plot, dpi = dpi)
+    return seconds
+
+def benchmark_stages(tiers = ('small', 'medium'), out_file = None, repeat = 3, dpi = 100, street_types = None, seed = 0, reference = None):
+    '''
+    Time every stage (see STAGES) from parsing a synthetic xml extract (see write_synthetic_osm) to plotting its streets
+    for each of the size **tiers** (names of SIZE_TIERS or dicts of arguments of write_synthetic_osm). Each tier is run
+    **repeat** times and the fastest time of each stage is kept. The results are written as json to **out_file**
+    (default benchmark_<time>.json) and compared to the ones of a previous run, if a **reference** json file is given.
+    Returns the results {'tiers': {tier: {'config': .., 'stages': {stage: seconds}}}, ...}.
+    '''
+    results = {'created': time.strftime('%d.%m.%Y %H:%M:%S'), 'python': platform.python_version(), 'numpy': np.__version__,
+               'pandas': pd.__version__, 'machine': platform.platform(), 'repeat': repeat, 'tiers': {}}
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp()
+    try:
+        os.chdir(work_dir)
+        for tier in tiers:
+            # dicts are unhashable, so check for custom tiers before looking up a name
+            tier_config = dict(tier) if isinstance(tier, dict) else dict(SIZE_TIERS[tier])
+            name = 'custom_%s' % tier_config.get('node_count') if isinstance(tier, dict) else tier
+            print('\nBenchmarking tier %s (%s)...' % (name, ', '.join('%s = %s' % item for item in sorted(tier_config.items()))))
+            config = dict(tier_config, street_types = street_types or STREET_TYPE_WEIGHTS, seed = seed)
+            xml_file = os.path.join(work_dir, 'synthetic.xml')
+            write_synthetic_osm(xml_file, **config)
+            runs = []
+            for k in range(repeat):
+                # the stages print their results, only the timings are of interest here
+                with contextlib.redirect_stdout(io.StringIO()):
+                    runs.append(_run_stages(xml_file, os.path.join(work_dir, '%s_%s' % (name, k)), dpi))
+            results['tiers'][name] = {'config': config, 'file_bytes': os.path.getsize(xml_file),
+                                      'stages': {stage: min(run[stage] for run in runs) for stage in STAGES}}
+            for stage in STAGES:
+                print('%24s %10.3f s' % (stage, results['tiers'][name]['stages'][stage]))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+    out_file = out_file or 'benchmark_%s.json' % time.strftime('%d.%m.%Y_%H.%M.%S')
+    with open(out_file, 'w') as write_file:
+        json.dump(results, write_file, indent = 2)
+    print('\nWritten results to %s' % out_file)
+    if reference:
+        compare_benchmarks(reference, results)
+    return results
+
+def compare_benchmarks(reference, results, threshold = REGRESSION_THRESHOLD):
+    '''
+    Compare the stage timings of two runs of benchmark_stages (results dicts or their json files), **results** against
+    the **reference**, and flag every stage that takes more than **threshold** (relative) longer.
+    Returns the list of regressions (tier, stage, reference seconds, seconds).
+    '''
+    runs = []
+    for run in [reference, results]:
+        if not isinstance(run, dict):
+            with open(run, 'r') as read_file:
+                run = json.load(read_file)
+        runs.append(run)
+    reference, results = runs
+    regressions = []
+    print('\n%10s %24s %12s %12s %8s' % ('tier', 'stage', 'reference s', 'seconds', 'ratio'))
+    for tier in results['tiers']:
+        if tier not in reference['tiers']:
+            continue
+        if reference['tiers'][tier]['config'] != results['tiers'][tier]['config']:
+            print('%10s: other configuration than in the reference run, skipped.' % tier)
+            continue
+        for stage, seconds in results['tiers'][tier]['stages'].items():
+            old_seconds = reference['tiers'][tier]['stages'].get(stage)
+            if old_seconds is None:
+                continue
+            ratio = seconds / old_seconds if old_seconds > 0 else float('inf')
+            flag = ''
+            if ratio > 1 + threshold and max(seconds, old_seconds) >= MIN_SECONDS:
+                flag = 'REGRESSION'
+                regressions.append( (tier, stage, old_seconds, seconds) )
+            print('%10s %24s %12.3f %12.3f %7.2fx %s' % (tier, stage, old_seconds, seconds, ratio, flag))
+    print('\n%s regression(s) found.' % len(regressions))
+    return regressions
+
+#############################################################################################################################
+
+if __name__== '__main__':
+
+    # python Benchmark.py parse <xml file> resp. python Benchmark.py [street counts of the plot benchmark]
+    # python Benchmark.py stages [tiers] [--compare reference.json] resp. python Benchmark.py compare reference.json results.json
+    if sys.argv[1:2] == ['parse']:
+        benchmark_parse(sys.argv[2] if len(sys.argv) > 2 else 'map.xml')
+    elif sys.argv[1:2] == ['stages']:
+        arguments = sys.argv[2:]
+        reference = None
+        if '--compare' in arguments:
+            reference = arguments[arguments.index('--compare') + 1]
+            arguments = arguments[:arguments.index('--compare')] + arguments[arguments.index('--compare') + 2:]
+        benchmark_stages(arguments or ['small', 'medium'], reference = reference)
+    elif sys.argv[1:2] == ['compare']:
+        compare_benchmarks(sys.argv[2], sys.argv[3])
+    else:
+        counts = [int(count) for count in sys.argv[1:]] or [1000, 10000, 50000]
+        benchmark_plot(counts)
@@ -1,16 +1,21 @@
 import parseXML_singleRun as parser
+import Dataset
+import Profiler
 import csv
 import os.path
 
 class Data(object):
 
-    def __init__(self, xml = None, csv_dir = None, max_size = 1000000):
+    def __init__(self, xml = None, csv_dir = None, max_size = 1000000, npy_dir = None):
         # xml: path to .xml file
         # csv: path to csv directory
-        assert(not (xml and csv_dir))
+        # npy_dir: path to a binary dataset directory (written by parseXML with --npy_output), its arrays are memory-mapped
+        assert(sum(map(bool, [xml, csv_dir, npy_dir])) == 1)
+        self.dataset = None
         if xml:
-            self.bounds, self.cameras, self.street_nodes, self.streets, self.areas, self.area_lats, self.area_lons = parser.collect_data(xml, max_size)
-        if csv:
+            (self.bounds, self.cameras, self.street_nodes, self.streets, self.areas, self.area_nodes,
+                self.area_lats, self.area_lons) = parser.collect_data(xml, csv_output = False, max_size = max_size)
+        if csv_dir:
             assert(os.path.isdir(csv_dir))
             self.bounds = {}
             self.cameras = {}
@@ -22,7 +27,26 @@ class Data(object):
             self.area_lons = {}
             csv_files = ['bounds.csv', 'cameras.csv', 'street_nodes.csv', 'streets.csv', 'areas.csv', 'area_nodes.csv', 'area_lats.csv', 'area_lons.csv']
             for csv_type in csv_files:
-                self.load_csv(csv_dir, csv_type)
+                # a csv directory may contain only the files needed for streets resp. postal areas
+                if not os.path.isfile(os.path.join(csv_dir, csv_type)):
+                    print('No file %s in %s, skipped.' % (csv_type, csv_dir))
+                    continue
+                with Profiler.stage('csv load') as current:
+                    self.load_csv(csv_dir, csv_type)
+                    current.items = len(getattr(self, csv_type[:-len('.csv')]))
+        if npy_dir:
+            # the dict attributes are only built on demand, Streets and PostalAreas can use the arrays of the dataset directly
+            self.dataset = Dataset.Dataset(npy_dir)
+            self._dicts = None
+
+    def __getattr__(self, name):
+        # build the dicts of a binary dataset when they are accessed the first time
+        dict_names = ['bounds', 'cameras', 'street_nodes', 'streets', 'areas', 'area_nodes', 'area_lats', 'area_lons']
+        if name in dict_names and self.__dict__.get('dataset') is not None:
+            if self._dicts is None:
+                self._dicts = dict(zip(dict_names, self.dataset.to_dicts()))
+            return self._dicts[name]
+        raise AttributeError(name)
 
     def get_cameras(self):
         return self.cameras
@@ -34,6 +58,24 @@ class Data(object):
     def get_areas(self):
         return self.bounds, self.areas, self.area_nodes, self.area_lats, self.area_lons
 
+    def get_dicts(self):
+        return self.bounds, self.cameras, self.street_nodes, self.streets, self.areas, self.area_nodes, self.area_lats, self.area_lons
+
+    def write_npy(self, npy_dir):
+        # write all data as binary columnar dataset
+        return Dataset.write_dataset(npy_dir, *self.get_dicts())
+
+    def write_sqlite(self, db_file):
+        # write all data to a sqlite database
+        from Database import write_database
+        if self.dataset is not None:
+            return write_database(db_file, self.dataset.get_arrays(), self.dataset.street_type_names)
+        return write_database(db_file, *Dataset.build_arrays(*self.get_dicts()))
+
+    def write_csv(self, csv_dir):
+        # export all data to csv files
+        return Dataset.write_csv(csv_dir, *self.get_dicts())
+
     def load_csv(self, csv_dir, csv_type):
         csv_file = os.path.join(csv_dir, csv_type)
         with open(csv_file, 'r') as read_file:
@@ -53,14 +95,14 @@ class Data(object):
                     self.areas[line[0]] = line[1:]
                 if csv_type == 'area_nodes.csv':
                     self.area_nodes[line[0]] = line[1:]
+                # one line per ring of an area
                 if csv_type == 'area_lats.csv':
-                    self.area_lats[line[0]] = line[1:]
+                    self.area_lats.setdefault(line[0], []).append(line[1:])
                 if csv_type == 'area_lons.csv':
-                    self.area_lons[line[0]] = line[1:]
+                    self.area_lons.setdefault(line[0], []).append(line[1:])
 
 ##########################################################################################
 
 if __name__== '__main__':
 
     testData = Data(csv_dir='./csv/')
-    _
\ No newline at end of file
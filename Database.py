@@ -0,0 +1,257 @@
+import os
+import json
+import sqlite3
+import numpy as np
+from Dataset import FORMAT_VERSION, decode_strings, resolve_polylines
+
+# normalized tables of a database, the r*tree tables index the bounding boxes of streets and postal areas and the camera positions
+SCHEMA = ['CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)',
+          'CREATE TABLE street_types (id INTEGER PRIMARY KEY, name TEXT UNIQUE)',
+          'CREATE TABLE streets (id INTEGER PRIMARY KEY, type_id INTEGER REFERENCES street_types(id), oneway INTEGER, '
+          'postal_code TEXT, name TEXT, length REAL)',
+          'CREATE TABLE nodes (id INTEGER PRIMARY KEY, lat REAL, lon REAL)',
+          'CREATE TABLE street_nodes (street_id INTEGER, seq INTEGER, node_id INTEGER, PRIMARY KEY (street_id, seq)) WITHOUT ROWID',
+          'CREATE TABLE cameras (id INTEGER PRIMARY KEY, lat REAL, lon REAL)',
+          'CREATE TABLE postal_areas (id INTEGER PRIMARY KEY, postal_code TEXT UNIQUE)',
+          'CREATE TABLE area_ways (area_id INTEGER, seq INTEGER, way_id INTEGER, PRIMARY KEY (area_id, seq)) WITHOUT ROWID',
+          'CREATE TABLE area_rings (area_id INTEGER, seq INTEGER, hole INTEGER, PRIMARY KEY (area_id, seq)) WITHOUT ROWID',
+          'CREATE TABLE ring_points (area_id INTEGER, ring INTEGER, seq INTEGER, lat REAL, lon REAL, PRIMARY KEY (area_id, ring, seq)) WITHOUT ROWID',
+          'CREATE TABLE camera_areas (camera_id INTEGER, area_id INTEGER, PRIMARY KEY (area_id, camera_id)) WITHOUT ROWID',
+          'CREATE VIRTUAL TABLE street_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)',
+          'CREATE VIRTUAL TABLE area_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)',
+          'CREATE VIRTUAL TABLE camera_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)']
+# indices are created after the bulk insert
+INDICES = ['CREATE INDEX streets_type ON streets (type_id)']
+
+def write_database(db_file, arrays, street_types):
+    '''
+    Write the arrays of a dataset (see Dataset.build_arrays) to the SQLite database **db_file** (an existing file is replaced).
+    All rows are inserted in one transaction with executemany, the indices are created afterwards.
+    The r*tree tables get the bounding boxes of all streets (of their nodes with coordinates) and postal area rings.
+    '''
+    if os.path.isfile(db_file):
+        os.remove(db_file)
+    connection = sqlite3.connect(db_file)
+    try:
+        # the database is written from scratch, so a failed load is simply repeated
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.executemany('INSERT INTO meta VALUES (?, ?)',
+                                   [('version', str(FORMAT_VERSION)), ('bounds', json.dumps(np.asarray(arrays['bounds']).tolist()))])
+            connection.executemany('INSERT INTO street_types VALUES (?, ?)', enumerate(street_types))
+
+            # streets, their node lists and the coordinates of the street nodes
+            street_ids = np.asarray(arrays['street_ids'], dtype = np.int64)
+            connection.executemany('INSERT INTO streets VALUES (?, ?, ?, ?, ?, ?)',
+                                   zip(street_ids.tolist(), np.asarray(arrays['street_types']).tolist(), np.asarray(arrays['street_oneway']).tolist(),
+                                       decode_strings(arrays['street_postal_data'], arrays['street_postal_offsets']),
+                                       decode_strings(arrays['street_name_data'], arrays['street_name_offsets']),
+                                       np.asarray(arrays['street_lengths']).tolist()))
+            offsets = np.asarray(arrays['street_node_offsets'], dtype = np.int64)
+            connection.executemany('INSERT INTO street_nodes VALUES (?, ?, ?)',
+                                   zip(*_list_rows(offsets, street_ids), np.asarray(arrays['street_node_ids']).tolist()))
+            connection.executemany('INSERT INTO nodes VALUES (?, ?, ?)', _coordinate_rows(arrays['node_ids'], arrays['node_lats'], arrays['node_lons']))
+            offsets, point_ids, lats, lons = resolve_polylines(offsets, arrays['street_node_ids'], arrays['node_ids'], arrays['node_lats'], arrays['node_lons'])
+            connection.executemany('INSERT INTO street_rtree VALUES (?, ?, ?, ?, ?)', _box_rows(street_ids, offsets, lats, lons))
+
+            # cameras
+            connection.executemany('INSERT INTO cameras VALUES (?, ?, ?)', _coordinate_rows(arrays['camera_ids'], arrays['camera_lats'], arrays['camera_lons']))
+            connection.executemany('INSERT INTO camera_rtree VALUES (?, ?, ?, ?, ?)',
+                                   _coordinate_rows(arrays['camera_ids'], arrays['camera_lats'], arrays['camera_lats'], arrays['camera_lons'], arrays['camera_lons']))
+
+            # postal areas, their ways, rings, bounding boxes and cameras
+            postal_codes = decode_strings(arrays['area_code_data'], arrays['area_code_offsets'])
+            area_ids = np.arange(len(postal_codes), dtype = np.int64)
+            connection.executemany('INSERT INTO postal_areas VALUES (?, ?)', enumerate(postal_codes))
+            connection.executemany('INSERT INTO area_ways VALUES (?, ?, ?)',
+                                   zip(*_list_rows(arrays['area_way_offsets'], area_ids), np.asarray(arrays['area_way_ids']).tolist()))
+            ring_areas, ring_seqs = _list_rows(arrays['area_ring_offsets'], area_ids)
+            connection.executemany('INSERT INTO area_rings VALUES (?, ?, ?)', zip(ring_areas, ring_seqs, np.asarray(arrays['area_ring_holes']).tolist()))
+            point_rings, point_seqs = _list_rows(arrays['area_point_offsets'], np.arange(len(ring_areas), dtype = np.int64))
+            connection.executemany('INSERT INTO ring_points VALUES (?, ?, ?, ?, ?)',
+                                   zip(np.array(ring_areas, dtype = np.int64)[point_rings].tolist(), np.array(ring_seqs, dtype = np.int64)[point_rings].tolist(),
+                                       point_seqs, np.asarray(arrays['area_ring_lats']).tolist(), np.asarray(arrays['area_ring_lons']).tolist()))
+            connection.executemany('INSERT INTO area_rtree VALUES (?, ?, ?, ?, ?)',
+                                   _box_rows(area_ids, np.asarray(arrays['area_point_offsets'])[np.asarray(arrays['area_ring_offsets'])],
+                                             arrays['area_ring_lats'], arrays['area_ring_lons']))
+            connection.executemany('INSERT INTO camera_areas VALUES (?, ?)',
+                                   zip(np.asarray(arrays['camera_area_ids']).tolist(), np.asarray(arrays['camera_area_idx']).tolist()))
+            for statement in INDICES:
+                connection.execute(statement)
+    finally:
+        connection.close()
+    return db_file
+
+def is_database(path):
+    # sqlite database files start with this header
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as read_file:
+        return read_file.read(16) == b'SQLite format 3\x00'
+
+def _list_rows(offsets, owner_ids):
+    # owner id and position in its list of all values of flat lists
+    offsets = np.asarray(offsets, dtype = np.int64)
+    counts = np.diff(offsets)
+    owners = np.repeat(np.asarray(owner_ids, dtype = np.int64), counts)
+    positions = np.arange(offsets[-1] - offsets[0], dtype = np.int64) - np.repeat(offsets[:-1] - offsets[0], counts)
+    return owners.tolist(), positions.tolist()
+
+def _coordinate_rows(ids, *columns):
+    return zip(np.asarray(ids).tolist(), *[np.asarray(column, dtype = np.float64).tolist() for column in columns])
+
+def _box_rows(ids, offsets, lats, lons):
+    # (id, min_lat, max_lat, min_lon, max_lon) of all non-empty polylines
+    offsets = np.asarray(offsets, dtype = np.int64)
+    non_empty = offsets[1:] > offsets[:-1]
+    if not non_empty.any():
+        return []
+    starts = offsets[:-1][non_empty]
+    lats, lons = np.asarray(lats, dtype = np.float64), np.asarray(lons, dtype = np.float64)
+    return _coordinate_rows(np.asarray(ids)[non_empty], np.fmin.reduceat(lats, starts), np.fmax.reduceat(lats, starts),
+                            np.fmin.reduceat(lons, starts), np.fmax.reduceat(lons, starts))
+
+class Database(object):
+    '''
+    SQLite database written by write_database. Streets and postal areas can be queried by bounding box (through the r*tree
+    tables) and by street type resp. postal code, so only the selected part of the data is loaded.
+    A bbox is given as (minlat, minlon, maxlat, maxlon), streets and areas are selected if their bounding box intersects it.
+    '''
+
+    def __init__(self, db_file):
+        assert(is_database(db_file)), 'No database file: %s' % db_file
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file)
+        meta = dict(self.connection.execute('SELECT key, value FROM meta'))
+        self.bounds = json.loads(meta['bounds'])
+        self.street_type_names = [name for (name,) in self.connection.execute('SELECT name FROM street_types ORDER BY id')]
+
+    def close(self):
+        self.connection.close()
+
+    def get_bounds(self):
+        return dict(zip(['minlat', 'minlon', 'maxlat', 'maxlon'], self.bounds))
+
+    def _select(self, sql, conditions, params, order = None):
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        if order:
+            sql += ' ORDER BY ' + order
+        return self.connection.execute(sql, params)
+
+    def _bbox_condition(self, rtree, bbox, conditions, params):
+        # r*tree entries that intersect the bbox
+        minlat, minlon, maxlat, maxlon = bbox
+        conditions += ['%s.max_lat >= ?' % rtree, '%s.min_lat <= ?' % rtree, '%s.max_lon >= ?' % rtree, '%s.min_lon <= ?' % rtree]
+        params += [minlat, maxlat, minlon, maxlon]
+
+    def query_streets(self, bbox = None, street_types = None):
+        '''
+        Return the streets in the **bbox** (all if None) of the given **street_types** (all if None) as dict of lists resp. arrays:
+        ids, types, oneway, postal_codes, names, lengths (haversine), node_offsets and node_ids (the node lists of the streets)
+        and lats, lons (coordinates of the nodes, nan if unknown).
+        '''
+        sql = 'SELECT s.id, t.name, s.oneway, s.postal_code, s.name, s.length FROM streets s JOIN street_types t ON t.id = s.type_id'
+        conditions, params = [], []
+        if bbox is not None:
+            sql += ' JOIN street_rtree r ON r.id = s.id'
+            self._bbox_condition('r', bbox, conditions, params)
+        if street_types:
+            conditions.append('t.name IN (%s)' % ', '.join('?' * len(street_types)))
+            params += list(street_types)
+        rows = self._select(sql, conditions, params, order = 's.id').fetchall()
+        streets = dict(zip(['ids', 'types', 'oneway', 'postal_codes', 'names', 'lengths'], [list(column) for column in zip(*rows)] or [[]] * 6))
+        # the node lists of the selected streets, with the coordinates of the nodes
+        self.connection.execute('CREATE TEMP TABLE selection (id INTEGER PRIMARY KEY)')
+        try:
+            self.connection.executemany('INSERT INTO selection VALUES (?)', ((street_id,) for street_id in streets['ids']))
+            points = self.connection.execute('SELECT sn.street_id, sn.node_id, n.lat, n.lon FROM selection x JOIN street_nodes sn ON sn.street_id = x.id '
+                                             'LEFT JOIN nodes n ON n.id = sn.node_id ORDER BY sn.street_id, sn.seq').fetchall()
+        finally:
+            self.connection.execute('DROP TABLE selection')
+        point_streets, node_ids, lats, lons = [list(column) for column in zip(*points)] or [[]] * 4
+        # the points are sorted by street id like the selected streets
+        streets['node_offsets'] = np.append(np.searchsorted(np.array(point_streets, dtype = np.int64), np.array(streets['ids'], dtype = np.int64)),
+                                            len(point_streets)).astype(np.int64)
+        streets['node_ids'] = np.array(node_ids, dtype = np.int64)
+        streets['lats'] = np.array(lats, dtype = np.float64)
+        streets['lons'] = np.array(lons, dtype = np.float64)
+        return streets
+
+    def query_areas(self, bbox = None, postal_codes = None):
+        '''
+        Return the postal areas in the **bbox** (all if None) with the given **postal_codes** (all if None) as dict:
+        postal_codes, ways (lists of lists), lats and lons (lists of the rings of each area), holes (lists of the hole flags of the rings), cams_to_areas
+        {..., postal_code: [camera_id, ..], ...} and cameras (ids, lats, lons) in the bounding box of all selected areas.
+        '''
+        sql = 'SELECT a.id, a.postal_code FROM postal_areas a'
+        conditions, params = [], []
+        if bbox is not None:
+            sql += ' JOIN area_rtree r ON r.id = a.id'
+            self._bbox_condition('r', bbox, conditions, params)
+        if postal_codes:
+            conditions.append('a.postal_code IN (%s)' % ', '.join('?' * len(postal_codes)))
+            params += list(postal_codes)
+        rows = self._select(sql, conditions, params, order = 'a.id').fetchall()
+        area_ids = np.array([area_id for (area_id, code) in rows], dtype = np.int64)
+        # the ways, rings, ring points and cameras of all selected areas in one query, the first column tells them apart
+        self.connection.execute('CREATE TEMP TABLE selection (id INTEGER PRIMARY KEY)')
+        try:
+            self.connection.executemany('INSERT INTO selection VALUES (?)', ((area_id,) for area_id in area_ids.tolist()))
+            # CROSS JOIN keeps the selection as outer loop, so only the rows of the selected areas are read through the primary keys
+            parts = self.connection.execute('SELECT 0, w.area_id, w.seq, w.way_id, NULL, NULL FROM selection x CROSS JOIN area_ways w ON w.area_id = x.id '
+                                            'UNION ALL SELECT 1, r.area_id, r.seq, r.hole, NULL, NULL FROM selection x CROSS JOIN area_rings r ON r.area_id = x.id '
+                                            'UNION ALL SELECT 2, p.area_id, p.ring, p.seq, p.lat, p.lon FROM selection x CROSS JOIN ring_points p ON p.area_id = x.id '
+                                            'UNION ALL SELECT 3, c.area_id, c.camera_id, 0, NULL, NULL FROM selection x CROSS JOIN camera_areas c ON c.area_id = x.id').fetchall()
+        finally:
+            self.connection.execute('DROP TABLE selection')
+        kinds, owners, keys, values, lats, lons = [np.array(column, dtype = dtype) for (column, dtype) in
+                                                   zip(list(zip(*parts)) or [[]] * 6, [np.int64] * 4 + [np.float64] * 2)]
+        # sort the rows by kind, area and position, then the rows of each kind are split at the bounds of the selected areas
+        order = np.lexsort((values, keys, owners, kinds))
+        kinds, owners, keys, values, lats, lons = kinds[order], owners[order], keys[order], values[order], lats[order], lons[order]
+        kind_bounds = np.searchsorted(kinds, np.arange(5))
+
+        def split(kind, column):
+            start, end = kind_bounds[kind], kind_bounds[kind + 1]
+            bounds = np.append(np.searchsorted(owners[start:end], area_ids), end - start).tolist()
+            values = column[start:end].tolist()
+            return [values[bounds[k]:bounds[k+1]] for k in range(len(area_ids))]
+
+        areas = {'postal_codes': [code for (area_id, code) in rows]}
+        areas['ways'] = [[str(way_id) for way_id in ways] for ways in split(0, values)]
+        areas['holes'] = [[bool(hole) for hole in holes] for holes in split(1, values)]
+        # ring points: a new ring starts where the area or the ring number changes
+        start, end = kind_bounds[2], kind_bounds[3]
+        is_first = np.ones(end - start, dtype = bool)
+        is_first[1:] = (owners[start+1:end] != owners[start:end-1]) | (keys[start+1:end] != keys[start:end-1])
+        ring_starts = np.flatnonzero(is_first)
+        ring_bounds = np.append(ring_starts, end - start).tolist()
+        ring_areas = owners[start:end][ring_starts]
+        area_bounds = np.append(np.searchsorted(ring_areas, area_ids), len(ring_starts)).tolist()
+        for (name, coordinates) in [('lats', lats[start:end].tolist()), ('lons', lons[start:end].tolist())]:
+            rings = [coordinates[ring_bounds[r]:ring_bounds[r+1]] for r in range(len(ring_starts))]
+            areas[name] = [rings[area_bounds[k]:area_bounds[k+1]] for k in range(len(area_ids))]
+        areas['cams_to_areas'] = {postal_code: [str(camera_id) for camera_id in cameras] for (postal_code, cameras) in zip(areas['postal_codes'], split(3, keys))}
+        # cameras in the box around all selected areas
+        if end > start:
+            camera_box = (lats[start:end].min(), lons[start:end].min(), lats[start:end].max(), lons[start:end].max())
+            areas['cameras'] = self.query_cameras(camera_box)
+        else:
+            areas['cameras'] = [[]] * 3
+        return areas
+
+    def query_cameras(self, bbox = None):
+        '''
+        Return the cameras in the **bbox** (all if None) as lists (ids, lats, lons), sorted by id.
+        '''
+        sql = 'SELECT c.id, c.lat, c.lon FROM cameras c'
+        conditions, params = [], []
+        if bbox is not None:
+            sql += ' JOIN camera_rtree r ON r.id = c.id'
+            self._bbox_condition('r', bbox, conditions, params)
+        cameras = self._select(sql, conditions, params).fetchall()
+        return [list(column) for column in zip(*sorted(cameras))] or [[]] * 3
@@ -0,0 +1,296 @@
+import os
+import csv
+import json
+import itertools
+import numpy as np
+from Geometry import polyline_lengths, take_polylines
+from SpatialIndex import PolygonSet, spatial_join
+from Rings import ring_holes
+
+FORMAT_VERSION = 2
+
+# all arrays of a dataset directory, each one is saved to a file <name>.npy
+ARRAYS = ['bounds',
+          'camera_ids', 'camera_lats', 'camera_lons',
+          'node_ids', 'node_lats', 'node_lons',
+          'street_ids', 'street_types', 'street_oneway', 'street_postal_data', 'street_postal_offsets',
+          'street_name_data', 'street_name_offsets', 'street_node_offsets', 'street_node_ids',
+          'area_code_data', 'area_code_offsets', 'area_relation_ids', 'area_way_offsets', 'area_way_ids',
+          'area_ring_offsets', 'area_point_offsets', 'area_ring_holes', 'area_ring_lats', 'area_ring_lons',
+          'area_node_ids', 'area_node_lats', 'area_node_lons',
+          'area_way_node_offsets', 'area_way_node_ids',
+          'street_lengths', 'camera_area_ids', 'camera_area_idx',
+          'all_node_ids', 'all_node_lats', 'all_node_lons']
+
+def write_dataset(out_dir, bounds, cameras, street_nodes, streets, postal_areas, area_nodes, area_lats, area_lons,
+                  area_way_nodes = None, nodes = None, area_relations = None):
+
+    '''
+    Write the data returned by collect_data (resp. loaded by Data) as binary columnar dataset to the directory **out_dir**.
+    Every column is saved as NumPy array to its own .npy file, so it can be memory-mapped when loading.
+    Variable-length lists (nodes of a street, ways and ring coordinates of an area) are stored CSR-like
+    as one flat array plus an offsets array, strings as utf-8 data plus offsets. The rings of the areas are stored with two levels
+    of offsets: area k has the rings area_ring_offsets[k] to area_ring_offsets[k+1]-1, ring r the points area_point_offsets[r]
+    to area_point_offsets[r+1]-1 of area_ring_lats/ area_ring_lons, area_ring_holes flags the rings that are holes.
+    **area_way_nodes** = {..., way_id: [node1, node2, ..], ...} gives the nodes of the area ways (may contain other ways too),
+    without it the rings of the areas cannot be updated by Update.apply_changes.
+    **nodes** is the finalized NodeStore (with fixed point coordinates) of all parsed nodes, without it new streets and areas
+    of an update can only use the nodes stored as street nodes, area nodes or cameras.
+    **area_relations** = {..., postal_code: relation_id, ...} gives the relations of the postal areas, by which Update.apply_changes
+    identifies changed areas (areas without a known relation are stored with relation id 0 and identified by their postal code).
+    The street lengths (haversine) and the assignment of cameras to postal areas are computed and stored as well.
+    '''
+    arrays, street_types = build_arrays(bounds, cameras, street_nodes, streets, postal_areas, area_nodes, area_lats, area_lons,
+                                        area_way_nodes, nodes, area_relations)
+    return write_arrays(out_dir, arrays, street_types, area_way_nodes = bool(area_way_nodes), all_nodes = nodes is not None)
+
+def build_arrays(bounds, cameras, street_nodes, streets, postal_areas, area_nodes, area_lats, area_lons,
+                 area_way_nodes = None, nodes = None, area_relations = None):
+    '''
+    Convert the data in the dict layout of collect_data to the arrays of a dataset (see write_dataset).
+    Returns the dict of all arrays and the names of the street type codes.
+    '''
+    arrays = {}
+    arrays['bounds'] = np.array([bounds[key] for key in ['minlat', 'minlon', 'maxlat', 'maxlon']], dtype = np.float64)
+    arrays['camera_ids'], arrays['camera_lats'], arrays['camera_lons'] = _coordinate_columns(cameras)
+    arrays['node_ids'], arrays['node_lats'], arrays['node_lons'] = _coordinate_columns(street_nodes)
+    arrays['area_node_ids'], arrays['area_node_lats'], arrays['area_node_lons'] = _coordinate_columns(area_nodes)
+
+    # streets: info columns and the street nodes as flat array with offsets
+    street_ids = list(streets.keys())
+    street_types = sorted(set(str(streets[street_id][0]) for street_id in street_ids))
+    type_codes = {street_type: code for (code, street_type) in enumerate(street_types)}
+    arrays['street_ids'] = np.array(street_ids, dtype = np.int64)
+    arrays['street_types'] = np.array([type_codes[str(streets[street_id][0])] for street_id in street_ids], dtype = np.int16)
+    arrays['street_oneway'] = np.array([int(streets[street_id][1] or 0) for street_id in street_ids], dtype = np.int8)
+    arrays['street_postal_data'], arrays['street_postal_offsets'] = string_table(streets[street_id][2] for street_id in street_ids)
+    arrays['street_name_data'], arrays['street_name_offsets'] = string_table(streets[street_id][3] for street_id in street_ids)
+    arrays['street_node_offsets'], arrays['street_node_ids'] = flat_lists([streets[street_id][4:] for street_id in street_ids], np.int64)
+
+    # postal areas: codes, their relations, their ways and their ring coordinates
+    postal_codes = list(postal_areas.keys())
+    arrays['area_code_data'], arrays['area_code_offsets'] = string_table(postal_codes)
+    area_relations = area_relations or {}
+    arrays['area_relation_ids'] = np.array([area_relations.get(code, 0) for code in postal_codes], dtype = np.int64)
+    arrays['area_way_offsets'], arrays['area_way_ids'] = flat_lists([postal_areas[code] for code in postal_codes], np.int64)
+    arrays.update(ring_arrays([area_lats.get(code, []) for code in postal_codes], [area_lons.get(code, []) for code in postal_codes]))
+    area_way_nodes = area_way_nodes or {}
+    arrays['area_way_node_offsets'], arrays['area_way_node_ids'] = flat_lists([area_way_nodes.get(str(way_id), [])
+                                                                                for way_id in arrays['area_way_ids'].tolist()], np.int64)
+    if nodes is not None:
+        nodes.finalize()
+        arrays['all_node_ids'], arrays['all_node_lats'], arrays['all_node_lons'] = nodes.ids, nodes.lats, nodes.lons
+    else:
+        arrays['all_node_ids'] = np.empty(0, dtype = np.int64)
+        arrays['all_node_lats'] = arrays['all_node_lons'] = np.empty(0, dtype = np.int32)
+    add_derived_arrays(arrays)
+    return arrays, street_types
+
+def write_arrays(out_dir, arrays, street_types, area_way_nodes = True, all_nodes = True):
+    '''
+    Save the dict of all **arrays** of a dataset and its meta data to the directory **out_dir**.
+    street_types are the names of the codes in street_types, area_way_nodes and all_nodes tell whether the node lists
+    of the area ways resp. the coordinates of all nodes are stored.
+    '''
+    if not os.path.isdir(out_dir):
+        os.mkdir(out_dir)
+    for name in ARRAYS:
+        np.save(os.path.join(out_dir, name + '.npy'), arrays[name])
+    meta = {'version': FORMAT_VERSION,
+            'street_types': list(street_types),
+            'area_way_nodes': area_way_nodes,
+            'all_nodes': all_nodes,
+            'counts': {'cameras': len(arrays['camera_ids']), 'street_nodes': len(arrays['node_ids']), 'streets': len(arrays['street_ids']),
+                       'postal_areas': len(arrays['area_code_offsets']) - 1, 'area_nodes': len(arrays['area_node_ids'])}}
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file, indent = 1)
+    return out_dir
+
+def resolve_polylines(offsets, point_ids, node_ids, node_lats, node_lons):
+    '''
+    Resolve the coordinates of the nodes of many polylines (point_ids with offsets) at once, node_ids must be sorted.
+    Nodes without coordinates are left out. Returns (new_offsets, found_point_ids, lats, lons).
+    '''
+    node_ids = np.asarray(node_ids, dtype = np.int64)
+    offsets = np.asarray(offsets, dtype = np.int64)
+    point_ids = np.asarray(point_ids, dtype = np.int64)
+    idx = np.searchsorted(node_ids, point_ids)
+    idx[idx == len(node_ids)] = 0
+    found = (node_ids[idx] == point_ids) if len(node_ids) else np.zeros(len(point_ids), dtype = bool)
+    # count the remaining points per polyline
+    polyline_index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    new_offsets = np.zeros(len(offsets), dtype = np.int64)
+    new_offsets[1:] = np.cumsum(np.bincount(polyline_index[found], minlength = len(offsets) - 1))
+    return new_offsets, point_ids[found], np.asarray(node_lats, dtype = np.float64)[idx[found]], np.asarray(node_lons, dtype = np.float64)[idx[found]]
+
+def street_lengths(arrays, streets = None):
+    '''
+    Compute the haversine lengths of all streets of a dataset (or only of the streets with the given indices).
+    '''
+    offsets, point_ids = arrays['street_node_offsets'], arrays['street_node_ids']
+    if streets is not None:
+        point_idx, offsets = take_polylines(offsets, streets)
+        point_ids = np.asarray(point_ids)[point_idx]
+    offsets, point_ids, lats, lons = resolve_polylines(offsets, point_ids, arrays['node_ids'], arrays['node_lats'], arrays['node_lons'])
+    return polyline_lengths(lats, lons, offsets)
+
+def camera_areas(arrays, cameras = None, areas = None):
+    '''
+    Assign the cameras of a dataset to its postal areas with one spatial join (optionally only the cameras resp. areas
+    with the given indices). Returns the arrays (camera_idx, area_idx) of all pairs, sorted by area and camera.
+    '''
+    polygons = PolygonSet(arrays['area_point_offsets'], arrays['area_ring_lats'], arrays['area_ring_lons'], arrays['area_ring_offsets'])
+    if areas is not None:
+        # areas that are not wanted get no rings
+        keep = np.zeros(len(polygons), dtype = bool)
+        keep[np.asarray(areas, dtype = np.int64)] = True
+        ring_counts = np.diff(polygons.polygon_offsets)
+        point_idx, point_offsets = take_polylines(polygons.ring_offsets, np.flatnonzero(np.repeat(keep, ring_counts)))
+        polygons = PolygonSet(point_offsets, polygons.lats[point_idx], polygons.lons[point_idx],
+                              np.append(0, np.cumsum(np.where(keep, ring_counts, 0))))
+    camera_idx = np.arange(len(arrays['camera_ids'])) if cameras is None else np.asarray(cameras, dtype = np.int64)
+    point_idx, area_idx = spatial_join(np.asarray(arrays['camera_lats'])[camera_idx], np.asarray(arrays['camera_lons'])[camera_idx], polygons)
+    return camera_idx[point_idx], area_idx
+
+def add_derived_arrays(arrays):
+    # street lengths and the camera assignment, computed from the other arrays
+    arrays['street_lengths'] = street_lengths(arrays)
+    camera_idx, area_idx = camera_areas(arrays)
+    arrays['camera_area_ids'] = np.asarray(arrays['camera_ids'])[camera_idx]
+    arrays['camera_area_idx'] = area_idx.astype(np.int64)
+    return arrays
+
+def is_dataset(directory):
+    return os.path.isfile(os.path.join(directory, 'meta.json'))
+
+def _coordinate_columns(coord_dict):
+    # {..., node_id: [node_lat, node_lon], ...} -> ids sorted ascending, lats, lons
+    ids = np.array(list(coord_dict.keys()), dtype = np.int64)
+    coords = np.array([tuple(coords)[:2] for coords in coord_dict.values()], dtype = np.float64).reshape(-1, 2)
+    order = np.argsort(ids, kind = 'stable')
+    return ids[order], coords[order, 0].copy(), coords[order, 1].copy()
+
+def flat_lists(lists, dtype):
+    # [list1, list2, ..] -> offsets of each list, flat array of all their values
+    offsets = np.zeros(len(lists) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(values) for values in lists])
+    flat = np.fromiter(itertools.chain.from_iterable(lists), dtype = dtype, count = offsets[-1])
+    return offsets, flat
+
+def ring_arrays(lat_rings, lon_rings):
+    '''
+    Convert the rings of all areas, given as lists [..., [ring1_lats, ring2_lats, ..], ...] (resp. lons), to the ring arrays
+    of a dataset: area_ring_offsets, area_point_offsets, area_ring_holes, area_ring_lats and area_ring_lons (see write_dataset).
+    '''
+    arrays = {}
+    arrays['area_ring_offsets'] = np.zeros(len(lat_rings) + 1, dtype = np.int64)
+    arrays['area_ring_offsets'][1:] = np.cumsum([len(rings) for rings in lat_rings])
+    arrays['area_point_offsets'], arrays['area_ring_lats'] = flat_lists(list(itertools.chain.from_iterable(lat_rings)), np.float64)
+    arrays['area_ring_lons'] = flat_lists(list(itertools.chain.from_iterable(lon_rings)), np.float64)[1]
+    arrays['area_ring_holes'] = ring_holes(arrays['area_ring_lats'], arrays['area_ring_lons'], arrays['area_point_offsets']).astype(np.int8)
+    return arrays
+
+def split_rings(arrays, convert = float):
+    '''
+    Return the rings of all areas of a dataset (a dict of its arrays or a Dataset) as lists of (lat_rings, lon_rings),
+    where lat_rings = [ring1_lats, ring2_lats, ..] with the coordinates converted by **convert**.
+    '''
+    get = arrays.get if isinstance(arrays, dict) else lambda name: getattr(arrays, name)
+    lats = [convert(lat) for lat in np.asarray(get('area_ring_lats')).tolist()]
+    lons = [convert(lon) for lon in np.asarray(get('area_ring_lons')).tolist()]
+    points = np.asarray(get('area_point_offsets')).tolist()
+    lat_rings = [lats[start:end] for (start, end) in zip(points[:-1], points[1:])]
+    lon_rings = [lons[start:end] for (start, end) in zip(points[:-1], points[1:])]
+    rings = np.asarray(get('area_ring_offsets')).tolist()
+    return [(lat_rings[start:end], lon_rings[start:end]) for (start, end) in zip(rings[:-1], rings[1:])]
+
+def string_table(strings):
+    # None is stored as empty string
+    encoded = [('' if string is None else str(string)).encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+    return np.frombuffer(b''.join(encoded), dtype = np.uint8), offsets
+
+def decode_strings(data, offsets):
+    '''
+    Return the list of strings of a string table given by its utf-8 **data** and **offsets**.
+    '''
+    raw = np.asarray(data).tobytes()
+    bounds = np.asarray(offsets).tolist()
+    return [raw[start:end].decode('utf-8') for (start, end) in zip(bounds[:-1], bounds[1:])]
+
+class Dataset(object):
+    '''
+    Binary columnar dataset written by write_dataset. With mmap = True all arrays are memory-mapped read-only,
+    so opening is almost instant and the pages are shared between all processes that use the same dataset.
+    '''
+
+    def __init__(self, npy_dir, mmap = True):
+        assert(is_dataset(npy_dir)), 'No dataset directory: %s' % npy_dir
+        self.npy_dir = npy_dir
+        with open(os.path.join(npy_dir, 'meta.json'), 'r') as meta_file:
+            self.meta = json.load(meta_file)
+        assert(self.meta['version'] == FORMAT_VERSION), 'Unsupported dataset version %s' % self.meta['version']
+        self.street_type_names = self.meta['street_types']
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(npy_dir, name + '.npy'), mmap_mode = 'r' if mmap else None))
+
+    def get_arrays(self):
+        '''
+        Return a dict of all arrays (as in-memory copies, so that they can be changed and written again with write_arrays).
+        '''
+        return {name: np.array(getattr(self, name)) for name in ARRAYS}
+
+    def get_bounds(self):
+        return dict(zip(['minlat', 'minlon', 'maxlat', 'maxlon'], self.bounds.tolist()))
+
+    def get_postal_codes(self):
+        return decode_strings(self.area_code_data, self.area_code_offsets)
+
+    def to_dicts(self):
+        '''
+        Return bounds, cameras, street_nodes, streets, postal_areas, area_nodes, area_lats, area_lons in the dict layout of collect_data.
+        '''
+        def coord_dict(ids, lats, lons):
+            return {str(node_id): (lat, lon) for (node_id, lat, lon) in zip(ids.tolist(), lats.tolist(), lons.tolist())}
+        def split(offsets, flat, convert):
+            values = [convert(value) for value in flat.tolist()]
+            bounds = offsets.tolist()
+            return [values[start:end] for (start, end) in zip(bounds[:-1], bounds[1:])]
+
+        cameras = coord_dict(self.camera_ids, self.camera_lats, self.camera_lons)
+        street_nodes = coord_dict(self.node_ids, self.node_lats, self.node_lons)
+        area_nodes = coord_dict(self.area_node_ids, self.area_node_lats, self.area_node_lons)
+        postal_codes = self.get_postal_codes()
+        street_postals = decode_strings(self.street_postal_data, self.street_postal_offsets)
+        street_names = decode_strings(self.street_name_data, self.street_name_offsets)
+        street_node_lists = split(self.street_node_offsets, self.street_node_ids, str)
+        streets = {}
+        for k, street_id in enumerate(self.street_ids.tolist()):
+            streets[str(street_id)] = [self.street_type_names[self.street_types[k]], int(self.street_oneway[k]),
+                                       street_postals[k], street_names[k]] + street_node_lists[k]
+        postal_areas = dict(zip(postal_codes, split(self.area_way_offsets, self.area_way_ids, str)))
+        rings = split_rings(self)
+        area_lats = dict(zip(postal_codes, [lat_rings for (lat_rings, lon_rings) in rings]))
+        area_lons = dict(zip(postal_codes, [lon_rings for (lat_rings, lon_rings) in rings]))
+        return self.get_bounds(), cameras, street_nodes, streets, postal_areas, area_nodes, area_lats, area_lons
+
+def write_csv(out_dir, bounds, cameras, street_nodes, streets, postal_areas, area_nodes, area_lats, area_lons):
+    '''
+    Write the data in the dict layout of collect_data to the csv files of a csv directory **out_dir**.
+    area_lats.csv and area_lons.csv get one row per ring (postal code and coordinates), the rings of an area in consecutive rows.
+    '''
+    if not os.path.isdir(out_dir):
+        os.mkdir(out_dir)
+    rows = {'bounds.csv': [[bounds[key] for key in ['minlat', 'minlon', 'maxlat', 'maxlon']]],
+            'cameras.csv': ([node_id] + list(coords) for (node_id, coords) in cameras.items()),
+            'street_nodes.csv': ([node_id] + list(coords) for (node_id, coords) in street_nodes.items()),
+            'streets.csv': ([street_id] + list(info) for (street_id, info) in streets.items()),
+            'areas.csv': ([postal_code] + list(ways) for (postal_code, ways) in postal_areas.items()),
+            'area_nodes.csv': ([node_id] + list(coords) for (node_id, coords) in area_nodes.items()),
+            'area_lats.csv': ([postal_code] + list(ring) for (postal_code, rings) in area_lats.items() for ring in rings),
+            'area_lons.csv': ([postal_code] + list(ring) for (postal_code, rings) in area_lons.items() for ring in rings)}
+    for csv_type in rows:
+        with open(os.path.join(out_dir, csv_type), 'w') as write_file:
+            csv.writer(write_file, delimiter=',').writerows(rows[csv_type])
+    return out_dir
@@ -0,0 +1,141 @@
+import numpy as np
+
+EARTH_RADIUS = 6371008.8            # mean earth radius in metres
+WGS84_A = 6378137.0                 # semi-major axis of the WGS84 ellipsoid in metres
+WGS84_F = 1 / 298.257223563         # flattening of the WGS84 ellipsoid
+WGS84_E2 = WGS84_F * (2 - WGS84_F)  # squared eccentricity
+
+# possible metrics for lengths: metres on a sphere, metres on the WGS84 ellipsoid, plain degrees
+METRICS = ['haversine', 'ellipsoidal', 'planar']
+
+def segment_lengths(lats, lons, metric = 'haversine'):
+    '''
+    Compute the lengths of all segments between consecutive points of the coordinate arrays **lats** and **lons** at once.
+    Returns an array of length len(lats) - 1.
+    metric: 'haversine' (great circle distance in metres), 'ellipsoidal' (metres on the WGS84 ellipsoid, using the
+    radii of curvature at the mid latitude of each segment, which is exact to millimetres for street segments)
+    or 'planar' (euclidean distance of the coordinates in degrees).
+    '''
+    assert(metric in METRICS), 'Unknown metric %s' % metric
+    lats = np.asarray(lats, dtype = np.float64)
+    lons = np.asarray(lons, dtype = np.float64)
+    if metric == 'planar':
+        return np.hypot(np.diff(lats), np.diff(lons))
+    phi = np.radians(lats)
+    d_phi = np.diff(phi)
+    d_lambda = np.radians(np.diff(lons))
+    if metric == 'haversine':
+        h = np.sin(d_phi / 2)**2 + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(d_lambda / 2)**2
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+    # ellipsoidal: meridional and prime vertical radius of curvature at the mid latitude
+    mid_phi = (phi[:-1] + phi[1:]) / 2
+    w = np.sqrt(1 - WGS84_E2 * np.sin(mid_phi)**2)
+    meridional = WGS84_A * (1 - WGS84_E2) / w**3
+    prime_vertical = WGS84_A / w
+    return np.hypot(meridional * d_phi, prime_vertical * np.cos(mid_phi) * d_lambda)
+
+def polyline_lengths(lats, lons, offsets, metric = 'haversine'):
+    '''
+    Compute the lengths of many polylines in one vectorized pass.
+    The points of all polylines are given by the flat coordinate arrays **lats** and **lons**,
+    polyline k consists of the points offsets[k] to offsets[k+1]-1.
+    Returns an array of length len(offsets) - 1 (polylines with less than two points have length 0).
+    '''
+    offsets = np.asarray(offsets, dtype = np.int64)
+    point_count = len(lats)
+    lengths = np.zeros(len(offsets) - 1, dtype = np.float64)
+    if point_count < 2:
+        return lengths
+    # segment i connects point i and i+1, the last point of each polyline gets length 0
+    segments = np.zeros(point_count, dtype = np.float64)
+    segments[:-1] = segment_lengths(lats, lons, metric)
+    ends = offsets[1:] - 1
+    segments[ends[ends >= 0]] = 0.0
+    # sum up the segments of each polyline, reduceat is only valid for non-empty polylines
+    non_empty = offsets[1:] > offsets[:-1]
+    lengths[non_empty] = np.add.reduceat(segments, offsets[:-1][non_empty])
+    return lengths
+
+# classification of points relative to a polygon
+OUTSIDE, INSIDE, BOUNDARY = 0, 1, 2
+
+def classify_points(lats, lons, start_lats, start_lons, end_lats, end_lons, rule = 'even-odd', tolerance = 1e-9, max_pairs = 1 << 22):
+    '''
+    Classify many points at once relative to a polygon given by its edges (all edges of all its rings, e.g. from PolygonSet.edges).
+    Returns an int8 array with OUTSIDE, INSIDE or BOUNDARY for each point (lats[k], lons[k]).
+    All points are tested against all edges in one broadcasted operation (in blocks of at most max_pairs point-edge pairs):
+    a ray from each point in direction of increasing longitude is intersected with every edge.
+    rule: 'even-odd' (inside if the ray crosses an odd number of edges, so inner rings are holes)
+          or 'nonzero' (inside if the winding number, i.e. the number of upward minus downward crossings, is not zero).
+    Points closer than **tolerance** (in degrees) to an edge are on the BOUNDARY.
+    '''
+    assert(rule in ['even-odd', 'nonzero']), 'Unknown rule %s' % rule
+    lats = np.asarray(lats, dtype = np.float64)
+    lons = np.asarray(lons, dtype = np.float64)
+    result = np.zeros(len(lats), dtype = np.int8)
+    if not len(start_lats) or not len(lats):
+        return result
+    a_lat = np.asarray(start_lats, dtype = np.float64)
+    a_lon = np.asarray(start_lons, dtype = np.float64)
+    b_lat = np.asarray(end_lats, dtype = np.float64)
+    b_lon = np.asarray(end_lons, dtype = np.float64)
+    d_lat, d_lon = b_lat - a_lat, b_lon - a_lon
+    squared_lengths = d_lat**2 + d_lon**2
+    # latitude band of each edge, extended by the tolerance
+    low_lats = np.minimum(a_lat, b_lat) - tolerance
+    high_lats = np.maximum(a_lat, b_lat) + tolerance
+    # upward edges count +1, downward edges -1 for the winding number
+    directions = np.where(d_lat > 0, 1.0, -1.0)
+    block = max(1, max_pairs // len(a_lat))
+    for start in range(0, len(lats), block):
+        p_lat = lats[start:start + block]
+        p_lon = lons[start:start + block]
+        # broadcast all points of the block against all edges, only pairs where the point lies in the latitude band
+        # of the edge can be crossings or boundary contacts, so continue only with those (usually very few) pairs
+        rows, cols = np.nonzero( (p_lat[:, np.newaxis] >= low_lats) & (p_lat[:, np.newaxis] <= high_lats) )
+        q_lat, q_lon = p_lat[rows], p_lon[rows]
+        e_lat, e_lon = a_lat[cols], a_lon[cols]
+        # only edges that span the latitude of the point can be crossed (half open, so that shared vertices count once)
+        spans = (e_lat > q_lat) != (b_lat[cols] > q_lat)
+        cross_lons = np.full(len(rows), -np.inf)
+        cross_lons[spans] = e_lon[spans] + (q_lat[spans] - e_lat[spans]) * d_lon[cols[spans]] / d_lat[cols[spans]]
+        crossings = cross_lons > q_lon
+        if rule == 'even-odd':
+            inside = np.bincount(rows[crossings], minlength = len(p_lat)) % 2 == 1
+        else:
+            inside = np.bincount(rows[crossings], weights = directions[cols[crossings]], minlength = len(p_lat)) != 0
+        # points on an edge: (almost) zero distance to the line of the edge and projection within the edge
+        lengths = np.sqrt(squared_lengths[cols])
+        cross_products = d_lat[cols] * (q_lon - e_lon) - d_lon[cols] * (q_lat - e_lat)
+        projections = d_lat[cols] * (q_lat - e_lat) + d_lon[cols] * (q_lon - e_lon)
+        on_edge = ( (lengths > 0) & (np.abs(cross_products) <= tolerance * lengths)
+                    & (projections >= -tolerance * lengths) & (projections <= squared_lengths[cols] + tolerance * lengths) )
+        # degenerated edges (duplicate points) are only touched by a point on the same position
+        on_edge |= (lengths == 0) & (np.abs(q_lat - e_lat) <= tolerance) & (np.abs(q_lon - e_lon) <= tolerance)
+        block_result = np.where(inside, INSIDE, OUTSIDE).astype(np.int8)
+        block_result[rows[on_edge]] = BOUNDARY
+        result[start:start + block] = block_result
+    return result
+
+def points_in_polygon(lats, lons, start_lats, start_lons, end_lats, end_lons, rule = 'even-odd', include_boundary = True, tolerance = 1e-9):
+    '''
+    Return a boolean array, which tells for each point whether it lies inside the polygon given by its edges
+    (points on the boundary count as inside if include_boundary is True). See classify_points.
+    '''
+    classes = classify_points(lats, lons, start_lats, start_lons, end_lats, end_lons, rule, tolerance)
+    if include_boundary:
+        return classes != OUTSIDE
+    return classes == INSIDE
+
+def take_polylines(offsets, indices):
+    '''
+    Select the polylines **indices** out of flat polyline arrays with **offsets**.
+    Returns (point_idx, new_offsets): the positions of their points in the flat arrays and their offsets in the selection.
+    '''
+    offsets = np.asarray(offsets, dtype = np.int64)
+    indices = np.asarray(indices, dtype = np.int64)
+    counts = offsets[indices + 1] - offsets[indices]
+    new_offsets = np.zeros(len(indices) + 1, dtype = np.int64)
+    new_offsets[1:] = np.cumsum(counts)
+    point_idx = np.repeat(offsets[indices] - new_offsets[:-1], counts) + np.arange(new_offsets[-1], dtype = np.int64)
+    return point_idx, new_offsets
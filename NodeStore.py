@@ -0,0 +1,178 @@
+import numpy as np
+
+class NodeStore(object):
+    '''
+    Compact storage of node coordinates as a replacement for a dict {..., node_id: [node_lat, node_lon], ...}.
+    Nodes are appended into fixed size chunks of NumPy arrays, on finalizing they are merged into one array of int64 ids
+    sorted in ascending order and two coordinate arrays, so that the coordinates of many nodes can be looked up at once
+    by a vectorized binary search.
+    With fixed_point = True the coordinates are stored as int32 in units of 1e-7 degrees (the precision of OpenStreetMap),
+    which gives back exactly the same floats for coordinates with at most 7 decimals.
+    '''
+
+    SCALE = 10000000
+
+    def __init__(self, chunk_size = 1 << 20, fixed_point = True):
+        self.chunk_size = chunk_size
+        self.fixed_point = fixed_point
+        self.coord_dtype = np.int32 if fixed_point else np.float64
+        # finished chunks of (ids, lats, lons) arrays, the first merged_chunks chunks ever finished are merged into ids already
+        self.chunks = []
+        self.merged_chunks = 0
+        self.ids = np.empty(0, dtype = np.int64)
+        self.lats = np.empty(0, dtype = self.coord_dtype)
+        self.lons = np.empty(0, dtype = self.coord_dtype)
+        self._new_chunk()
+
+    @classmethod
+    def from_arrays(cls, ids, lats, lons):
+        '''
+        Create a finalized fixed point store from sorted unique ids and coordinates in units of 1e-7 degrees (e.g. saved arrays).
+        '''
+        store = cls(chunk_size = 1)
+        store.ids = np.asarray(ids, dtype = np.int64)
+        store.lats = np.asarray(lats, dtype = np.int32)
+        store.lons = np.asarray(lons, dtype = np.int32)
+        return store
+
+    def _new_chunk(self):
+        self.chunk_ids = np.empty(self.chunk_size, dtype = np.int64)
+        self.chunk_lats = np.empty(self.chunk_size, dtype = self.coord_dtype)
+        self.chunk_lons = np.empty(self.chunk_size, dtype = self.coord_dtype)
+        self.fill = 0
+
+    def _flush_chunk(self):
+        if self.fill:
+            self.chunks.append( (self.chunk_ids[:self.fill].copy(), self.chunk_lats[:self.fill].copy(),
+                                 self.chunk_lons[:self.fill].copy()) )
+            self.fill = 0
+
+    def _encode(self, coords):
+        if self.fixed_point:
+            return np.round(np.asarray(coords, dtype = np.float64) * self.SCALE).astype(np.int32)
+        return np.asarray(coords, dtype = np.float64)
+
+    def _decode(self, coords):
+        if self.fixed_point:
+            return coords / np.float64(self.SCALE)
+        return coords
+
+    def add(self, node_id, lat, lon):
+        '''
+        Append a single node, where node_id is an integer (or a string of it) and lat/ lon are floats.
+        '''
+        if self.fill == self.chunk_size:
+            self._flush_chunk()
+            self._new_chunk()
+        self.chunk_ids[self.fill] = int(node_id)
+        if self.fixed_point:
+            self.chunk_lats[self.fill] = round(float(lat) * self.SCALE)
+            self.chunk_lons[self.fill] = round(float(lon) * self.SCALE)
+        else:
+            self.chunk_lats[self.fill] = lat
+            self.chunk_lons[self.fill] = lon
+        self.fill += 1
+
+    def add_many(self, node_ids, lats, lons):
+        '''
+        Append the nodes of the equally long arrays node_ids, lats and lons.
+        '''
+        if len(node_ids):
+            self._flush_chunk()
+            self.chunks.append( (np.asarray(node_ids, dtype = np.int64), self._encode(lats), self._encode(lons)) )
+
+    def new_chunks(self, start = 0):
+        '''
+        Return the number of finished chunks and the (ids, lats, lons) arrays (coordinates encoded as stored) of all nodes
+        appended since chunk **start**, e.g. to save the nodes incrementally. They can be appended again with add_encoded.
+        Chunks are counted over the whole lifetime of the store, so a store that was finalized after chunk start
+        cannot tell its nodes apart any more and raises a ValueError.
+        '''
+        self._flush_chunk()
+        if start < self.merged_chunks:
+            raise ValueError('Chunk %s is merged already (%s chunks were finalized)' % (start, self.merged_chunks))
+        chunks = self.chunks[start - self.merged_chunks:]
+        chunk_count = self.merged_chunks + len(self.chunks)
+        if not chunks:
+            return chunk_count, (np.empty(0, dtype = np.int64), np.empty(0, dtype = self.coord_dtype), np.empty(0, dtype = self.coord_dtype))
+        return chunk_count, tuple(np.concatenate([chunk[k] for chunk in chunks]) for k in range(3))
+
+    def add_encoded(self, node_ids, lats, lons):
+        '''
+        Append the nodes of the arrays node_ids, lats and lons, whose coordinates are already encoded (see new_chunks).
+        '''
+        if len(node_ids):
+            self._flush_chunk()
+            self.chunks.append( (np.asarray(node_ids, dtype = np.int64), np.asarray(lats, dtype = self.coord_dtype),
+                                 np.asarray(lons, dtype = self.coord_dtype)) )
+
+    def finalize(self):
+        '''
+        Merge all chunks into the sorted id array. If a node id was added more than once, the last one wins.
+        '''
+        self._flush_chunk()
+        if not self.chunks:
+            return
+        self.merged_chunks += len(self.chunks)
+        self.chunks.insert(0, (self.ids, self.lats, self.lons))
+        ids = np.concatenate([chunk[0] for chunk in self.chunks])
+        lats = np.concatenate([chunk[1] for chunk in self.chunks])
+        lons = np.concatenate([chunk[2] for chunk in self.chunks])
+        self.chunks = []
+        # OpenStreetMap files are usually sorted by node id already, so sorting can be skipped in most cases
+        if len(ids) > 1 and not np.all(ids[1:] > ids[:-1]):
+            order = np.argsort(ids, kind = 'stable')
+            ids, lats, lons = ids[order], lats[order], lons[order]
+            # keep only the last of equal ids
+            is_last = np.append(ids[1:] != ids[:-1], True)
+            ids, lats, lons = ids[is_last], lats[is_last], lons[is_last]
+        self.ids, self.lats, self.lons = ids, lats, lons
+
+    def lookup(self, node_ids):
+        '''
+        Look up the coordinates of all nodes in node_ids at once.
+        Return the arrays (lats, lons, found), where found is a boolean mask of the nodes contained in the store
+        (coordinates of nodes that were not found are nan).
+        '''
+        if self.fill or self.chunks:
+            self.finalize()
+        node_ids = np.asarray(node_ids, dtype = np.int64)
+        lats = np.full(node_ids.shape, np.nan)
+        lons = np.full(node_ids.shape, np.nan)
+        if not len(self.ids):
+            return lats, lons, np.zeros(node_ids.shape, dtype = bool)
+        idx = np.searchsorted(self.ids, node_ids)
+        idx[idx == len(self.ids)] = 0
+        found = self.ids[idx] == node_ids
+        lats[found] = self._decode(self.lats[idx[found]])
+        lons[found] = self._decode(self.lons[idx[found]])
+        return lats, lons, found
+
+    def get(self, node_id, default = None):
+        lats, lons, found = self.lookup([int(node_id)])
+        if not found[0]:
+            return default
+        return lats[0], lons[0]
+
+    def __contains__(self, node_id):
+        return self.lookup([int(node_id)])[2][0]
+
+    def __getitem__(self, node_id):
+        coords = self.get(node_id)
+        if coords is None:
+            raise KeyError(node_id)
+        return coords
+
+    def __len__(self):
+        # counted without finalizing (e.g. for progress reports while nodes are appended),
+        # so a node added more than once is counted repeatedly until the store is finalized
+        return len(self.ids) + sum(len(chunk[0]) for chunk in self.chunks) + self.fill
+
+    def nbytes(self):
+        '''
+        Return the number of bytes used by the stored arrays.
+        '''
+        arrays = [self.ids, self.lats, self.lons, self.chunk_ids, self.chunk_lats, self.chunk_lons]
+        for chunk in self.chunks:
+            arrays.extend(chunk)
+        return sum(array.nbytes for array in arrays)
@@ -1,4 +1,6 @@
 import argparse
+import os
+import Profiler
 
 def parse_args(args):
     if args.command in ['parseXML', 'pa', 'parse']:
@@ -6,82 +8,305 @@ def parse_args(args):
         csv = args.csv
         xml_file = args.file
         size = int(args.max_size)
+        workers = int(args.workers)
+        two_pass = args.two_pass
+        npy = args.npy
+        engine = args.engine
+        rule_file = args.rules
+        sqlite = args.sqlite
+        progress = args.progress
+        status_file = args.status_file
+        checkpoint = args.checkpoint
+        resume = args.resume
     elif args.command in ['streets', 'st']:
         command = 'streets'
         csv_dir = args.csv_dir
+        npy_dir = args.npy_dir
         print_types = args.print_types
         stat = args.lengths
         street_type = args.type
         plot = args.plot
         dpi = args.dpi
+        width = args.width
+        height = args.height
         oneway = args.oneway
+        metric = args.metric
+        db_file = args.db_file
+        bbox = args.bbox
+        route = args.route
+        reachable = args.reachable
+        topology = args.topology
+        nearest = load_query_points(args.nearest, args.nearest_file)
+        k = args.k
+        radius = args.radius
     elif args.command in ['postal_areas', 'po', 'postals']:
         command = 'postal_areas'
         csv_dir = args.csv_dir
+        npy_dir = args.npy_dir
         cam_counts = args.cam_counts
         postal_area = args.area
+        nearest = load_query_points(args.nearest, args.nearest_file)
+        k = args.k
+        radius = args.radius
+        db_file = args.db_file
+        bbox = args.bbox
+    elif args.command in ['tiles', 'ti']:
+        command = 'tiles'
+        csv_dir = args.csv_dir
+        npy_dir = args.npy_dir
+        out_dir = args.output_dir
+        min_zoom = args.min_zoom
+        max_zoom = args.max_zoom
+        street_types = args.types
+        workers = args.workers
+        use_cache = args.cache
+    elif args.command in ['update', 'up']:
+        command = 'update'
+        npy_dir = args.npy_dir
+        osc_file = args.osc_file
+        out_dir = args.output_dir
+    elif args.command in ['convert', 'co']:
+        command = 'convert'
+        input_dir = args.input_dir
+        output_dir = args.output_dir
+        output_format = args.format
+    elif args.command in ['serve', 'se']:
+        command = 'serve'
+        csv_dir = args.csv_dir
+        npy_dir = args.npy_dir
+        host = args.host
+        port = args.port
+        socket_path = args.socket
+        metric = args.metric
     print('\nSpecified program:\n\t %s' % command)
     print('Used options to it are:')
     for arg in vars(args):
         if not arg == args.command:
             print('\t %s = %s' %(arg, getattr(args, arg)))
-    if command == 'parseXML':
-        parseXML_program(xml_file, size, csv)
-    elif command == 'streets':
-        if not any([print_types, stat, plot, oneway]):
-            print("\nPlease specify at least one of the options of '--print_types', '--analyze_lengths', '--plot', '--oneway_quota'.\n")
-            exit(1)
-        streets_program(csv_dir, print_types, stat, street_type, plot, dpi, oneway)
-    elif command == 'postal_areas':
-        if not any([cam_counts, postal_area]):
-            print("\nPlease specify at least one of the options of '--cam_counts', '--cams_to_area'.\n")
-            exit(1)
-        postals_program(csv_dir,cam_counts, postal_area)
-
-def parseXML_program(xml_file, size, csv):
+    profile = args.profile or args.profile_json or args.profile_trace or args.cprofile
+    if profile:
+        Profiler.enable(trace_memory = args.trace_memory, cprofile_stage = args.cprofile)
+    try:
+        with Profiler.stage(command):
+            if command == 'parseXML':
+                parseXML_program(xml_file, size, csv, workers, two_pass, npy, engine, rule_file, sqlite, progress, status_file, checkpoint, resume)
+            elif command == 'streets':
+                if not any([print_types, stat, plot, oneway, route, reachable, topology, nearest is not None]):
+                    print("\nPlease specify at least one of the options of '--print_types', '--analyze_lengths', '--plot', '--oneway_quota', '--route', '--reachable', '--topology', '--nearest', '--nearest_file'.\n")
+                    exit(1)
+                streets_program(csv_dir, npy_dir, print_types, stat, street_type, plot, dpi, oneway, metric, width, height, db_file, bbox, route, reachable, topology, nearest, k, radius)
+            elif command == 'postal_areas':
+                if not any([cam_counts, postal_area, nearest is not None]):
+                    print("\nPlease specify at least one of the options of '--cam_counts', '--cams_to_area', '--nearest', '--nearest_file'.\n")
+                    exit(1)
+                postals_program(csv_dir, npy_dir, cam_counts, postal_area, db_file, bbox, nearest, k, radius)
+            elif command == 'tiles':
+                tiles_program(csv_dir, npy_dir, out_dir, min_zoom, max_zoom, street_types, workers, use_cache)
+            elif command == 'update':
+                update_program(npy_dir, osc_file, out_dir)
+            elif command == 'convert':
+                convert_program(input_dir, output_dir, output_format)
+            elif command == 'serve':
+                serve_program(csv_dir, npy_dir, host, port, socket_path, metric)
+    finally:
+        if profile:
+            Profiler.disable().report(args.profile_json, args.profile_trace)
+
+def parseXML_program(xml_file, size, csv, workers, two_pass, npy, engine, rule_file, sqlite, progress, status_file, checkpoint, resume):
     from parseXML_singleRun import collect_data
-    collect_data(FILE = xml_file, csv_output = csv, max_size = size)
+    collect_data(FILE = xml_file, csv_output = csv, max_size = size, workers = workers, two_pass = two_pass, npy_output = npy, engine = engine,
+                 rule_file = rule_file, sqlite_output = sqlite, progress_interval = progress, status_file = status_file,
+                 checkpoint_interval = checkpoint, resume = resume)
 
-def streets_program(csv_dir, print_types, stat, street_type, plot, dpi, oneway):
-    from Streets import Streets
+def load_data(csv_dir, npy_dir):
     from Data import Data
-    new_data = Data(csv_dir=csv_dir)
+    # a binary dataset is preferred, otherwise load the csv directory (argparse returns it as list if given explicitly)
+    if npy_dir:
+        return Data(npy_dir=npy_dir)
+    if isinstance(csv_dir, list):
+        csv_dir = csv_dir[0]
+    return Data(csv_dir=csv_dir)
+
+def load_streets(csv_dir, npy_dir, add_length = True, metric = 'haversine', db_file = None, bbox = None, street_types = None):
+    from Streets import Streets
+    if db_file:
+        # query only the wanted streets from the database
+        from Database import Database
+        return Streets.from_database(Database(db_file), bbox, street_types, add_length = add_length, metric = metric)
+    new_data = load_data(csv_dir, npy_dir)
+    if new_data.dataset is not None:
+        return Streets.from_dataset(new_data.dataset, add_length = add_length, metric = metric)
     bounds, streets, node_coords = new_data.get_streets()
-    new_streets = Streets(bounds, streets, node_coords, add_length = True)
-    new_streets.run_streets(print_types, stat, street_type, plot, dpi, oneway)
+    return Streets(bounds, streets, node_coords, add_length = add_length, metric = metric)
+
+def load_query_points(nearest, nearest_file):
+    '''
+    Return the query points (lats, lons) of the options --nearest LAT LON resp. --nearest_file (a csv file with the
+    columns 'lat' and 'lon'), None if neither is given.
+    '''
+    if nearest_file:
+        import pandas as pd
+        points = pd.read_csv(nearest_file)
+        assert('lat' in points.columns and 'lon' in points.columns), "The file %s needs the columns 'lat' and 'lon'." % nearest_file
+        return points['lat'].values.astype(float), points['lon'].values.astype(float)
+    if nearest:
+        return [nearest[0]], [nearest[1]]
+    return None
 
-def postals_program(csv_dir, cam_counts, postal_area):
+def streets_program(csv_dir, npy_dir, print_types, stat, street_type, plot, dpi, oneway, metric, width, height, db_file, bbox, route, reachable, topology, nearest, k, radius):
+    with Profiler.stage('load streets'):
+        new_streets = load_streets(csv_dir, npy_dir, metric = metric, db_file = db_file, bbox = bbox, street_types = [street_type] if street_type else None)
+    # the routing graph is saved next to the data it is built from (a binary dataset uses its own subdirectory)
+    routing_dir = None
+    if db_file:
+        routing_dir = db_file + '.routing'
+    elif not npy_dir:
+        routing_dir = os.path.join(csv_dir[0] if isinstance(csv_dir, list) else csv_dir, 'routing')
+    new_streets.run_streets(print_types, stat, street_type, plot, dpi, oneway, width, height, route, reachable, routing_dir, topology, nearest, k, radius)
+
+def postals_program(csv_dir, npy_dir, cam_counts, postal_area, db_file, bbox, nearest, k, radius):
     from PostalAreas import PostalAreas
+    if db_file:
+        # query only the wanted areas from the database (only the given one, if no camera counts of all areas are wanted)
+        from Database import Database
+        with Profiler.stage('load postal areas'):
+            # nearest camera queries need all cameras, not only those around the queried areas
+            new_postals = PostalAreas.from_database(Database(db_file), bbox, None if cam_counts or nearest is not None or not postal_area else [postal_area],
+                                                    all_cameras = nearest is not None)
+        new_postals.run_postals(cam_counts, postal_area, nearest, k, radius)
+        return
+    with Profiler.stage('load postal areas'):
+        new_data = load_data(csv_dir, npy_dir)
+        if new_data.dataset is not None:
+            new_postals = PostalAreas.from_dataset(new_data.dataset)
+        else:
+            cameras = new_data.get_cameras()
+            bounds, areas, area_nodes, area_lats, area_lons = new_data.get_areas()
+            new_postals = PostalAreas(bounds, areas, area_nodes, area_lats, area_lons, cameras)
+    new_postals.run_postals(cam_counts, postal_area, nearest, k, radius)
+
+def tiles_program(csv_dir, npy_dir, out_dir, min_zoom, max_zoom, street_types, workers, use_cache):
+    from Tiles import render_tiles
+    with Profiler.stage('load streets'):
+        new_streets = load_streets(csv_dir, npy_dir, add_length = False)
+    render_tiles(new_streets, out_dir, min_zoom, max_zoom, street_types, workers, use_cache = use_cache)
+
+def update_program(npy_dir, osc_file, out_dir):
+    from Update import apply_changes
+    apply_changes(npy_dir, osc_file, out_dir)
+
+def convert_program(input_dir, output_dir, output_format):
     from Data import Data
-    new_data = Data(csv_dir=csv_dir)
-    cameras = new_data.get_cameras()
-    bounds, areas, area_nodes, area_lats, area_lons = new_data.get_areas()
-    new_postals = PostalAreas(bounds, areas, area_nodes, area_lats, area_lons, cameras)
-    new_postals.run_postals(cam_counts, postal_area)
+    from Dataset import is_dataset
+    with Profiler.stage('load data'):
+        if is_dataset(input_dir):
+            new_data = Data(npy_dir=input_dir)
+        else:
+            new_data = Data(csv_dir=input_dir)
+    with Profiler.stage('write %s' % output_format):
+        if output_format == 'npy':
+            new_data.write_npy(output_dir)
+        elif output_format == 'csv':
+            new_data.write_csv(output_dir)
+        elif output_format == 'sqlite':
+            new_data.write_sqlite(output_dir)
+    print('Written %s data to %s' % (output_format, output_dir))
+
+def serve_program(csv_dir, npy_dir, host, port, socket_path, metric):
+    from Server import serve
+    if isinstance(csv_dir, list):
+        csv_dir = csv_dir[0]
+    serve(csv_dir, npy_dir, host, port, socket_path, metric)
 
 #############################################################################################################################################
 
 parser = argparse.ArgumentParser()
 subparsers = parser.add_subparsers(dest='command')
 
-xml_parser = subparsers.add_parser('parseXML', aliases=['pa','parse'])
-xml_parser.add_argument('--file', '-f', default='map.xml', help='path to xml file to get data from.', dest='file')
-xml_parser.add_argument('--max_size', '--size', '-s', default='1000000', help='How many characters should be parsed in one iteration.', dest='max_size')
+# options of all subcommands
+profile_parser = argparse.ArgumentParser(add_help=False)
+profile_parser.add_argument('--profile', action='store_true', default=False, help='With this option, wall time, cpu time, peak memory and item counts of all stages will be printed as table.', dest='profile')
+profile_parser.add_argument('--profile_json', default=None, help='Write the profiled stages to this json file.', dest='profile_json')
+profile_parser.add_argument('--profile_trace', default=None, help='Write the profiled stages to this chrome trace file (chrome://tracing, ui.perfetto.dev).', dest='profile_trace')
+profile_parser.add_argument('--cprofile', default=None, metavar='STAGE', help="Run the stage with this name (as in the profile table, e.g. 'spatial join') under cProfile and dump its statistics to profile_<stage>.prof.", dest='cprofile')
+profile_parser.add_argument('--trace_memory', action='store_true', default=False, help='With --profile: also trace the peak memory allocated by python (tracemalloc, slower).', dest='trace_memory')
+
+xml_parser = subparsers.add_parser('parseXML', aliases=['pa','parse'], parents=[profile_parser])
+xml_parser.add_argument('--file', '-f', default='map.xml', help='path to xml (or .osm.pbf) file to get data from, xml files may be compressed (.bz2, .gz, .xz).', dest='file')
+xml_parser.add_argument('--max_size', '--size', '-s', default='1000000', help='How many characters (bytes of compressed files) should be parsed in one iteration.', dest='max_size')
 xml_parser.add_argument('--csv_output', '--csv', '-c', action='store_false', help='Without this option the parsed data will not be saved to csv files.', dest='csv')
+xml_parser.add_argument('--workers', '-w', default='1', help='How many processes should parse shards of the xml file (resp. blocks of the pbf file) in parallel.', dest='workers')
+xml_parser.add_argument('--npy_output', '--npy', '-n', action='store_true', default=False, help='With this option the parsed data will also be saved as binary (memory-mappable) dataset.', dest='npy')
+xml_parser.add_argument('--two_pass', '-2', action='store_true', default=False, help='With this option, only coordinates of street, area and camera nodes will be kept (reads ways and relations in a first pass).', dest='two_pass')
+xml_parser.add_argument('--engine', '-e', default='etree', choices=['etree', 'expat'], help='Parse engine for xml files: etree builds the xml elements, expat extracts the data directly (faster).', dest='engine')
+xml_parser.add_argument('--rules', '-r', default=None, help='Json file with tag rules of additional tables to extract in the same pass (see example_rules.json), they are saved as csv files.', dest='rules')
+xml_parser.add_argument('--sqlite_output', '--sqlite', '-q', action='store_true', default=False, help='With this option the parsed data will also be saved as sqlite database (with r*tree indices).', dest='sqlite')
+xml_parser.add_argument('--progress', '-P', default=None, type=float, metavar='SECONDS', help='Report the progress (read bytes, elements per second, ETA, memory) every SECONDS to stderr.', dest='progress')
+xml_parser.add_argument('--status_file', default=None, help='Write the progress as json to this file (every 10 seconds or as given by --progress) instead of stderr.', dest='status_file')
+xml_parser.add_argument('--checkpoint', default=None, type=float, metavar='SECONDS', help='Write a checkpoint of the parse state to <file>.checkpoint every SECONDS (serial parses of uncompressed xml files).', dest='checkpoint')
+xml_parser.add_argument('--resume', action='store_true', help='Continue an interrupted parse at its last checkpoint (same options), with identical results.', dest='resume')
 
-street_parser = subparsers.add_parser('streets', aliases=['st'])
+street_parser = subparsers.add_parser('streets', aliases=['st'], parents=[profile_parser])
 street_parser.add_argument('--csv_dir', '--csv', '--c', nargs=1, default='./csv/', help='Specify the csv directory from which the data will be loaded.', dest='csv_dir')
+street_parser.add_argument('--npy_dir', '--npy', default=None, help='Specify a binary dataset directory from which the data will be loaded (instead of the csv directory).', dest='npy_dir')
 street_parser.add_argument('--print_types', '-pt', action='store_true', default=False, help='With this option one can print all street_types.', dest='print_types')
 street_parser.add_argument('--analyze_lengths', '--lengths', '-l', default=None, help="Value must be some statistic out of 'min', 'max', 'average', 'median'.", dest='lengths')
+street_parser.add_argument('--metric', '-m', default='haversine', choices=['haversine', 'ellipsoidal', 'planar'], help="How to measure street lengths: metres on a sphere ('haversine') or on the WGS84 ellipsoid ('ellipsoidal'), or degrees ('planar').", dest='metric')
 street_parser.add_argument('--street_type', '--type', '-t', default=None, help='Which street type to analyze.', dest='type')
 street_parser.add_argument('--plot', '-p', action='store_true', default=False, help='With this option, all streets (or all of the given type) will be plotted to file.', dest='plot')
-street_parser.add_argument('--dpi',  default=None, help='Which resolution to use for png image output.', dest='dpi')
+street_parser.add_argument('--dpi',  default=None, type=int, help='Which resolution to use for png image output.', dest='dpi')
+street_parser.add_argument('--width',  default=None, type=int, help='Width of the png image in pixels (default: 6.4 inches at the given dpi).', dest='width')
+street_parser.add_argument('--height',  default=None, type=int, help='Height of the png image in pixels (default: following the aspect ratio of the map excerpt).', dest='height')
 street_parser.add_argument('--oneway_quota', '--oneway', '-o', default=False, action='store_true', help='With this option, the oneway_quota of all streets (or of all streets of the given type) will be printed.', dest='oneway')
+street_parser.add_argument('--db_file', '--db', default=None, help='Specify a sqlite database from which only the streets (of the given type) will be queried.', dest='db_file')
+street_parser.add_argument('--bbox', nargs=4, type=float, default=None, metavar=('MINLAT', 'MINLON', 'MAXLAT', 'MAXLON'), help='Query only the streets in this bounding box from the sqlite database.', dest='bbox')
+street_parser.add_argument('--route', '-r', nargs=4, type=float, default=None, metavar=('FROM_LAT', 'FROM_LON', 'TO_LAT', 'TO_LON'), help='Print the shortest route (respecting oneway streets) between the junctions closest to the two points.', dest='route')
+street_parser.add_argument('--reachable', nargs=3, type=float, default=None, metavar=('LAT', 'LON', 'METRES'), help='Print how many junctions can be reached within METRES from the junction closest to the point.', dest='reachable')
+street_parser.add_argument('--topology', action='store_true', default=False, help='Print node degrees, junctions, dead ends and connected components of the street network (of all streets and of each type, or of the given type).', dest='topology')
+street_parser.add_argument('--nearest', nargs=2, type=float, default=None, metavar=('LAT', 'LON'), help='Print the nearest streets of the point.', dest='nearest')
+street_parser.add_argument('--nearest_file', default=None, help="Print the nearest streets of all points of this csv file (with the columns 'lat' and 'lon').", dest='nearest_file')
+street_parser.add_argument('--k', '-k', type=int, default=None, help='If --nearest(_file) is used: How many nearest streets to print per point (default: 1, resp. all within --radius).', dest='k')
+street_parser.add_argument('--radius', type=float, default=None, help='If --nearest(_file) is used: Print the streets within this distance in metres.', dest='radius')
 
-postal_parser = subparsers.add_parser('postal_areas', aliases=['po', 'postals'])
+postal_parser = subparsers.add_parser('postal_areas', aliases=['po', 'postals'], parents=[profile_parser])
 postal_parser.add_argument('--csv_dir', '--csv', '-c', nargs=1, default='./csv/', help='Specify the csv directory from which the data will be loaded.', dest='csv_dir')
+postal_parser.add_argument('--npy_dir', '--npy', default=None, help='Specify a binary dataset directory from which the data will be loaded (instead of the csv directory).', dest='npy_dir')
 postal_parser.add_argument('--cam_counts', '--counts', '-co', default=False, action='store_true', help='With this option one can print a list a table of camera counts per postal area.', dest='cam_counts')
 postal_parser.add_argument('--cams_to_area', '--area', '-a', default=None, help='With this option one can print a list of all cameras for the given postal area.', dest='area')
+postal_parser.add_argument('--db_file', '--db', default=None, help='Specify a sqlite database from which only the needed postal areas will be queried.', dest='db_file')
+postal_parser.add_argument('--bbox', nargs=4, type=float, default=None, metavar=('MINLAT', 'MINLON', 'MAXLAT', 'MAXLON'), help='Query only the postal areas in this bounding box from the sqlite database.', dest='bbox')
+postal_parser.add_argument('--nearest', nargs=2, type=float, default=None, metavar=('LAT', 'LON'), help='Print the nearest cameras of the point.', dest='nearest')
+postal_parser.add_argument('--nearest_file', default=None, help="Print the nearest cameras of all points of this csv file (with the columns 'lat' and 'lon').", dest='nearest_file')
+postal_parser.add_argument('--k', '-k', type=int, default=None, help='If --nearest(_file) is used: How many nearest cameras to print per point (default: 1, resp. all within --radius).', dest='k')
+postal_parser.add_argument('--radius', type=float, default=None, help='If --nearest(_file) is used: Print the cameras within this distance in metres.', dest='radius')
+
+tiles_parser = subparsers.add_parser('tiles', aliases=['ti'], parents=[profile_parser])
+tiles_parser.add_argument('--csv_dir', '--csv', '-c', nargs=1, default='./csv/', help='Specify the csv directory from which the data will be loaded.', dest='csv_dir')
+tiles_parser.add_argument('--npy_dir', '--npy', default=None, help='Specify a binary dataset directory from which the data will be loaded (instead of the csv directory).', dest='npy_dir')
+tiles_parser.add_argument('--output_dir', '--output', '-o', default='./tiles/', help='Directory of the tile pyramid <zoom>/<x>/<y>.png.', dest='output_dir')
+tiles_parser.add_argument('--min_zoom', '-z', default=10, type=int, help='Lowest zoom level to render.', dest='min_zoom')
+tiles_parser.add_argument('--max_zoom', '-Z', default=14, type=int, help='Highest zoom level to render.', dest='max_zoom')
+tiles_parser.add_argument('--street_type', '--type', '-t', nargs='+', default=None, help='Render only streets of these types.', dest='types')
+tiles_parser.add_argument('--workers', '-w', default=1, type=int, help='How many processes should render tiles in parallel.', dest='workers')
+tiles_parser.add_argument('--no_cache', action='store_false', default=True, help='Render all tiles again, even if their content did not change.', dest='cache')
+
+update_parser = subparsers.add_parser('update', aliases=['up'], parents=[profile_parser])
+update_parser.add_argument('--npy_dir', '--npy', '-n', required=True, help='Binary dataset directory (written by parseXML with --npy_output) to update.', dest='npy_dir')
+update_parser.add_argument('--osc_file', '--osc', '-f', required=True, help='osmChange file (.osc) with the changes to apply.', dest='osc_file')
+update_parser.add_argument('--output_dir', '--output', '-o', default=None, help='Directory to write the updated dataset to (default: update the dataset in place).', dest='output_dir')
+
+convert_parser = subparsers.add_parser('convert', aliases=['co'], parents=[profile_parser])
+convert_parser.add_argument('--input_dir', '--input', '-i', required=True, help='csv directory or binary dataset directory to convert.', dest='input_dir')
+convert_parser.add_argument('--output_dir', '--output', '-o', required=True, help='Directory (resp. database file for sqlite) to write the converted data to.', dest='output_dir')
+convert_parser.add_argument('--format', '-f', default='npy', choices=['npy', 'csv', 'sqlite'], help='Output format: binary dataset (npy), csv files or sqlite database.', dest='format')
+
+serve_parser = subparsers.add_parser('serve', aliases=['se'], parents=[profile_parser])
+serve_parser.add_argument('--csv_dir', '--csv', '-c', nargs=1, default='./csv/', help='Specify the csv directory from which the data will be loaded.', dest='csv_dir')
+serve_parser.add_argument('--npy_dir', '--npy', default=None, help='Specify a binary dataset directory from which the data will be loaded (instead of the csv directory).', dest='npy_dir')
+serve_parser.add_argument('--host', default='127.0.0.1', help='Host address to listen on.', dest='host')
+serve_parser.add_argument('--port', '-p', default=8000, type=int, help='Port to listen on.', dest='port')
+serve_parser.add_argument('--socket', '-u', default=None, help='Listen on this unix socket instead of host and port.', dest='socket')
+serve_parser.add_argument('--metric', '-m', default='haversine', choices=['haversine', 'ellipsoidal', 'planar'], help='How to measure street lengths (see streets).', dest='metric')
 
 #############################################################################################################################################
 
@@ -0,0 +1,353 @@
+import zlib
+import lzma
+import struct
+import itertools
+import collections
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from TagRules import is_camera, street_info, postal_info, table_rows, set_rules, active_rules
+
+# Reader of OpenStreetMap PBF files (https://wiki.openstreetmap.org/wiki/PBF_Format) with its own protocol buffer decoding.
+# A file is a sequence of blocks: a 4 byte big-endian length, a BlobHeader message and a Blob message (raw or compressed data),
+# which contains an OSMHeader block or an OSMData block (PrimitiveBlock). All PrimitiveBlocks can be decoded independently.
+
+# wire types of protocol buffer fields
+VARINT, FIXED64, LENGTH, FIXED32 = 0, 1, 2, 5
+
+# features of the OSMHeader block which this reader understands
+SUPPORTED_FEATURES = ['OsmSchema-V0.6', 'DenseNodes']
+
+def read_varint(buf, pos):
+    '''
+    Decode the varint at position **pos** of **buf**, return (value, position after the varint).
+    '''
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 128:
+            return result, pos
+        shift += 7
+
+def iter_fields(buf):
+    '''
+    Yield (field_number, wire_type, value) for all fields of the protocol buffer message **buf**.
+    value is an int for varints and a memoryview (of the bytes) for all other wire types.
+    '''
+    buf = memoryview(buf)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == VARINT:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == LENGTH:
+            size, pos = read_varint(buf, pos)
+            value = buf[pos:pos + size]
+            pos += size
+        elif wire_type == FIXED64:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == FIXED32:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError('Unsupported wire type %s' % wire_type)
+        yield field, wire_type, value
+
+def decode_varints(buf):
+    '''
+    Decode a packed array of varints at once with NumPy, returns an uint64 array.
+    '''
+    data = np.frombuffer(buf, dtype = np.uint8)
+    if not len(data):
+        return np.empty(0, dtype = np.uint64)
+    # the last byte of each varint has no continuation bit
+    ends = np.flatnonzero(data < 128)
+    assert(ends[-1] == len(data) - 1), 'Truncated packed varints'
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shifts = (np.arange(len(data)) - np.repeat(starts, ends - starts + 1)) * 7
+    values = (data & 0x7f).astype(np.uint64) << shifts.astype(np.uint64)
+    # the 7 bit groups do not overlap, so adding them up is the same as or-ing them
+    return np.add.reduceat(values, starts)
+
+def decode_signed(buf):
+    # packed sint32/ sint64 (zigzag encoded) -> int64 array
+    values = decode_varints(buf)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+def decode_int(buf):
+    # packed int32/ int64/ uint32 (two's complement) -> int64 array
+    return decode_varints(buf).astype(np.int64)
+
+def zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+def int64(value):
+    # int64 fields are plain varints of the 64 bit two's complement
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def varint_list(buf, signed = False):
+    '''
+    Decode a packed array of varints to a list of ints. Short arrays (like the tags and nodes of a single way)
+    are decoded in Python, which is faster than the overhead of NumPy for them.
+    '''
+    if len(buf) > 64:
+        values = decode_signed(buf) if signed else decode_int(buf)
+        return values.tolist()
+    values = []
+    pos = 0
+    while pos < len(buf):
+        value, pos = read_varint(buf, pos)
+        values.append(zigzag(value) if signed else value)
+    return values
+
+def iter_blobs(FILE):
+    '''
+    Read only the framing of the PBF file **FILE** and yield (blob_type, offset, size) for each block,
+    where offset and size give the position of its Blob message in the file.
+    '''
+    with open(FILE, 'rb') as read_file:
+        while True:
+            length = read_file.read(4)
+            if not length:
+                break
+            header_size = struct.unpack('>I', length)[0]
+            blob_type, data_size = None, 0
+            for field, wire_type, value in iter_fields(read_file.read(header_size)):
+                if field == 1:
+                    blob_type = bytes(value).decode('utf-8')
+                elif field == 3:
+                    data_size = value
+            offset = read_file.tell()
+            yield blob_type, offset, data_size
+            read_file.seek(offset + data_size)
+
+def read_blob(FILE, offset, size):
+    '''
+    Read the Blob message at **offset** of the file and return its uncompressed data.
+    '''
+    with open(FILE, 'rb') as read_file:
+        read_file.seek(offset)
+        blob = read_file.read(size)
+    for field, wire_type, value in iter_fields(blob):
+        if field == 1:
+            return bytes(value)
+        if field == 3:
+            return zlib.decompress(value)
+        if field == 4:
+            return lzma.decompress(value)
+        if field in (5, 6, 7):
+            raise ValueError('Unsupported blob compression (field %s)' % field)
+    return b''
+
+def read_header(data):
+    '''
+    Decode an OSMHeader block. Returns the bounds (minlat, minlon, maxlat, maxlon) as strings (or None) and the required features.
+    '''
+    bounds = None
+    features = []
+    for field, wire_type, value in iter_fields(data):
+        if field == 1:
+            box = {}
+            for box_field, box_wire_type, box_value in iter_fields(value):
+                box[box_field] = zigzag(box_value)
+            # left, right, top, bottom in nanodegrees
+            bounds = tuple(str(box.get(key, 0) / 1e9) for key in [4, 1, 3, 2])
+        elif field == 4:
+            features.append(bytes(value).decode('utf-8'))
+    return bounds, features
+
+def _tags(keys, values, strings):
+    return [(strings[key], strings[value]) for (key, value) in zip(keys, values)]
+
+def decode_block(data):
+    '''
+    Decode a PrimitiveBlock. Returns the arrays (node_ids, lats, lons) of all nodes that are no camera
+    and the list of (tag, output) tuples of all cameras, ways and postal area relations (and rows of additional tables) in the order of the block,
+    where output is the same as the one of _get_camera, _get_street and _get_relation for xml elements.
+    '''
+    strings = []
+    groups = []
+    granularity, lat_offset, lon_offset = 100, 0, 0
+    for field, wire_type, value in iter_fields(data):
+        if field == 1:
+            strings = [bytes(string).decode('utf-8') for (string_field, string_wire_type, string) in iter_fields(value) if string_field == 1]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 19:
+            lat_offset = int64(value)
+        elif field == 20:
+            lon_offset = int64(value)
+
+    def coordinates(lats, lons):
+        # nanodegrees divided once, so the floats are the same as the ones parsed from the decimal strings of the xml files
+        return (lat_offset + granularity * np.asarray(lats, dtype = np.int64)) / 1e9, (lon_offset + granularity * np.asarray(lons, dtype = np.int64)) / 1e9
+
+    rules = active_rules()
+    node_ids, node_lats, node_lons = [], [], []
+    # nodes that are stored as single Node messages (rare in practice) are collected in lists
+    single_ids, single_lats, single_lons = [], [], []
+    elements = []
+    for group in groups:
+        for field, wire_type, value in iter_fields(group):
+            if field == 1:
+                node = _message_fields(value)
+                tags = _tags(varint_list(node[2]), varint_list(node[3]), strings)
+                node_id = zigzag(node[1])
+                lat = (lat_offset + granularity * zigzag(node[8])) / 1e9
+                lon = (lon_offset + granularity * zigzag(node[9])) / 1e9
+                if is_camera(tags):
+                    elements.append( ('node', (True, str(node_id), np.float64(lat), np.float64(lon))) )
+                else:
+                    single_ids.append(node_id)
+                    single_lats.append(lat)
+                    single_lons.append(lon)
+                if rules.extra['node']:
+                    elements += table_rows('node', tags, {'@id': str(node_id), '@lat': lat, '@lon': lon})
+            elif field == 2:
+                ids, lats, lons, tagged = _decode_dense(value, strings, rules.keys['node'])
+                lats, lons = coordinates(lats, lons)
+                cameras = []
+                for k, tags in tagged:
+                    if is_camera(tags):
+                        elements.append( ('node', (True, str(ids[k]), lats[k], lons[k])) )
+                        cameras.append(k)
+                    if rules.extra['node']:
+                        elements += table_rows('node', tags, {'@id': str(ids[k]), '@lat': float(lats[k]), '@lon': float(lons[k])})
+                if cameras:
+                    is_node = np.ones(len(ids), dtype = bool)
+                    is_node[cameras] = False
+                    ids, lats, lons = ids[is_node], lats[is_node], lons[is_node]
+                node_ids.append(ids)
+                node_lats.append(lats)
+                node_lons.append(lons)
+            elif field == 3:
+                way = _message_fields(value)
+                tags = _tags(varint_list(way[2]), varint_list(way[3]), strings)
+                refs = [str(ref) for ref in itertools.accumulate(varint_list(way[8], signed = True))]
+                elements.append( ('way', street_info(str(way[1]), tags, refs)) )
+                if rules.extra['way']:
+                    elements += table_rows('way', tags, {'@id': str(way[1]), '@nodes': refs})
+            elif field == 4:
+                relation = _message_fields(value)
+                tags = _tags(varint_list(relation[2]), varint_list(relation[3]), strings)
+                member_ids = itertools.accumulate(varint_list(relation[9], signed = True))
+                member_types = varint_list(relation[10])
+                # member type 1 is a way
+                member_ways = [str(member_id) for (member_id, member_type) in zip(member_ids, member_types) if member_type == 1]
+                output = postal_info(str(relation[1]), tags, member_ways)
+                if output:
+                    elements.append( ('relation', output) )
+                if rules.extra['relation']:
+                    elements += table_rows('relation', tags, {'@id': str(relation[1]), '@ways': member_ways})
+    node_ids.append(np.array(single_ids, dtype = np.int64))
+    node_lats.append(np.array(single_lats, dtype = np.float64))
+    node_lons.append(np.array(single_lons, dtype = np.float64))
+    return (np.concatenate(node_ids), np.concatenate(node_lats), np.concatenate(node_lons)), elements
+
+def _message_fields(buf):
+    # fields of a message by number, missing packed arrays are empty
+    fields = collections.defaultdict(bytes)
+    for field, wire_type, value in iter_fields(buf):
+        fields[field] = value
+    return fields
+
+def _decode_dense(buf, strings, keys):
+    '''
+    Decode DenseNodes: delta coded ids and coordinates and the tags of all nodes as one packed array
+    (key, value, key, value, 0, key, value, 0, ...). Returns ids, raw lats, raw lons and a list [..., (k, tags), ...]
+    of the nodes k that have any tag with one of the **keys** of the node rules (only those can match a table).
+    '''
+    fields = _message_fields(buf)
+    ids = np.cumsum(decode_signed(fields[1]))
+    lats = np.cumsum(decode_signed(fields[8]))
+    lons = np.cumsum(decode_signed(fields[9]))
+    keys_vals = decode_int(fields[10])
+    key_ids = [index for (index, string) in enumerate(strings) if string in keys and index > 0]
+    tagged = []
+    if len(keys_vals) and key_ids:
+        is_end = keys_vals == 0
+        if is_end.sum() == len(ids):
+            # position of each entry within the tags of its node, so that keys (even positions) and values can be told apart
+            positions = np.arange(len(keys_vals))
+            node_starts = np.maximum.accumulate(np.where(is_end, positions + 1, 0))
+            node_starts = np.append(0, node_starts[:-1])
+            is_key = ~is_end & ((positions - node_starts) % 2 == 0)
+            key_positions = np.flatnonzero(is_key & np.isin(keys_vals, key_ids))
+            ends = np.flatnonzero(is_end)
+            starts = np.append(0, ends[:-1] + 1)
+            for node in np.unique(np.cumsum(is_end)[key_positions]).tolist():
+                node_keys_vals = keys_vals[starts[node]:ends[node]].tolist()
+                tagged.append( (node, _tags(node_keys_vals[0::2], node_keys_vals[1::2], strings)) )
+        else:
+            # empty values (string 0) make the fast path ambiguous, read the tags node by node
+            key_ids = set(key_ids)
+            node, k = 0, 0
+            node_keys, node_vals = [], []
+            keys_vals = keys_vals.tolist()
+            while k < len(keys_vals):
+                if keys_vals[k] == 0:
+                    if key_ids.intersection(node_keys):
+                        tagged.append( (node, _tags(node_keys, node_vals, strings)) )
+                    node_keys, node_vals = [], []
+                    node += 1
+                    k += 1
+                    continue
+                node_keys.append(keys_vals[k])
+                node_vals.append(keys_vals[k + 1])
+                k += 2
+    return ids, lats, lons, tagged
+
+def _decode_blob(args):
+    # worker function: read and decode one OSMData block
+    FILE, offset, size = args
+    return decode_block(read_blob(FILE, offset, size))
+
+def read_pbf(FILE, workers = 1, progress = None):
+    '''
+    Read the PBF file **FILE** and yield for each block (in file order) the arrays (node_ids, lats, lons) of all its nodes
+    that are no camera and a list of (tag, output) tuples of its other elements, just like the parallel xml parse.
+    The bounds of the file header are yielded first as ('bounds', (minlat, minlon, maxlat, maxlon)).
+    With **workers** > 1 the blocks are read and decoded in a process pool (at most 4 blocks per worker are in flight).
+    **progress** is called with the size of each block after it was handed out.
+    '''
+    empty = (np.empty(0, dtype = np.int64), np.empty(0), np.empty(0))
+    data_blobs = []
+    for blob_type, offset, size in iter_blobs(FILE):
+        if blob_type == 'OSMHeader':
+            bounds, features = read_header(read_blob(FILE, offset, size))
+            unsupported = [feature for feature in features if feature not in SUPPORTED_FEATURES]
+            assert(not unsupported), 'Unsupported features of %s: %s' % (FILE, unsupported)
+            if bounds:
+                yield empty, [('bounds', bounds)]
+        elif blob_type == 'OSMData':
+            data_blobs.append( (FILE, offset, size) )
+    if workers > 1:
+        # the workers decode with the tag rules of this process
+        with ProcessPoolExecutor(max_workers = workers, initializer = set_rules, initargs = (active_rules(),)) as pool:
+            pending = collections.deque()
+            for blob in data_blobs:
+                pending.append( (blob[2], pool.submit(_decode_blob, blob)) )
+                if len(pending) >= workers * 4:
+                    size, future = pending.popleft()
+                    yield future.result()
+                    if progress:
+                        progress(size)
+            while pending:
+                size, future = pending.popleft()
+                yield future.result()
+                if progress:
+                    progress(size)
+    else:
+        for blob in data_blobs:
+            yield _decode_blob(blob)
+            if progress:
+                progress(blob[2])
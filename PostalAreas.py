@@ -1,136 +1,188 @@
 import pandas as pd
 import numpy as np
+import Profiler
+from SpatialIndex import PolygonSet, KDTree, spatial_join
+from Dataset import split_rings
+
+# tolerance (metres) of the simplified rings, which points are tested against before the full resolution (see PolygonSet.contains)
+COARSE_TOLERANCE = 10.0
 
 class PostalAreas(object):
 
-    def __init__(self, bounds, areas, area_nodes, area_lats, area_lons, cameras):
+    def __init__(self, bounds, areas, area_nodes, area_lats, area_lons, cameras, cams_to_areas = None):
         self.minlat, self.minlon =  np.float_(bounds['minlat']), np.float_(bounds['minlon'])
         self.maxlat, self.maxlon =  np.float_(bounds['maxlat']), np.float_(bounds['maxlon'])
         self.areas = areas
         self.area_nodes = area_nodes
         self.area_lats, self.area_lons = area_lats, area_lons
-        self.cameras = pd.DataFrame(cameras, index = ['lat', 'lon']).T
-        self.cube_lats = pd.DataFrame( {postal: [ min(self.area_lats[postal]) , max(self.area_lats[postal]) ] for postal in areas.keys()},
-                                       index = ['min', 'max'] ).T
-        self.cube_lons = pd.DataFrame( {postal: [ min(self.area_lons[postal]) , max(self.area_lons[postal]) ] for postal in areas.keys()},
-                                       index = ['min', 'max'] ).T
-        self.cams_to_areas = self.get_cams_to_areas()
+        if isinstance(cameras, pd.DataFrame):
+            self.cameras = cameras
+        else:
+            self.cameras = pd.DataFrame(cameras, index = ['lat', 'lon']).T
+        self.cameras = self.cameras.astype(np.float64)
+        # polygons of all postal areas as flat coordinate arrays and a bounding box index over them, built once
+        self.postal_codes = list(areas.keys())
+        with Profiler.stage('polygon index', len(self.postal_codes)):
+            self.polygons = PolygonSet.from_lists([self.area_lats[postal] for postal in self.postal_codes],
+                                                  [self.area_lons[postal] for postal in self.postal_codes])
+            self.area_index = self.polygons.build_index()
+        self.cube_lats = pd.DataFrame( {'min': self.polygons.min_lats, 'max': self.polygons.max_lats},
+                                       index = self.postal_codes, columns = ['min', 'max'] )
+        self.cube_lons = pd.DataFrame( {'min': self.polygons.min_lons, 'max': self.polygons.max_lons},
+                                       index = self.postal_codes, columns = ['min', 'max'] )
+        # the assignment of cameras to areas can be given (e.g. stored in a dataset), otherwise it is computed
+        self.cams_to_areas = self.get_cams_to_areas() if cams_to_areas is None else cams_to_areas
+        self._camera_index = None
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        '''
+        Create PostalAreas from the (memory-mapped) arrays of a binary Dataset.
+        '''
+        postal_codes = dataset.get_postal_codes()
+        def split(offsets, flat):
+            bounds = offsets.tolist()
+            values = flat.tolist()
+            return [values[start:end] for (start, end) in zip(bounds[:-1], bounds[1:])]
+        areas = dict(zip(postal_codes, [list(map(str, ways)) for ways in split(dataset.area_way_offsets, dataset.area_way_ids)]))
+        rings = split_rings(dataset)
+        area_lats = dict(zip(postal_codes, [lat_rings for (lat_rings, lon_rings) in rings]))
+        area_lons = dict(zip(postal_codes, [lon_rings for (lat_rings, lon_rings) in rings]))
+        area_nodes = dict(zip(dataset.area_node_ids.astype(str).tolist(),
+                              zip(dataset.area_node_lats.tolist(), dataset.area_node_lons.tolist())))
+        cameras = pd.DataFrame({'lat': np.asarray(dataset.camera_lats), 'lon': np.asarray(dataset.camera_lons)},
+                               index = dataset.camera_ids.astype(str), columns = ['lat', 'lon'])
+        # stored assignment: pairs of camera id and area index, sorted by area and camera
+        camera_ids = dataset.camera_area_ids.astype(str)
+        bounds = np.searchsorted(dataset.camera_area_idx, np.arange(len(postal_codes) + 1)).tolist()
+        cams_to_areas = { postal_code: camera_ids[bounds[k]:bounds[k+1]].tolist() for (k, postal_code) in enumerate(postal_codes) }
+        return cls(dataset.get_bounds(), areas, area_nodes, area_lats, area_lons, cameras, cams_to_areas)
+
+    @classmethod
+    def from_database(cls, database, bbox = None, postal_codes = None, all_cameras = False):
+        '''
+        Create PostalAreas from the postal areas of a Database that intersect the **bbox** (minlat, minlon, maxlat, maxlon)
+        and have one of the **postal_codes** (all areas if None). Only these areas and the cameras around them are loaded,
+        the stored assignment of the cameras to the areas is used.
+        With **all_cameras**, all cameras (in the bbox) are loaded instead, e.g. for nearest camera queries.
+        '''
+        areas = database.query_areas(bbox, postal_codes)
+        camera_ids, camera_lats, camera_lons = database.query_cameras(bbox) if all_cameras else areas['cameras']
+        cameras = pd.DataFrame({'lat': np.array(camera_lats, dtype = np.float64), 'lon': np.array(camera_lons, dtype = np.float64)},
+                               index = [str(camera_id) for camera_id in camera_ids], columns = ['lat', 'lon'])
+        bounds = dict(zip(['minlat', 'minlon', 'maxlat', 'maxlon'], bbox)) if bbox is not None else database.get_bounds()
+        return cls(bounds, dict(zip(areas['postal_codes'], areas['ways'])), {}, dict(zip(areas['postal_codes'], areas['lats'])),
+                   dict(zip(areas['postal_codes'], areas['lons'])), cameras, areas['cams_to_areas'])
 
     def get_cubes_to_cam(self, cam_id):
         # get lat and lon of camera
-        cam_lat = self.cameras.ix[cam_id, 'lat']
-        cam_lon = self.cameras.ix[cam_id, 'lon']
-        # get rows of cube dataframes that 'contain' the camera in one direction (lat resp. lon)
-        cubes_to_cam_lats = self.cube_lats[(self.cube_lats['min'] <= cam_lat) & (self.cube_lats['max'] >= cam_lat)]
-        cubes_to_cam_lons = self.cube_lons[(self.cube_lons['min'] <= cam_lon) & (self.cube_lons['max'] >= cam_lon)]
-        # get only rows of cubes that contain the camera in both lat and lon direction
-        cubes_to_cam = cubes_to_cam_lats.loc[ cubes_to_cam_lats.index.intersection(cubes_to_cam_lons.index) ]
+        cam_lat = self.cameras.loc[cam_id, 'lat']
+        cam_lon = self.cameras.loc[cam_id, 'lon']
+        # query the bounding box index for the cubes that contain the camera
+        point_idx, cube_idx = self.area_index.query_points([cam_lat], [cam_lon])
         # return the containing cubes (by index of postal codes)
-        return cubes_to_cam.index
+        return self.cube_lats.index[np.sort(cube_idx)]
 
     def get_cams_to_cube(self, postal_code):
         # get min/ max lat and lon of cube to postal code area
-        cube_min_lat, cube_max_lat = self.cube_lats.ix[postal_code, 'min'], self.cube_lats.ix[postal_code, 'max']
-        cube_min_lon, cube_max_lon = self.cube_lons.ix[postal_code, 'min'], self.cube_lons.ix[postal_code, 'max']
-        # get rows of cameras dataframes that are 'contained' in the cube in one direction (lat resp. lon)
-        cams_to_cube_lats = self.cameras.ix[ (self.cameras['lat'] <= cube_max_lat) & (self.cameras['lat'] >= cube_min_lat) , 'lat']
-        cams_to_cube_lons = self.cameras.ix[ (self.cameras['lon'] <= cube_max_lon) & (self.cameras['lon'] >= cube_min_lon) , 'lon']
-        # get only rows of cameras that are contained in the cube in both lat and lon direction
-        cams_to_cube = cams_to_cube_lats.loc[ cams_to_cube_lats.index.intersection(cams_to_cube_lons.index) ]
+        cube_min_lat, cube_max_lat = self.cube_lats.loc[postal_code, 'min'], self.cube_lats.loc[postal_code, 'max']
+        cube_min_lon, cube_max_lon = self.cube_lons.loc[postal_code, 'min'], self.cube_lons.loc[postal_code, 'max']
+        # get rows of cameras that are contained in the cube in both lat and lon direction
+        in_cube = ( (self.cameras['lat'] <= cube_max_lat) & (self.cameras['lat'] >= cube_min_lat)
+                    & (self.cameras['lon'] <= cube_max_lon) & (self.cameras['lon'] >= cube_min_lon) )
         # return the contained cameras (by index of its id)
-        return cams_to_cube.index
+        return self.cameras.index[in_cube.values]
 
     def get_cams_to_areas(self):
-        cams_to_areas = dict.fromkeys( self.areas.keys(), [] )
-        for postal_code in cams_to_areas:
-            cams_in_area = self.get_cams_to_area(postal_code)
-            cams_to_areas[postal_code] = cams_in_area
-        return cams_to_areas
+        # assign all cameras to the postal areas in one spatial join
+        return self.assign_points(self.cameras.index, self.cameras['lat'].values, self.cameras['lon'].values)
+
+    def assign_points(self, point_ids, lats, lons):
+        '''
+        Assign any point dataset to the postal areas with one bulk spatial join.
+        Return a dict {..., postal_code: [point_id1, point_id2, ..], ...} (with an empty list for areas without points).
+        '''
+        point_ids = np.asarray(point_ids)
+        with Profiler.stage('spatial join', len(point_ids)):
+            point_idx, polygon_idx = spatial_join(lats, lons, self.polygons, self.area_index, coarse_tolerance = COARSE_TOLERANCE)
+        # the pairs are sorted by polygon, so split them at the polygon boundaries
+        bounds = np.searchsorted(polygon_idx, np.arange(len(self.postal_codes) + 1)).tolist()
+        return { postal_code: point_ids[point_idx[bounds[k]:bounds[k+1]]].tolist() for (k, postal_code) in enumerate(self.postal_codes) }
 
     def get_cams_to_area(self, postal_code):
-        cams_in_area = []
-        for cam_id in self.get_cams_to_cube(postal_code):
-            cubes_to_cam = self.get_cubes_to_cam(cam_id)
-            if len(cubes_to_cam) == 1:
-                #print('Camera has unique postal code cube, so it must be the postal area!')
-                cams_in_area.append(cam_id)
+        # candidates are the cameras in the cube of the postal area, test all of them at once against all edges of the area
+        cams_in_cube = self.get_cams_to_cube(postal_code)
+        polygon = self.postal_codes.index(postal_code)
+        cam_lats = self.cameras.loc[cams_in_cube, 'lat'].values
+        cam_lons = self.cameras.loc[cams_in_cube, 'lon'].values
+        inside = self.polygons.contains(polygon, cam_lats, cam_lons, coarse_tolerance = COARSE_TOLERANCE)
+        return list(cams_in_cube[inside])
+
+    @property
+    def camera_index(self):
+        # KD-tree over the camera coordinates, built on first use
+        if self._camera_index is None:
+            with Profiler.stage('camera index', len(self.cameras)):
+                self._camera_index = KDTree(self.cameras['lat'].values, self.cameras['lon'].values)
+        return self._camera_index
+
+    def nearest_cameras(self, lats, lons, k = 1, radius = None, verbose = True):
+        '''
+        Find the **k** nearest cameras of all points (lats, lons) at once, or with **radius** all cameras within radius metres
+        (at most k of them, if k is given). Returns a DataFrame with one row per pair of point (its position in lats/ lons)
+        and camera: ['point', 'rank', 'camera', 'lat', 'lon', 'distance'], sorted by point and distance in metres.
+        '''
+        lats, lons = np.atleast_1d(lats), np.atleast_1d(lons)
+        with Profiler.stage('nearest cameras', len(lats)):
+            if radius is None:
+                item_idx, distances = self.camera_index.query(lats, lons, k or 1)
+                point_idx, ranks = np.nonzero(item_idx >= 0)
+                item_idx, distances = item_idx[point_idx, ranks], distances[point_idx, ranks]
             else:
-                # cam coordinates for testing whether cam is in the area
-                cam_coords = (self.cameras.ix[cam_id, 'lat'], self.cameras.ix[cam_id, 'lon'])
-                cube_min_lat, cube_max_lat = self.cube_lats.ix[postal_code, 'min'], self.cube_lats.ix[postal_code, 'max']
-                cube_min_lon, cube_max_lon = self.cube_lons.ix[postal_code, 'min'], self.cube_lons.ix[postal_code, 'max']
-                eps = (np.float_(cube_max_lat) - np.float_(cube_min_lat)) / 100
-                # some point outside the postal area from which we start a ray to the cam position
-                outside_point = (np.float_(cube_min_lat) - eps, np.float_(cube_max_lat))
-                area_lats = np.float_(self.area_lats[postal_code])
-                area_lons = np.float_(self.area_lons[postal_code])
-                node_total = len(area_lats)
-                # coordinates of nodes that define the area
-                node_coords = list(zip(area_lats, area_lons))
-                #print('zip:')
-                #print(list(node_coords))
-                # count how many sides the ray intersects
-                # if the counter is odd, the cam is inside the area
-                intersection_counter = 0
-                # check every border side if the ray intersects
-                for i in range(node_total):
-                    x = node_coords[i]
-                    y = node_coords[((i+1) % (node_total))]
-                    if self.rays_intersect(np.float_(x), np.float_(y), np.float_(outside_point), np.float_(cam_coords)):
-                        intersection_counter += 1
-                if intersection_counter % 2 == 1:
-                    cams_in_area.append(cam_id)
-        return cams_in_area
-
-    def rays_intersect(self, ray1_node1, ray1_node2, ray2_node1, ray2_node2):
-        # transform ray1 (as an infinite line) to linear standard form ax + by + c = 0
-        a1 = ray1_node1[1] - ray1_node2[1]
-        b1 = ray1_node2[0] - ray1_node1[0]
-        c1 = ( ray1_node2[0] * ray1_node1[1] ) - ( ray1_node1[0] * ray1_node2[1] )
-        # by plugging in nodes of ray2 in the linear equation, check whether points of ray2 are on this line or on different sides of it (i.e. result in different signs and so intersect it)
-        result1 = (a1 * ray2_node1[0]) + (b1 * ray2_node1[1]) + c1
-        result2 = (a1 * ray2_node1[0]) + (b1 * ray2_node1[1]) + c1
-        # if both results have the same sign, both nodes of ray2 are on the same side of the line, i.e. cannot intersect it
-        if (result1 * result2 > 0):
-            return False
-        # if the nodes are on different sides of the line, check whether ray2 intersects not only the infinite line of ray1, but even the finite length ray1
-        # for testing do the same computations as above with roles of ray1 and ray2 interchanged
-        a2 = ray2_node2[1] - ray2_node1[1]
-        b2 = ray2_node1[0] - ray2_node2[0]
-        c2 = ( ray2_node2[0] * ray2_node1[1] ) - ( ray2_node1[0] * ray2_node2[1] )
-        # get results when plugging in points of ray1
-        result1 = (a2 * ray1_node1[0]) + (b2 * ray1_node1[1]) + c2
-        result2 = (a2 * ray1_node1[0]) + (b2 * ray1_node1[1]) + c2
-        if (result1 * result2 > 0):
-            return False
-        # at this point, the both rays either intersect exactly once or they are collinear
-        if ((a1 * b2) - (a2 * b1) == 0.0):
-            # just handle the collinear case as no intersection
-            return False
-        # only remaining case is that the rays intersect
-        return True
+                point_idx, item_idx, distances = self.camera_index.query_radius(lats, lons, radius)
+                ranks = np.arange(len(point_idx)) - np.searchsorted(point_idx, point_idx)
+                if k:
+                    point_idx, item_idx, distances, ranks = (array[ranks < k] for array in (point_idx, item_idx, distances, ranks))
+        result = pd.DataFrame({'point': point_idx, 'rank': ranks + 1, 'camera': self.cameras.index[item_idx],
+                               'lat': self.cameras['lat'].values[item_idx], 'lon': self.cameras['lon'].values[item_idx],
+                               'distance': distances}, columns = ['point', 'rank', 'camera', 'lat', 'lon', 'distance'])
+        if verbose:
+            print('\nThe nearest cameras of the given points are:\n')
+            print(result.to_string(index = False))
+        return result
 
     def get_camera_count(self, postal_code):
         cams = self.cams_to_areas[postal_code]
         return len(cams)
 
-    def get_camera_counts(self):
+    def get_camera_counts(self, verbose = True):
         cam_counts = {}
         for postal_code in self.areas:
             cam_count = self.get_camera_count(postal_code)
             cam_counts[postal_code] = cam_count
-        cam_counts_series = pd.Series(cam_counts).order(ascending=False) #.sort(ascending = False)
-        print('\nThe cam counts are listed here:\n')
-        print(cam_counts_series.to_string())
-
-    def run_postals(self, cam_counts, postal_area):
+        # pandas before 0.17 has no sort_values, but order
+        if hasattr(pd.Series, 'sort_values'):
+            cam_counts_series = pd.Series(cam_counts).sort_values(ascending=False)
+        else:
+            cam_counts_series = pd.Series(cam_counts).order(ascending=False)
+        if verbose:
+            print('\nThe cam counts are listed here:\n')
+            print(cam_counts_series.to_string())
+        return cam_counts_series
+
+    def run_postals(self, cam_counts, postal_area, nearest = None, k = None, radius = None):
         if cam_counts:
-            self.get_camera_counts()
+            with Profiler.stage('get_camera_counts'):
+                self.get_camera_counts()
         if postal_area:
             assert(postal_area in self.areas.keys()), 'Given postal area is no valid postal code.'
-            cams = self.get_cams_to_area(postal_area)
+            with Profiler.stage('get_cams_to_area'):
+                cams = self.get_cams_to_area(postal_area)
             print('The camera IDs of the given postal area %s are:' % postal_area)
             print(cams)
+        if nearest is not None:
+            with Profiler.stage('nearest_cameras'):
+                self.nearest_cameras(nearest[0], nearest[1], k, radius)
 
 #############################################################################################################################
 
@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import tracemalloc
+
+# the active profiler, stages are only recorded while profiling is enabled (see enable)
+_PROFILER = None
+
+def peak_memory():
+    '''
+    Return the peak resident memory (in bytes) of this process since the last call of reset_peak_memory.
+    '''
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    # no proc file system: peak of the whole lifetime of the process (in kilobytes on linux, in bytes on mac os)
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def current_memory():
+    '''
+    Return the current resident memory (in bytes) of this process (the peak without proc file system).
+    '''
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return peak_memory()
+
+def reset_peak_memory():
+    # the peak up to now still counts for the open stages of the active profiler
+    if _PROFILER is not None:
+        _PROFILER._update_peaks()
+    _reset_peak_memory()
+
+def _reset_peak_memory():
+    # on linux, writing 5 to clear_refs resets the peak resident memory of the process
+    try:
+        with open('/proc/self/clear_refs', 'w') as refs_file:
+            refs_file.write('5')
+    except IOError:
+        pass
+
+class _NullStage(object):
+    # stage of a disabled profiler, costs only the with statement
+    items = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage(object):
+
+    def __init__(self, profiler, name, items):
+        self.profiler = profiler
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.profiler._start(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler._stop(self)
+        return False
+
+class Profiler(object):
+    '''
+    Record wall time, cpu time, peak resident memory (and with trace_memory the peak of the memory allocated by python,
+    see tracemalloc) and item count of nested stages. A stage is a with block (see stage), whose items can be set inside:
+        with stage('parse xml') as current:
+            ...
+            current.items = element_count
+    Peaks include those of the nested stages. With cprofile_stage, every stage of that name is run under cProfile and the
+    statistics are dumped to cprofile_file (default profile_<stage>.prof, readable with pstats or snakeviz).
+    '''
+
+    def __init__(self, trace_memory = False, cprofile_stage = None, cprofile_file = None):
+        self.trace_memory = trace_memory
+        self.cprofile_stage = cprofile_stage
+        self.cprofile_file = cprofile_file or 'profile_%s.prof' % (cprofile_stage or '').replace(' ', '_').replace(':', '').replace('/', '_')
+        self.cprofile = None
+        self.records = []           # (name, depth, start, wall, cpu, peak rss, peak traced, items) of all finished stages
+        self.open_stages = []
+        self.start_time = time.time()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stage(self, name, items = None):
+        return _Stage(self, name, items)
+
+    def _update_peaks(self):
+        # carry the peaks up to now over to all open stages, before the peaks are reset for a new stage
+        peak_rss = peak_memory()
+        peak_traced = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        for stage in self.open_stages:
+            stage.peak_rss = max(stage.peak_rss, peak_rss)
+            if self.trace_memory:
+                stage.peak_traced = max(stage.peak_traced, peak_traced)
+
+    def _start(self, stage):
+        self._update_peaks()
+        _reset_peak_memory()
+        stage.peak_rss = 0
+        stage.peak_traced = 0
+        if self.trace_memory and hasattr(tracemalloc, 'reset_peak'):
+            # (before python 3.9, the traced peak is the one of the whole run)
+            tracemalloc.reset_peak()
+        if stage.name == self.cprofile_stage and self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+            stage.cprofile = True
+        else:
+            stage.cprofile = False
+        self.open_stages.append(stage)
+        stage.start = time.time()
+        stage.cpu = time.process_time()
+        if stage.cprofile:
+            self.cprofile.enable()
+
+    def _stop(self, stage):
+        wall = time.time() - stage.start
+        cpu = time.process_time() - stage.cpu
+        if stage.cprofile:
+            self.cprofile.disable()
+        self._update_peaks()
+        self.open_stages.remove(stage)
+        self.records.append( (stage.name, len(self.open_stages), stage.start - self.start_time, wall, cpu, stage.peak_rss,
+                              stage.peak_traced if self.trace_memory else None, stage.items) )
+
+    def record(self, name, wall, cpu = None, items = None):
+        '''
+        Add a stage that was measured elsewhere (e.g. in a background thread), it ends now.
+        '''
+        self.records.append( (name, len(self.open_stages), time.time() - self.start_time - wall, wall, cpu, None, None, items) )
+
+    def summary(self):
+        '''
+        Return the stages aggregated by name and nesting depth in order of their first start:
+        [(name, depth, calls, wall, cpu, peak rss, peak traced, items), ...].
+        '''
+        stages = {}
+        for (name, depth, start, wall, cpu, peak_rss, peak_traced, items) in sorted(self.records, key = lambda record: (record[2], record[1])):
+            if (name, depth) not in stages:
+                stages[(name, depth)] = [name, depth, 0, 0.0, None, None, None, None]
+            stage = stages[(name, depth)]
+            stage[2] += 1
+            stage[3] += wall
+            for (k, value) in [(4, cpu), (7, items)]:
+                if value is not None:
+                    stage[k] = (stage[k] or 0) + value
+            for (k, value) in [(5, peak_rss), (6, peak_traced)]:
+                if value is not None:
+                    stage[k] = max(stage[k] or 0, value)
+        return [tuple(stage) for stage in stages.values()]
+
+    def print_summary(self):
+        print('\nProfile:')
+        print('\t%-40s %6s %10s %10s %14s %14s %12s' % ('stage', 'calls', 'seconds', 'cpu s', 'peak RSS (MB)', 'peak py (MB)', 'items'))
+        show = lambda value, pattern: pattern % value if value is not None else '-'
+        for (name, depth, calls, wall, cpu, peak_rss, peak_traced, items) in self.summary():
+            print('\t%-40s %6s %10.3f %10s %14s %14s %12s' % ('  ' * depth + name, calls, wall, show(cpu, '%.3f'),
+                  show(peak_rss and peak_rss / 2.0**20, '%.1f'), show(peak_traced and peak_traced / 2.0**20, '%.1f'), show(items, '%s')))
+
+    def write_json(self, json_file):
+        # all stages (in order of their end) and the summary
+        columns = ['name', 'depth', 'start', 'seconds', 'cpu_seconds', 'peak_rss', 'peak_traced', 'items']
+        summary_columns = ['name', 'depth', 'calls', 'seconds', 'cpu_seconds', 'peak_rss', 'peak_traced', 'items']
+        with open(json_file, 'w') as write_file:
+            json.dump({'stages': [dict(zip(columns, record)) for record in self.records],
+                       'summary': [dict(zip(summary_columns, stage)) for stage in self.summary()]}, write_file, indent = 1)
+
+    def write_trace(self, trace_file):
+        # chrome trace event format (complete events in microseconds), to open in chrome://tracing or https://ui.perfetto.dev
+        events = []
+        for (name, depth, start, wall, cpu, peak_rss, peak_traced, items) in self.records:
+            events.append({'name': name, 'cat': 'stage', 'ph': 'X', 'ts': int(start * 1e6), 'dur': int(wall * 1e6), 'pid': os.getpid(), 'tid': 1,
+                           'args': {'cpu_seconds': cpu, 'peak_rss': peak_rss, 'peak_traced': peak_traced, 'items': items}})
+        with open(trace_file, 'w') as write_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, write_file)
+
+    def report(self, json_file = None, trace_file = None):
+        '''
+        Print the summary table and write the stages to a json and/or chrome trace file and the cProfile statistics.
+        '''
+        self.print_summary()
+        if json_file:
+            self.write_json(json_file)
+            print('Written profile to %s' % json_file)
+        if trace_file:
+            self.write_trace(trace_file)
+            print('Written chrome trace to %s' % trace_file)
+        if self.cprofile_stage:
+            if self.cprofile is None:
+                print('No stage %s was run, no cProfile statistics written.' % self.cprofile_stage)
+            else:
+                self.cprofile.dump_stats(self.cprofile_file)
+                print('Written cProfile statistics of stage %s to %s' % (self.cprofile_stage, self.cprofile_file))
+
+def enable(trace_memory = False, cprofile_stage = None, cprofile_file = None):
+    '''
+    Start recording the stages of all instrumented code in a new Profiler, which is returned.
+    '''
+    global _PROFILER
+    _PROFILER = Profiler(trace_memory, cprofile_stage, cprofile_file)
+    return _PROFILER
+
+def disable():
+    '''
+    Stop recording and return the Profiler (None if profiling was not enabled).
+    '''
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    if profiler is not None and profiler.trace_memory:
+        tracemalloc.stop()
+    return profiler
+
+def stage(name, items = None):
+    '''
+    Return a with block that records the stage **name** in the active Profiler (and does nothing if profiling is disabled).
+    '''
+    if _PROFILER is None:
+        return _NULL_STAGE
+    return _PROFILER.stage(name, items)
+
+def record(name, wall, cpu = None, items = None):
+    if _PROFILER is not None:
+        _PROFILER.record(name, wall, cpu, items)
@@ -0,0 +1,142 @@
+import numpy as np
+from Geometry import take_polylines
+from Simplify import METRES_PER_DEGREE
+
+# style of each street type: (RGB color, line width in pixels, drawing order), major streets are drawn on top
+STREET_STYLES = {'motorway': ((200, 40, 60), 3, 10), 'motorway_link': ((200, 40, 60), 2, 10),
+                 'trunk': ((220, 90, 40), 3, 9), 'trunk_link': ((220, 90, 40), 2, 9),
+                 'primary': ((230, 140, 20), 2, 8), 'primary_link': ((230, 140, 20), 2, 8),
+                 'secondary': ((190, 160, 0), 2, 7), 'secondary_link': ((190, 160, 0), 1, 7),
+                 'tertiary': ((90, 90, 90), 1, 6), 'tertiary_link': ((90, 90, 90), 1, 6),
+                 'residential': ((40, 40, 40), 1, 5), 'unclassified': ((40, 40, 40), 1, 5),
+                 'living_street': ((40, 40, 40), 1, 5), 'service': ((140, 140, 140), 1, 3),
+                 'footway': ((120, 170, 120), 1, 1), 'path': ((120, 170, 120), 1, 1),
+                 'cycleway': ((80, 120, 220), 1, 2), 'track': ((160, 120, 80), 1, 1)}
+DEFAULT_STYLE = ((0, 0, 0), 1, 0)
+
+def image_size(bounds, width = None, height = None, dpi = 100):
+    '''
+    Return (width, height) in pixels for the map excerpt **bounds** = (minlat, minlon, maxlat, maxlon).
+    A missing side is computed from the other one with the aspect ratio of the excerpt (longitudes shrink with cos(lat)),
+    without any side the width is the one of a 6.4 inch figure at **dpi**.
+    '''
+    minlat, minlon, maxlat, maxlon = bounds
+    aspect = (maxlat - minlat) / ((maxlon - minlon) * np.cos(np.radians((minlat + maxlat) / 2)))
+    if width is None and height is None:
+        width = int(round(6.4 * dpi))
+    if height is None:
+        height = int(round(width * aspect))
+    if width is None:
+        width = int(round(height / aspect))
+    return max(1, int(width)), max(1, int(height))
+
+def pixel_size(bounds, width):
+    '''
+    Return the width of one pixel in metres (at the middle latitude) of an image with **width** pixels covering **bounds**.
+    '''
+    minlat, minlon, maxlat, maxlon = bounds
+    return (maxlon - minlon) * METRES_PER_DEGREE * np.cos(np.radians((minlat + maxlat) / 2)) / width
+
+def project(lats, lons, bounds, width, height):
+    '''
+    Project coordinates linearly to pixel coordinates (x to the right, y downwards) of an image covering **bounds**.
+    '''
+    minlat, minlon, maxlat, maxlon = bounds
+    xs = (np.asarray(lons) - minlon) / (maxlon - minlon) * width
+    ys = (maxlat - np.asarray(lats)) / (maxlat - minlat) * height
+    return xs, ys
+
+def draw_polylines(image, xs, ys, offsets, color, width = 1, max_samples = 1 << 22):
+    '''
+    Rasterize many polylines at once into the NumPy image array **image** (height x width x channels).
+    Polyline k consists of the points offsets[k] to offsets[k+1]-1 of the pixel coordinates xs/ ys.
+    All segments are clipped to the image (Liang-Barsky) and sampled in steps of at most one pixel,
+    then every sample sets a square brush of **width** pixels to **color**.
+    '''
+    height, image_width = image.shape[:2]
+    xs = np.asarray(xs, dtype = np.float64)
+    ys = np.asarray(ys, dtype = np.float64)
+    offsets = np.asarray(offsets, dtype = np.int64)
+    if len(xs) < 2:
+        return image
+    # segment i connects point i and i+1, but not across polylines
+    is_segment = np.ones(len(xs) - 1, dtype = bool)
+    ends = offsets[1:-1] - 1
+    is_segment[ends[(ends >= 0) & (ends < len(xs) - 1)]] = False
+    starts = np.flatnonzero(is_segment)
+    x0, y0, x1, y1 = xs[starts], ys[starts], xs[starts + 1], ys[starts + 1]
+    # clip the segments to the image extended by the brush
+    margin = width
+    dx, dy = x1 - x0, y1 - y0
+    t0 = np.zeros(len(x0))
+    t1 = np.ones(len(x0))
+    keep = np.ones(len(x0), dtype = bool)
+    for (p, q) in [(-dx, x0 + margin), (dx, image_width + margin - x0), (-dy, y0 + margin), (dy, height + margin - y0)]:
+        parallel = p == 0
+        keep &= ~(parallel & (q < 0))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            r = q / p
+        t0 = np.where(~parallel & (p < 0), np.maximum(t0, r), t0)
+        t1 = np.where(~parallel & (p > 0), np.minimum(t1, r), t1)
+    keep &= t0 <= t1
+    x0, y0, dx, dy, t0, t1 = x0[keep], y0[keep], dx[keep], dy[keep], t0[keep], t1[keep]
+    x0, y0 = x0 + t0 * dx, y0 + t0 * dy
+    dx, dy = dx * (t1 - t0), dy * (t1 - t0)
+    # number of samples of each segment
+    steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64) + 1
+    brush = np.arange(width) - (width - 1) // 2
+    color = np.asarray(color, dtype = image.dtype)
+    # process the segments in chunks of at most max_samples samples
+    chunk_ends = np.searchsorted(np.cumsum(steps), np.arange(max_samples, steps.sum() + max_samples, max_samples), side = 'right')
+    chunk_start = 0
+    for chunk_end in np.append(chunk_ends, len(steps)):
+        chunk_end = max(chunk_end, chunk_start + 1)
+        if chunk_start >= len(steps):
+            break
+        chunk = slice(chunk_start, chunk_end)
+        chunk_steps = steps[chunk]
+        segment = np.repeat(np.arange(len(chunk_steps)), chunk_steps)
+        sample = np.arange(chunk_steps.sum()) - np.repeat(np.cumsum(chunk_steps) - chunk_steps, chunk_steps)
+        t = sample / np.maximum(chunk_steps - 1, 1)[segment]
+        px = np.floor(x0[chunk][segment] + t * dx[chunk][segment]).astype(np.int64)
+        py = np.floor(y0[chunk][segment] + t * dy[chunk][segment]).astype(np.int64)
+        for oy in brush:
+            for ox in brush:
+                bx, by = px + ox, py + oy
+                visible = (bx >= 0) & (bx < image_width) & (by >= 0) & (by < height)
+                image[by[visible], bx[visible]] = color
+        chunk_start = chunk_end
+    return image
+
+def draw_streets(image, xs, ys, offsets, types = None, styles = None):
+    '''
+    Draw streets given by the pixel coordinates xs/ ys and offsets into **image**, styled by their **types**
+    (see render_streets). For images with an alpha channel the streets are drawn opaque.
+    '''
+    styles = STREET_STYLES if styles is None else styles
+    alpha = (255,) if image.shape[2] == 4 else ()
+    offsets = np.asarray(offsets, dtype = np.int64)
+    if types is None:
+        color, line_width, order = DEFAULT_STYLE
+        return draw_polylines(image, xs, ys, offsets, tuple(color) + alpha, line_width)
+    types = np.asarray(types, dtype = object)
+    type_names = sorted(set(types), key = lambda street_type: styles.get(street_type, DEFAULT_STYLE)[2])
+    for street_type in type_names:
+        color, line_width, order = styles.get(street_type, DEFAULT_STYLE)
+        point_idx, type_offsets = take_polylines(offsets, np.flatnonzero(types == street_type))
+        draw_polylines(image, xs[point_idx], ys[point_idx], type_offsets, tuple(color) + alpha, line_width)
+    return image
+
+def render_streets(lats, lons, offsets, bounds, types = None, width = None, height = None, dpi = 100,
+                   styles = None, background = (255, 255, 255)):
+    '''
+    Render all streets (flat coordinate arrays **lats**/ **lons** with **offsets**) in one pass into an in-memory RGB image
+    covering **bounds** = (minlat, minlon, maxlat, maxlon) and return it as NumPy array.
+    With **types** (one street type per street) the streets are styled by STREET_STYLES (or the given **styles**),
+    the types are drawn one after another in the order of their style.
+    '''
+    width, height = image_size(bounds, width, height, dpi)
+    image = np.empty((height, width, len(background)), dtype = np.uint8)
+    image[:, :] = background
+    xs, ys = project(lats, lons, bounds, width, height)
+    return draw_streets(image, xs, ys, offsets, types, styles)
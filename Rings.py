@@ -0,0 +1,115 @@
+import numpy as np
+from Geometry import classify_points, OUTSIDE, INSIDE
+
+def assemble_rings(way_node_lists):
+    '''
+    Stitch ways (lists of node ids) into rings by their shared end nodes, reversing ways where needed.
+    The next way of a ring is found through a hash of the end nodes of all open ways, so the assembly is linear
+    in the number of nodes, whatever the order of the ways. Closed ways are rings on their own.
+    Returns the rings as closed node lists (first node repeated at the end) and the number of rings whose ways
+    did not close (e.g. because the excerpt cuts the area), those are closed by a straight edge.
+    '''
+    ways = [list(way_nodes) for way_nodes in way_node_lists if len(way_nodes) >= 2]
+    ends = {}
+    for (k, way_nodes) in enumerate(ways):
+        if way_nodes[0] != way_nodes[-1]:
+            ends.setdefault(way_nodes[0], []).append(k)
+            ends.setdefault(way_nodes[-1], []).append(k)
+    used = [False] * len(ways)
+
+    def extend(ring):
+        # append unused ways at the end of the ring until it is closed or no way continues it
+        while ring[0] != ring[-1]:
+            candidates = ends.get(ring[-1], [])
+            while candidates and used[candidates[-1]]:
+                candidates.pop()
+            if not candidates:
+                return
+            k = candidates.pop()
+            used[k] = True
+            ring += ways[k][1:] if ways[k][0] == ring[-1] else ways[k][-2::-1]
+
+    rings = []
+    open_count = 0
+    for (k, way_nodes) in enumerate(ways):
+        if used[k]:
+            continue
+        used[k] = True
+        ring = list(way_nodes)
+        extend(ring)
+        if ring[0] != ring[-1]:
+            # the first way may lie in the middle of a chain, so continue at its other end as well
+            ring.reverse()
+            extend(ring)
+            if ring[0] != ring[-1]:
+                open_count += 1
+                ring.append(ring[0])
+        rings.append(ring)
+    return rings, open_count
+
+def area_rings(way_ids, way_nodes, lookup):
+    '''
+    Build the rings of an area from its member **way_ids**, given the node lists **way_nodes** {..., way_id: [node1, node2, ..], ...}
+    (missing ways are skipped) and **lookup**, a function that returns (lats, lons, found) for an array of node ids
+    (e.g. NodeStore.lookup). Rings contained in an even number of other rings are outer rings (counterclockwise),
+    the others are holes (clockwise), so the result does not depend on the member roles and matches the even-odd rule.
+    Returns the flat coordinate arrays (lats, lons) of the closed outer rings followed by the holes, the ring offsets
+    (ring k consists of the points ring_offsets[k] to ring_offsets[k+1]-1), a boolean array that flags the holes,
+    the array of node ids without coordinates (left out) and the number of rings that were not closed.
+    '''
+    rings, open_count = assemble_rings([way_nodes[way_id] for way_id in way_ids if way_id in way_nodes])
+    node_ids = np.array([node_id for ring in rings for node_id in ring], dtype = np.int64)
+    lats, lons, found = lookup(node_ids)
+    bounds = np.cumsum([0] + [len(ring) for ring in rings])
+    ring_coords = [(lats[start:end][found[start:end]], lons[start:end][found[start:end]])
+                   for (start, end) in zip(bounds[:-1], bounds[1:]) if found[start:end].any()]
+    oriented = _orient_rings(ring_coords)
+    ring_offsets = np.zeros(len(oriented) + 1, dtype = np.int64)
+    ring_offsets[1:] = np.cumsum([len(ring_lats) for (ring_lats, ring_lons, is_hole) in oriented])
+    flat_lats = np.concatenate([ring_lats for (ring_lats, ring_lons, is_hole) in oriented] or [np.empty(0)])
+    flat_lons = np.concatenate([ring_lons for (ring_lats, ring_lons, is_hole) in oriented] or [np.empty(0)])
+    holes = np.array([is_hole for (ring_lats, ring_lons, is_hole) in oriented], dtype = bool)
+    return flat_lats, flat_lons, ring_offsets, holes, node_ids[~found], open_count
+
+def ring_holes(lats, lons, ring_offsets):
+    '''
+    Flag the clockwise rings of flat ring arrays with **ring_offsets**, which are the holes of rings oriented by area_rings.
+    '''
+    lats, lons = np.asarray(lats, dtype = np.float64), np.asarray(lons, dtype = np.float64)
+    ring_offsets = np.asarray(ring_offsets, dtype = np.int64)
+    sizes = np.diff(ring_offsets)
+    holes = np.zeros(len(sizes), dtype = bool)
+    if not len(lats):
+        return holes
+    # shoelace terms with the next point of the same ring (the first point for the last one)
+    next_idx = np.arange(1, len(lats) + 1)
+    non_empty = sizes > 0
+    next_idx[ring_offsets[1:][non_empty] - 1] = ring_offsets[:-1][non_empty]
+    terms = lons * lats[next_idx] - lons[next_idx] * lats
+    holes[non_empty] = np.add.reduceat(terms, ring_offsets[:-1][non_empty]) < 0
+    return holes
+
+def _signed_area(lats, lons):
+    # shoelace formula with lon as x and lat as y, positive for counterclockwise rings
+    return 0.5 * np.sum(lons * np.roll(lats, -1) - np.roll(lons, -1) * lats)
+
+def _orient_rings(ring_coords):
+    # nesting depth of every ring (number of rings that contain it), then outer rings counterclockwise first, holes clockwise,
+    # returns (lats, lons, is_hole) of each ring
+    depths = [0] * len(ring_coords)
+    if len(ring_coords) > 1:
+        boxes = [(lats.min(), lats.max(), lons.min(), lons.max()) for (lats, lons) in ring_coords]
+        for (i, (lats, lons)) in enumerate(ring_coords):
+            for (j, (other_lats, other_lons)) in enumerate(ring_coords):
+                if i == j or not (boxes[j][0] <= boxes[i][0] and boxes[i][1] <= boxes[j][1] and boxes[j][2] <= boxes[i][2] and boxes[i][3] <= boxes[j][3]):
+                    continue
+                # rings may touch (share nodes), so ring i lies inside ring j if none of its other points is outside
+                classes = classify_points(lats, lons, other_lats, other_lons, np.roll(other_lats, -1), np.roll(other_lons, -1))
+                if (classes == INSIDE).any() and not (classes == OUTSIDE).any():
+                    depths[i] += 1
+    oriented = []
+    for (depth, (lats, lons)) in sorted(zip(depths, ring_coords), key = lambda ring: ring[0] % 2):
+        if (_signed_area(lats, lons) > 0) != (depth % 2 == 0):
+            lats, lons = lats[::-1], lons[::-1]
+        oriented.append((lats, lons, depth % 2 == 1))
+    return oriented
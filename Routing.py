@@ -0,0 +1,287 @@
+import os
+import json
+import math
+import heapq
+import hashlib
+import numpy as np
+import Profiler
+from Geometry import EARTH_RADIUS, segment_lengths
+
+# arrays of a saved routing graph, each one is saved to a file <name>.npy
+GRAPH_ARRAYS = ['node_ids', 'lats', 'lons', 'indptr', 'targets', 'weights', 'edge_streets']
+
+def graph_key(street_offsets, street_point_ids, street_lats, street_lons, oneway):
+    '''
+    Checksum of the street geometry a routing graph is built from, to detect saved graphs of other (e.g. updated) data.
+    '''
+    digest = hashlib.sha1()
+    for array, dtype in [(street_offsets, np.int64), (street_point_ids, np.int64), (street_lats, np.float64),
+                         (street_lons, np.float64), (oneway, np.bool_)]:
+        digest.update(np.ascontiguousarray(array, dtype = dtype).tobytes())
+    return digest.hexdigest()
+
+class RoutingGraph(object):
+    '''
+    Routing graph of the streets: vertices are the junctions (nodes shared by several streets or used twice by one street)
+    and the end nodes of all streets, edges are the street sections between two consecutive vertices of a street,
+    weighted by their length in metres (haversine). Oneway streets only get an edge in their direction, all others one
+    in each direction. The adjacency is stored in CSR layout: the edges leaving vertex v are indptr[v] to indptr[v+1]-1
+    of targets/ weights/ edge_streets (the index of the street in the order of Streets.street_data).
+    Queries run Dijkstra's algorithm (A* with the great circle distance as lower bound for point-to-point queries) on
+    Python lists of the arrays, which only touch the part of the graph that is needed.
+    '''
+
+    def __init__(self, node_ids, lats, lons, indptr, targets, weights, edge_streets, key = None):
+        self.node_ids = np.asarray(node_ids, dtype = np.int64)
+        self.lats = np.asarray(lats, dtype = np.float64)
+        self.lons = np.asarray(lons, dtype = np.float64)
+        self.indptr = np.asarray(indptr, dtype = np.int64)
+        self.targets = np.asarray(targets, dtype = np.int32)
+        self.weights = np.asarray(weights, dtype = np.float64)
+        self.edge_streets = np.asarray(edge_streets, dtype = np.int32)
+        self.key = key
+        self._lists = None
+
+    @classmethod
+    def from_streets(cls, street_offsets, street_point_ids, street_lats, street_lons, oneway):
+        '''
+        Build the graph from the flat street geometry (see Streets._set_geometry) and the boolean array **oneway**
+        (one entry per street).
+        '''
+        street_offsets = np.asarray(street_offsets, dtype = np.int64)
+        point_ids = np.asarray(street_point_ids, dtype = np.int64)
+        oneway = np.asarray(oneway, dtype = bool)
+        key = graph_key(street_offsets, point_ids, street_lats, street_lons, oneway)
+        with Profiler.stage('routing graph', len(point_ids)):
+            point_count = len(point_ids)
+            point_streets = np.repeat(np.arange(len(street_offsets) - 1, dtype = np.int64), np.diff(street_offsets))
+            # vertices: end points of the streets and all nodes that occur more than once
+            is_vertex = np.zeros(point_count, dtype = bool)
+            non_empty = street_offsets[1:] > street_offsets[:-1]
+            is_vertex[street_offsets[:-1][non_empty]] = True
+            is_vertex[street_offsets[1:][non_empty] - 1] = True
+            _, inverse, counts = np.unique(point_ids, return_inverse = True, return_counts = True)
+            is_vertex |= counts[inverse] > 1
+            vertex_points = np.flatnonzero(is_vertex)
+            node_ids, idx = np.unique(point_ids[vertex_points], return_index = True)
+            lats = np.asarray(street_lats, dtype = np.float64)[vertex_points[idx]]
+            lons = np.asarray(street_lons, dtype = np.float64)[vertex_points[idx]]
+            # length along the streets up to each point, segments between two streets count 0
+            segments = np.zeros(point_count, dtype = np.float64)
+            if point_count > 1:
+                segments[1:] = segment_lengths(street_lats, street_lons)
+                segments[street_offsets[:-1][street_offsets[:-1] < point_count]] = 0.0
+            along = np.cumsum(segments)
+            # edges between consecutive vertices of the same street
+            starts, ends = vertex_points[:-1], vertex_points[1:]
+            same_street = point_streets[starts] == point_streets[ends]
+            starts, ends = starts[same_street], ends[same_street]
+            sources = np.searchsorted(node_ids, point_ids[starts])
+            targets = np.searchsorted(node_ids, point_ids[ends])
+            weights = along[ends] - along[starts]
+            streets = point_streets[starts]
+            # repeated nodes in a row give loops, which are never part of a shortest path
+            proper = sources != targets
+            sources, targets, weights, streets = sources[proper], targets[proper], weights[proper], streets[proper]
+            backward = ~oneway[streets]
+            sources, targets = np.concatenate([sources, targets[backward]]), np.concatenate([targets, sources[backward]])
+            weights, streets = np.concatenate([weights, weights[backward]]), np.concatenate([streets, streets[backward]])
+            order = np.argsort(sources, kind = 'stable')
+            indptr = np.zeros(len(node_ids) + 1, dtype = np.int64)
+            indptr[1:] = np.cumsum(np.bincount(sources, minlength = len(node_ids)))
+        return cls(node_ids, lats, lons, indptr, targets[order], weights[order], streets[order], key)
+
+    @classmethod
+    def load(cls, directory, mmap = True):
+        '''
+        Load a graph saved by save, returns None if there is none in **directory**.
+        '''
+        meta_file = os.path.join(directory, 'meta.json')
+        if not os.path.isfile(meta_file):
+            return None
+        with open(meta_file) as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        arrays = [np.load(os.path.join(directory, '%s.npy' % name), mmap_mode = mmap_mode) for name in GRAPH_ARRAYS]
+        return cls(*arrays, key = meta.get('key'))
+
+    def save(self, directory):
+        '''
+        Save the arrays of the graph and its key to the directory **directory** (e.g. next to the dataset it was built from).
+        '''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name in GRAPH_ARRAYS:
+            np.save(os.path.join(directory, '%s.npy' % name), getattr(self, name))
+        # the meta file is written last, so an interrupted save is never loaded
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'key': self.key, 'vertices': self.vertex_count(), 'edges': self.edge_count()}, f)
+
+    def vertex_count(self):
+        return len(self.node_ids)
+
+    def edge_count(self):
+        return len(self.targets)
+
+    def _adjacency(self):
+        # the arrays as Python lists (and coordinates in radians for the A* bound), element access is much faster on them
+        if self._lists is None:
+            lat_radians = np.radians(self.lats)
+            self._lists = (self.indptr.tolist(), self.targets.tolist(), self.weights.tolist(),
+                           lat_radians.tolist(), np.radians(self.lons).tolist(), np.cos(lat_radians).tolist())
+        return self._lists
+
+    def vertex(self, node_id):
+        '''
+        Return the vertex of the node **node_id** (None if the node is no junction or street end).
+        '''
+        k = np.searchsorted(self.node_ids, node_id)
+        if k < len(self.node_ids) and self.node_ids[k] == node_id:
+            return int(k)
+        return None
+
+    def nearest_vertex(self, lat, lon):
+        '''
+        Return the vertex closest to the point (lat, lon), using the equirectangular distance.
+        '''
+        if not self.vertex_count():
+            return None
+        scale = math.cos(math.radians(lat))
+        return int(np.argmin((self.lats - lat)**2 + ((self.lons - lon) * scale)**2))
+
+    def _search(self, source, targets = None, max_distance = np.inf, target = None):
+        '''
+        Dijkstra's algorithm from vertex **source**, which stops when all **targets** (a set of vertices) are settled or
+        all vertices within **max_distance** metres are. With a single **target**, the great circle distance to it
+        guides the search (A*). Returns the dicts of the settled distances and of the edges they were reached over.
+        '''
+        indptr, edge_targets, weights, lat_radians, lon_radians, cos_lats = self._adjacency()
+        if target is not None:
+            target_lat, target_lon, target_cos = lat_radians[target], lon_radians[target], cos_lats[target]
+
+            def bound(v):
+                h = (math.sin((lat_radians[v] - target_lat) / 2)**2 +
+                     cos_lats[v] * target_cos * math.sin((lon_radians[v] - target_lon) / 2)**2)
+                return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(h, 1.0)))
+            targets = {target}
+        remaining = set(targets) if targets is not None else None
+        settled = {}
+        reached = {source: 0.0}
+        edges = {source: -1}
+        heap = [(bound(source) if target is not None else 0.0, 0.0, source)]
+        while heap:
+            _, distance, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            if distance > max_distance:
+                break
+            settled[u] = distance
+            if remaining is not None:
+                remaining.discard(u)
+                if not remaining:
+                    break
+            for e in range(indptr[u], indptr[u+1]):
+                v = edge_targets[e]
+                new_distance = distance + weights[e]
+                if v not in settled and new_distance < reached.get(v, np.inf):
+                    reached[v] = new_distance
+                    edges[v] = e
+                    heapq.heappush(heap, (new_distance + bound(v) if target is not None else new_distance, new_distance, v))
+        return settled, edges
+
+    def _edge_source(self, e):
+        return int(np.searchsorted(self.indptr, e, side = 'right')) - 1
+
+    def shortest_path(self, source, target):
+        '''
+        Shortest path from vertex **source** to vertex **target** (A*), respecting oneway streets.
+        Returns (distance in metres, list of the vertices, list of the edges) of the path or (inf, [], []) if the target
+        cannot be reached. The streets of the path are edge_streets of its edges.
+        '''
+        settled, edges = self._search(source, target = target)
+        if target not in settled:
+            return np.inf, [], []
+        path_edges = []
+        v = target
+        while v != source:
+            path_edges.append(edges[v])
+            v = self._edge_source(edges[v])
+        path_edges.reverse()
+        return settled[target], [source] + [int(self.targets[e]) for e in path_edges], path_edges
+
+    def distances(self, source, targets, max_distance = np.inf):
+        '''
+        Distances in metres from vertex **source** to all vertices **targets** (one-to-many, a single search),
+        inf for targets that cannot be reached (within **max_distance**).
+        '''
+        targets = [int(target) for target in targets]
+        settled, _ = self._search(source, targets = set(targets), max_distance = max_distance)
+        return np.array([settled.get(target, np.inf) for target in targets], dtype = np.float64)
+
+    def distance_matrix(self, sources, targets, max_distance = np.inf):
+        '''
+        Matrix of the distances in metres from all vertices **sources** (rows) to all vertices **targets** (columns).
+        '''
+        matrix = np.full((len(sources), len(targets)), np.inf)
+        for (k, source) in enumerate(sources):
+            matrix[k] = self.distances(int(source), targets, max_distance)
+        return matrix
+
+    def reachable(self, source, max_distance):
+        '''
+        All vertices that can be reached from vertex **source** within **max_distance** metres.
+        Returns the arrays (vertices, distances), sorted by distance.
+        '''
+        settled, _ = self._search(source, max_distance = max_distance)
+        return np.fromiter(settled.keys(), dtype = np.int64, count = len(settled)), np.fromiter(settled.values(), dtype = np.float64, count = len(settled))
+
+def component_labels(sources, targets, count):
+    '''
+    Connected components of the undirected graph with **count** vertices and the edges **sources** - **targets**, found by
+    an array-based union-find: in each round every edge hooks the root of its larger label onto its smaller one
+    (np.minimum.at), then all paths are compressed by pointer jumping, until both ends of all edges share their root.
+    Returns the label of every vertex, which is the smallest vertex of its component.
+    '''
+    parent = np.arange(count, dtype = np.int64)
+    sources = np.asarray(sources, dtype = np.int64)
+    targets = np.asarray(targets, dtype = np.int64)
+    while len(sources):
+        source_roots, target_roots = parent[sources], parent[targets]
+        different = source_roots != target_roots
+        if not different.any():
+            break
+        # edges whose ends already share their root are never needed again
+        sources, targets = sources[different], targets[different]
+        source_roots, target_roots = source_roots[different], target_roots[different]
+        np.minimum.at(parent, np.maximum(source_roots, target_roots), np.minimum(source_roots, target_roots))
+        while True:
+            grand_parent = parent[parent]
+            if np.array_equal(grand_parent, parent):
+                break
+            parent = grand_parent
+    return parent
+
+def network_topology(street_offsets, street_point_ids):
+    '''
+    Topology of the street network given by the flat node ids of all streets (street k consists of the points
+    street_offsets[k] to street_offsets[k+1]-1 of street_point_ids). Two nodes are adjacent if they follow each other in a
+    street, the degree of a node is its number of distinct neighbours: junctions have degree 3 or more, dead ends degree 1.
+    Returns the dict {'node_ids', 'degrees', 'components'} of arrays over all nodes (sorted by id), where components are
+    the labels of the connected components (see component_labels).
+    '''
+    street_offsets = np.asarray(street_offsets, dtype = np.int64)
+    point_ids = np.asarray(street_point_ids, dtype = np.int64)
+    with Profiler.stage('topology', len(point_ids)):
+        node_ids, inverse = np.unique(point_ids, return_inverse = True)
+        # segments between consecutive points of the same street, as sorted vertex pairs without loops and duplicates
+        is_start = np.zeros(len(point_ids), dtype = bool)
+        is_start[street_offsets[:-1][street_offsets[:-1] < len(point_ids)]] = True
+        inner = np.flatnonzero(~is_start[1:]) + 1
+        first, second = inverse[inner - 1], inverse[inner]
+        proper = first != second
+        low, high = np.minimum(first, second)[proper], np.maximum(first, second)[proper]
+        pairs = np.unique(low * len(node_ids) + high)
+        low, high = pairs // len(node_ids), pairs % len(node_ids)
+        degrees = np.bincount(np.concatenate([low, high]), minlength = len(node_ids))
+        components = component_labels(low, high, len(node_ids))
+    return {'node_ids': node_ids, 'degrees': degrees, 'components': components}
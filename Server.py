@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import asyncio
+import collections
+import numpy as np
+from urllib.parse import urlsplit, parse_qs
+from Data import Data
+from Dataset import is_dataset
+from Streets import Streets
+from PostalAreas import PostalAreas
+
+CACHE_SIZE = 1024               # how many query results are kept (least recently used ones are dropped first)
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+def load_state(csv_dir = './csv/', npy_dir = None, metric = 'haversine'):
+    '''
+    Load a dataset once and build everything the queries need: the Streets (including all lengths) and the PostalAreas
+    (including the assignment of all cameras to the areas). Return them as dict together with the source and load time.
+    '''
+    start = time.time()
+    if npy_dir:
+        new_data = Data(npy_dir=npy_dir)
+        streets = Streets.from_dataset(new_data.dataset, metric = metric)
+        postals = PostalAreas.from_dataset(new_data.dataset)
+    else:
+        new_data = Data(csv_dir=csv_dir)
+        bounds, street_info, node_coords = new_data.get_streets()
+        streets = Streets(bounds, street_info, node_coords, metric = metric)
+        bounds, areas, area_nodes, area_lats, area_lons = new_data.get_areas()
+        postals = PostalAreas(bounds, areas, area_nodes, area_lats, area_lons, new_data.get_cameras())
+    return {'streets': streets, 'postals': postals, 'source': npy_dir or csv_dir, 'metric': metric,
+            'loaded': time.strftime('%d.%m.%Y %H:%M:%S'), 'load_seconds': time.time() - start}
+
+def _json_default(value):
+    # numpy scalars and arrays as well as pandas objects (e.g. the row of a street) are not json serializable
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    return str(value)
+
+class QueryServer(object):
+    '''
+    Answer queries on one loaded dataset over http (GET requests, parameters in the query string, json responses):
+        /street_types                               all street types
+        /oneway_quota?street_type=TYPE              oneway quota of all streets (or of the given type)
+        /lengths?stat=STAT&street_type=TYPE         'min', 'max', 'median' or 'average' of the street lengths
+        /cam_counts                                 camera counts of all postal areas
+        /cams_to_area?area=POSTAL_CODE              ids of all cameras in the given postal area
+        /reload?npy_dir=DIR (or csv_dir=DIR)        load a (new) dataset and swap it in, by default the current source again
+        /status                                     source, load time, number of requests and cached results
+    Queries run in a thread pool, so the event loop keeps accepting (concurrent) requests. Their results are cached
+    (identical concurrent queries wait for the same result), the cache is dropped when a new dataset is swapped in.
+    A reload builds the new dataset in the background while all queries are still answered from the current one.
+    '''
+
+    def __init__(self, state, cache_size = CACHE_SIZE):
+        self.state = state
+        self.generation = 1
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.requests = 0
+        self.cache_hits = 0
+        self._reload_lock = None
+        self.queries = {'/street_types': self.street_types, '/oneway_quota': self.oneway_quota, '/lengths': self.lengths,
+                        '/cam_counts': self.cam_counts, '/cams_to_area': self.cams_to_area}
+
+    def street_types(self, state):
+        return {'street_types': sorted(state['streets'].street_types)}
+
+    def oneway_quota(self, state, street_type = None):
+        quota, oneway_number, total_number = state['streets'].get_oneway_quota(street_type, verbose = False)
+        return {'street_type': street_type, 'quota': quota, 'oneway': oneway_number, 'total': total_number}
+
+    def lengths(self, state, stat = 'average', street_type = None):
+        assert(stat in ['max', 'min', 'median', 'average']), "Given statistic %s is not valid. Use one of 'max', 'min', 'median', 'average'." % stat
+        result = state['streets'].analyze_street_lengths(stat, street_type, verbose = False)
+        if stat in ['median', 'average']:
+            return {'stat': stat, 'street_type': street_type, 'metric': state['metric'], 'value': result}
+        stat_value, stat_idx, stat_row = result
+        return {'stat': stat, 'street_type': street_type, 'metric': state['metric'], 'value': stat_value,
+                'street_id': stat_idx, 'street': stat_row.to_dict()}
+
+    def cam_counts(self, state):
+        cam_counts = state['postals'].get_camera_counts(verbose = False)
+        return {'cam_counts': [[postal_code, count] for (postal_code, count) in cam_counts.items()]}
+
+    def cams_to_area(self, state, area = None):
+        assert(area in state['postals'].areas.keys()), 'Given postal area is no valid postal code.'
+        return {'area': area, 'cameras': [str(cam_id) for cam_id in state['postals'].get_cams_to_area(area)]}
+
+    def status(self):
+        state = self.state
+        return {'source': state['source'], 'metric': state['metric'], 'loaded': state['loaded'], 'load_seconds': state['load_seconds'],
+                'generation': self.generation, 'requests': self.requests, 'cache_hits': self.cache_hits, 'cached': len(self.cache)}
+
+    async def query(self, path, params):
+        '''
+        Return the (cached) result of the query **path** with the **params** {name: value} on the current dataset.
+        '''
+        state, generation = self.state, self.generation
+        key = (generation, path, tuple(sorted(params.items())))
+        future = self.cache.get(key)
+        if future is not None:
+            self.cache_hits += 1
+            self.cache.move_to_end(key)
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, lambda: self.queries[path](state, **params))
+            self.cache[key] = future
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last = False)
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            # failed queries are not cached
+            if self.cache.get(key) is future:
+                del self.cache[key]
+            raise
+
+    async def reload(self, csv_dir = None, npy_dir = None, metric = None):
+        '''
+        Load the given dataset (by default the current source again) in the background and swap it in afterwards.
+        '''
+        async with self._reload_lock:
+            if not csv_dir and not npy_dir:
+                source = self.state['source']
+                csv_dir, npy_dir = (None, source) if is_dataset(source) else (source, None)
+            assert(os.path.isdir(npy_dir or csv_dir)), 'No directory %s' % (npy_dir or csv_dir)
+            loop = asyncio.get_running_loop()
+            state = await loop.run_in_executor(None, load_state, csv_dir, npy_dir, metric or self.state['metric'])
+            self.state = state
+            self.generation += 1
+            self.cache.clear()
+            print('Reloaded %s in %.2f s.' % (state['source'], state['load_seconds']))
+            return self.status()
+
+    async def handle_request(self, method, target):
+        '''
+        Return the status code and the json result of a request.
+        '''
+        url = urlsplit(target)
+        params = {name: values[-1] for (name, values) in parse_qs(url.query).items()}
+        path = url.path.rstrip('/') or '/'
+        if path not in self.queries and path not in ['/reload', '/status']:
+            return 404, {'error': 'Unknown query %s, use one of %s.' % (path, ', '.join(sorted(list(self.queries) + ['/reload', '/status'])))}
+        if method not in (['GET', 'POST'] if path == '/reload' else ['GET']):
+            return 405, {'error': 'Method %s is not allowed for %s.' % (method, path)}
+        try:
+            if path == '/status':
+                return 200, self.status()
+            if path == '/reload':
+                return 200, await self.reload(**params)
+            return 200, await self.query(path, params)
+        except (AssertionError, KeyError, TypeError) as error:
+            # invalid parameters (unknown parameter names, street types, statistics or postal codes)
+            return 400, {'error': str(error) or repr(error)}
+        except Exception as error:
+            return 500, {'error': repr(error)}
+
+    async def handle_connection(self, reader, writer):
+        # http/1.1 with keep-alive: answer requests on the connection until the client closes it
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0)):
+                    await reader.readexactly(int(headers['content-length']))
+                start = time.time()
+                self.requests += 1
+                status, result = await self.handle_request(method, target)
+                body = json.dumps(result, default = _json_default).encode('utf-8')
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                writer.write(('HTTP/1.1 %s %s\r\nContent-Type: application/json\r\nContent-Length: %s\r\nConnection: %s\r\n\r\n'
+                              % (status, STATUS_TEXT[status], len(body), 'keep-alive' if keep_alive else 'close')).encode('latin-1') + body)
+                await writer.drain()
+                print('%s %s %s (%.1f ms)' % (method, target, status, (time.time() - start) * 1000))
+                if not keep_alive:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self, host = '127.0.0.1', port = 8000, socket_path = None):
+        self._reload_lock = asyncio.Lock()
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle_connection, path = socket_path)
+            print('Serving on unix socket %s...' % socket_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print('Serving on http://%s:%s/ ...' % (host, port))
+        async with server:
+            await server.serve_forever()
+
+def serve(csv_dir = './csv/', npy_dir = None, host = '127.0.0.1', port = 8000, socket_path = None, metric = 'haversine'):
+    '''
+    Load the dataset once and answer queries on it (see QueryServer) on host:port resp. on a unix socket until interrupted.
+    '''
+    print('\nLoading %s...' % (npy_dir or csv_dir))
+    state = load_state(csv_dir, npy_dir, metric)
+    print('Loaded in %.2f s.' % state['load_seconds'])
+    try:
+        asyncio.run(QueryServer(state).run(host, port, socket_path))
+    except KeyboardInterrupt:
+        print('\nStopped.')
+    finally:
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,104 @@
+import numpy as np
+from Geometry import EARTH_RADIUS, take_polylines
+
+METRES_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+# tolerances (in metres) of the levels of detail, a level is only computed when it is used the first time
+LOD_TOLERANCES = [0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0]
+
+def simplify(lats, lons, offsets, tolerance):
+    '''
+    Douglas-Peucker simplification of many polylines at once, polyline k consists of the points offsets[k] to offsets[k+1]-1
+    of the flat coordinate arrays **lats** and **lons**. nan entries split a polyline into parts (e.g. the rings of an area),
+    which are simplified separately. Returns a boolean mask of the points to keep: the end points of all parts, the nan
+    entries and enough points that every left out point is at most **tolerance** metres away from the simplified part.
+    All segments of one level of the recursion are processed together: the distances of all their inner points to their
+    chords (in metres, projected around the start of each chord) are computed in one vectorized pass, and every segment
+    whose farthest point is farther away than the tolerance is split at this point.
+    Closed rings work as well, their chord is the start point itself.
+    '''
+    lats = np.asarray(lats, dtype = np.float64)
+    lons = np.asarray(lons, dtype = np.float64)
+    offsets = np.asarray(offsets, dtype = np.int64)
+    point_count = len(lats)
+    keep = np.isnan(lats)
+    if not point_count:
+        return keep
+    # parts: runs of coordinates between polyline offsets and nan entries
+    is_offset = np.zeros(point_count + 1, dtype = bool)
+    is_offset[offsets] = True
+    valid = ~keep
+    segment_starts = np.flatnonzero(valid & (is_offset[:-1] | np.append(True, keep[:-1])))
+    segment_ends = np.flatnonzero(valid & (is_offset[1:] | np.append(keep[1:], True)))
+    keep[segment_starts] = True
+    keep[segment_ends] = True
+    ys = np.radians(lats)
+    xs = np.radians(lons)
+    while len(segment_starts):
+        inner_counts = segment_ends - segment_starts - 1
+        active = inner_counts > 0
+        segment_starts, segment_ends, inner_counts = segment_starts[active], segment_ends[active], inner_counts[active]
+        if not len(segment_starts):
+            break
+        # all inner points of all segments, with the index of their segment
+        run_starts = np.cumsum(inner_counts) - inner_counts
+        owners = np.repeat(np.arange(len(segment_starts)), inner_counts)
+        points = np.repeat(segment_starts + 1 - run_starts, inner_counts) + np.arange(inner_counts.sum(), dtype = np.int64)
+        scales = np.cos(ys[segment_starts])[owners]
+        ax, ay = xs[segment_starts][owners] * scales, ys[segment_starts][owners]
+        dx, dy = xs[segment_ends][owners] * scales - ax, ys[segment_ends][owners] - ay
+        px, py = xs[points] * scales - ax, ys[points] - ay
+        # distance to the chord (a segment, so that degenerated chords of closed rings give the distance to their start)
+        squared_lengths = dx**2 + dy**2
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            t = np.where(squared_lengths > 0, np.clip((px * dx + py * dy) / squared_lengths, 0, 1), 0)
+        distances = np.hypot(px - t * dx, py - t * dy) * EARTH_RADIUS
+        max_distances = np.maximum.reduceat(distances, run_starts)
+        # split each segment at its first farthest point, if that is farther away than the tolerance
+        is_max = np.flatnonzero(distances == max_distances[owners])
+        segments, first = np.unique(owners[is_max], return_index = True)
+        split_points = points[is_max[first]]
+        split = max_distances[segments] > tolerance
+        segments, split_points = segments[split], split_points[split]
+        keep[split_points] = True
+        segment_starts, segment_ends = (np.concatenate([segment_starts[segments], split_points]),
+                                        np.concatenate([split_points, segment_ends[segments]]))
+    return keep
+
+class LevelsOfDetail(object):
+    '''
+    Simplified versions of the flat polylines (or nan separated rings) **lats**, **lons** with **offsets** at the given
+    **tolerances** in metres (see simplify). Each level is computed on first use and cached as the positions of its points
+    in the flat arrays and its own offsets, so the coordinates are never copied until they are taken.
+    '''
+
+    def __init__(self, lats, lons, offsets, tolerances = LOD_TOLERANCES):
+        self.lats = lats
+        self.lons = lons
+        self.offsets = np.asarray(offsets, dtype = np.int64)
+        self.tolerances = sorted(tolerances)
+        self.levels = {}
+
+    def level(self, tolerance = None):
+        '''
+        Return (point_idx, offsets) of the level of **tolerance** (None: full resolution).
+        '''
+        if tolerance is None:
+            return np.arange(len(self.lats), dtype = np.int64), self.offsets
+        if tolerance not in self.levels:
+            point_idx = np.flatnonzero(simplify(self.lats, self.lons, self.offsets, tolerance))
+            self.levels[tolerance] = (point_idx, np.searchsorted(point_idx, self.offsets))
+        return self.levels[tolerance]
+
+    def tolerance_for(self, pixel_size):
+        # the coarsest level that deviates at most half a pixel (of pixel_size metres), None if there is none
+        tolerances = [tolerance for tolerance in self.tolerances if tolerance <= pixel_size / 2.0]
+        return tolerances[-1] if tolerances else None
+
+    def take(self, polylines, tolerance = None):
+        '''
+        Select the **polylines** (indices) at the level of detail of **tolerance** (None: full resolution, see tolerance_for).
+        Returns (point_idx, offsets): the positions of their points in the flat arrays and their offsets in the selection.
+        '''
+        point_idx, offsets = self.level(tolerance)
+        idx, new_offsets = take_polylines(offsets, polylines)
+        return point_idx[idx], new_offsets
@@ -0,0 +1,368 @@
+import numpy as np
+from Geometry import points_in_polygon, classify_points, INSIDE, BOUNDARY
+from Simplify import simplify, METRES_PER_DEGREE
+
+def _expand_runs(starts, counts):
+    # positions starts[0], .., starts[0]+counts[0]-1, starts[1], .., starts[1]+counts[1]-1, ...
+    counts = np.asarray(counts, dtype = np.int64)
+    total = counts.sum()
+    run_starts = np.cumsum(counts) - counts
+    return np.repeat(np.asarray(starts, dtype = np.int64) - run_starts, counts) + np.arange(total, dtype = np.int64)
+
+class GridIndex(object):
+    '''
+    Uniform grid index over bounding boxes (min_lat, min_lon, max_lat, max_lon), built once with NumPy.
+    Every box is registered in all grid cells it overlaps, the cell contents are stored CSR-like
+    (cell_offsets into cell_boxes), so that many points or boxes can be queried at once.
+    '''
+
+    def __init__(self, min_lats, min_lons, max_lats, max_lons, cells = None):
+        self.min_lats = np.asarray(min_lats, dtype = np.float64)
+        self.min_lons = np.asarray(min_lons, dtype = np.float64)
+        self.max_lats = np.asarray(max_lats, dtype = np.float64)
+        self.max_lons = np.asarray(max_lons, dtype = np.float64)
+        box_count = len(self.min_lats)
+        if cells is None:
+            # about four boxes per cell for evenly spread boxes
+            cells = max(1, int(np.ceil(np.sqrt(box_count / 4.0))))
+        self.rows = self.cols = cells
+        # empty boxes (e.g. of empty polygons) are not registered in any cell
+        valid = (self.min_lats <= self.max_lats) & (self.min_lons <= self.max_lons)
+        if valid.any():
+            self.lat0, self.lon0 = self.min_lats[valid].min(), self.min_lons[valid].min()
+            lat1, lon1 = self.max_lats[valid].max(), self.max_lons[valid].max()
+        else:
+            self.lat0 = self.lon0 = lat1 = lon1 = 0.0
+        self.cell_height = ((lat1 - self.lat0) / self.rows) or 1.0
+        self.cell_width = ((lon1 - self.lon0) / self.cols) or 1.0
+        # register each box in every cell it overlaps
+        row0, row1 = self._rows(self.min_lats), self._rows(self.max_lats)
+        col0, col1 = self._cols(self.min_lons), self._cols(self.max_lons)
+        widths = col1 - col0 + 1
+        counts = np.where(valid, (row1 - row0 + 1) * widths, 0)
+        boxes = np.repeat(np.arange(box_count, dtype = np.int64), counts)
+        k = _expand_runs(np.zeros(box_count, dtype = np.int64), counts)
+        cells_of_boxes = (row0[boxes] + k // widths[boxes]) * self.cols + col0[boxes] + k % widths[boxes]
+        order = np.argsort(cells_of_boxes, kind = 'stable')
+        self.cell_boxes = boxes[order]
+        self.cell_offsets = np.searchsorted(cells_of_boxes[order], np.arange(self.rows * self.cols + 1))
+
+    def _rows(self, lats):
+        return np.clip(np.floor((np.asarray(lats) - self.lat0) / self.cell_height), 0, self.rows - 1).astype(np.int64)
+
+    def _cols(self, lons):
+        return np.clip(np.floor((np.asarray(lons) - self.lon0) / self.cell_width), 0, self.cols - 1).astype(np.int64)
+
+    def query_points(self, lats, lons):
+        '''
+        Return the arrays (point_idx, box_idx) of all pairs of a point (lats[point_idx], lons[point_idx])
+        and a box that contains it (including its border).
+        '''
+        lats = np.asarray(lats, dtype = np.float64)
+        lons = np.asarray(lons, dtype = np.float64)
+        cells = self._rows(lats) * self.cols + self._cols(lons)
+        counts = self.cell_offsets[cells + 1] - self.cell_offsets[cells]
+        point_idx = np.repeat(np.arange(len(lats), dtype = np.int64), counts)
+        box_idx = self.cell_boxes[_expand_runs(self.cell_offsets[cells], counts)]
+        # exact test against the bounding boxes (points outside the grid were clipped to border cells)
+        inside = ( (self.min_lats[box_idx] <= lats[point_idx]) & (lats[point_idx] <= self.max_lats[box_idx])
+                   & (self.min_lons[box_idx] <= lons[point_idx]) & (lons[point_idx] <= self.max_lons[box_idx]) )
+        return point_idx[inside], box_idx[inside]
+
+    def query_box(self, min_lat, min_lon, max_lat, max_lon):
+        '''
+        Return the sorted indices of all boxes that overlap the given box.
+        '''
+        row0, row1 = self._rows(min_lat), self._rows(max_lat)
+        col0, col1 = self._cols(min_lon), self._cols(max_lon)
+        if min_lat > max_lat or min_lon > max_lon:
+            return np.empty(0, dtype = np.int64)
+        rows = np.arange(row0, row1 + 1)
+        starts = self.cell_offsets[rows * self.cols + col0]
+        ends = self.cell_offsets[rows * self.cols + col1 + 1]
+        box_idx = np.unique(self.cell_boxes[_expand_runs(starts, ends - starts)])
+        overlap = ( (self.min_lats[box_idx] <= max_lat) & (min_lat <= self.max_lats[box_idx])
+                    & (self.min_lons[box_idx] <= max_lon) & (min_lon <= self.max_lons[box_idx]) )
+        return box_idx[overlap]
+
+class KDTree(object):
+    '''
+    Balanced KD-tree over points or segments, built with NumPy: the coordinates are projected to metres (equirectangular
+    around the mean latitude of the items), every level splits the items of each node at the median of their centers
+    along the longer side of the node. Items with end coordinates (**end_lats**, **end_lons**) are segments, their
+    distance to a point is the distance to the closest point of the segment.
+    The nodes of level l are stored implicitly (node i has the children 2i and 2i+1 on level l+1) as ranges of the
+    permuted items (level_offsets[l]) with bounding boxes, leaves hold leaf_size to 2*leaf_size-1 items.
+    All queries of a batch descend the tree together, level by level, as arrays of (query, node) pairs, pruned by the
+    distance of the query to the box of the node.
+    '''
+
+    def __init__(self, lats, lons, end_lats = None, end_lons = None, leaf_size = 16):
+        lats = np.asarray(lats, dtype = np.float64)
+        lons = np.asarray(lons, dtype = np.float64)
+        self.is_segments = end_lats is not None
+        if end_lats is None:
+            end_lats, end_lons = lats, lons
+        end_lats = np.asarray(end_lats, dtype = np.float64)
+        end_lons = np.asarray(end_lons, dtype = np.float64)
+        item_count = len(lats)
+        self.ref_lat = float(np.mean(lats)) if item_count else 0.0
+        x0, y0 = self.project(lats, lons)
+        x1, y1 = self.project(end_lats, end_lons)
+        depth = int(np.floor(np.log2(item_count / float(leaf_size)))) if item_count >= leaf_size else 0
+        perm = np.arange(item_count, dtype = np.int64)
+        offsets = np.array([0, item_count], dtype = np.int64)
+        self.level_offsets = [offsets]
+        self.split_dims, self.split_values = [], []
+        centers = ((x0 + x1) / 2, (y0 + y1) / 2)
+        for _ in range(depth):
+            node_count = len(offsets) - 1
+            nodes = np.repeat(np.arange(node_count, dtype = np.int64), np.diff(offsets))
+            # split along the longer side (of the box of the centers) of each node
+            extents = [np.maximum.reduceat(center[perm], offsets[:-1]) - np.minimum.reduceat(center[perm], offsets[:-1]) for center in centers]
+            dims = (extents[1] > extents[0]).astype(np.int64)
+            keys = np.where(dims[nodes] == 1, centers[1][perm], centers[0][perm])
+            order = np.lexsort((keys, nodes))
+            perm, keys = perm[order], keys[order]
+            mids = offsets[:-1] + np.diff(offsets) // 2
+            self.split_dims.append(dims)
+            self.split_values.append(keys[mids])
+            offsets = np.insert(offsets, np.arange(1, node_count + 1), mids)
+            self.level_offsets.append(offsets)
+        self.depth = depth
+        self.perm = perm
+        self.x0, self.y0, self.x1, self.y1 = x0[perm], y0[perm], x1[perm], y1[perm]
+        # bounding boxes of the nodes, from the leaves upwards
+        self.boxes = [None] * (depth + 1)
+        if item_count:
+            starts = offsets[:-1]
+            self.boxes[depth] = (np.minimum.reduceat(np.minimum(self.x0, self.x1), starts), np.minimum.reduceat(np.minimum(self.y0, self.y1), starts),
+                                 np.maximum.reduceat(np.maximum(self.x0, self.x1), starts), np.maximum.reduceat(np.maximum(self.y0, self.y1), starts))
+            for level in range(depth - 1, -1, -1):
+                min_x, min_y, max_x, max_y = self.boxes[level + 1]
+                self.boxes[level] = (np.minimum(min_x[0::2], min_x[1::2]), np.minimum(min_y[0::2], min_y[1::2]),
+                                     np.maximum(max_x[0::2], max_x[1::2]), np.maximum(max_y[0::2], max_y[1::2]))
+
+    def __len__(self):
+        return len(self.perm)
+
+    def project(self, lats, lons):
+        # equirectangular projection to metres around the reference latitude
+        scale = np.cos(np.radians(self.ref_lat))
+        return np.asarray(lons, dtype = np.float64) * METRES_PER_DEGREE * scale, np.asarray(lats, dtype = np.float64) * METRES_PER_DEGREE
+
+    def _item_distances(self, xs, ys, items):
+        # distances of the points (xs, ys) to the (permuted) items
+        x0, y0 = self.x0[items], self.y0[items]
+        if not self.is_segments:
+            return np.hypot(xs - x0, ys - y0)
+        dx, dy = self.x1[items] - x0, self.y1[items] - y0
+        squared_lengths = dx**2 + dy**2
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            t = np.where(squared_lengths > 0, np.clip(((xs - x0) * dx + (ys - y0) * dy) / squared_lengths, 0, 1), 0)
+        return np.hypot(xs - x0 - t * dx, ys - y0 - t * dy)
+
+    def _search(self, xs, ys, bounds):
+        '''
+        Return the arrays (query_idx, item_idx, distances) of all (permuted) items within distance bounds[query_idx].
+        '''
+        queries = np.arange(len(xs), dtype = np.int64)
+        nodes = np.zeros(len(xs), dtype = np.int64)
+        for level in range(self.depth + 1):
+            min_x, min_y, max_x, max_y = (box[nodes] for box in self.boxes[level])
+            qx, qy = xs[queries], ys[queries]
+            box_distances = np.hypot(np.maximum(np.maximum(min_x - qx, qx - max_x), 0), np.maximum(np.maximum(min_y - qy, qy - max_y), 0))
+            near = box_distances <= bounds[queries]
+            queries, nodes = queries[near], nodes[near]
+            if level < self.depth:
+                queries = np.repeat(queries, 2)
+                nodes = np.repeat(2 * nodes, 2) + np.tile([0, 1], len(nodes))
+        offsets = self.level_offsets[self.depth]
+        counts = offsets[nodes + 1] - offsets[nodes]
+        query_idx = np.repeat(queries, counts)
+        items = _expand_runs(offsets[nodes], counts)
+        distances = self._item_distances(xs[query_idx], ys[query_idx], items)
+        within = distances <= bounds[query_idx]
+        return query_idx[within], items[within], distances[within]
+
+    def _sorted(self, query_idx, items, distances):
+        # sort the pairs by query and distance, return them with the rank of each pair within its query
+        order = np.lexsort((distances, query_idx))
+        query_idx, items, distances = query_idx[order], items[order], distances[order]
+        starts = np.searchsorted(query_idx, query_idx)
+        return query_idx, items, distances, np.arange(len(query_idx)) - starts
+
+    def query(self, lats, lons, k = 1):
+        '''
+        Find the **k** nearest items of all points (lats, lons) at once. Returns the arrays (item_idx, distances) of shape
+        (number of points, k), sorted by distance in metres (item -1 and distance inf where there are less than k items).
+        '''
+        xs, ys = self.project(np.atleast_1d(lats), np.atleast_1d(lons))
+        item_idx = np.full((len(xs), k), -1, dtype = np.int64)
+        result = np.full((len(xs), k), np.inf)
+        if not len(self) or not len(xs):
+            return item_idx, result
+        k_found = min(k, len(self))
+        # an upper bound of the k-th distance: the k-th distance to the items of the deepest node around the point with k items
+        level = max(l for l in range(self.depth + 1) if np.diff(self.level_offsets[l]).min() >= k_found)
+        nodes = np.zeros(len(xs), dtype = np.int64)
+        for l in range(level):
+            coords = np.where(self.split_dims[l][nodes] == 1, ys, xs)
+            nodes = 2 * nodes + (coords >= self.split_values[l][nodes])
+        offsets = self.level_offsets[level]
+        counts = offsets[nodes + 1] - offsets[nodes]
+        query_idx = np.repeat(np.arange(len(xs), dtype = np.int64), counts)
+        items = _expand_runs(offsets[nodes], counts)
+        distances = self._item_distances(xs[query_idx], ys[query_idx], items)
+        query_idx, _, distances, ranks = self._sorted(query_idx, items, distances)
+        bounds = distances[ranks == k_found - 1]
+        query_idx, items, distances, ranks = self._sorted(*self._search(xs, ys, bounds))
+        nearest = ranks < k_found
+        item_idx[query_idx[nearest], ranks[nearest]] = self.perm[items[nearest]]
+        result[query_idx[nearest], ranks[nearest]] = distances[nearest]
+        return item_idx, result
+
+    def query_radius(self, lats, lons, radius):
+        '''
+        Find all items within **radius** metres of the points (lats, lons). Returns the arrays (point_idx, item_idx, distances)
+        of all such pairs, sorted by point and distance.
+        '''
+        xs, ys = self.project(np.atleast_1d(lats), np.atleast_1d(lons))
+        if not len(self):
+            return np.empty(0, dtype = np.int64), np.empty(0, dtype = np.int64), np.empty(0)
+        query_idx, items, distances, _ = self._sorted(*self._search(xs, ys, np.full(len(xs), float(radius))))
+        return query_idx, self.perm[items], distances
+
+class PolygonSet(object):
+    '''
+    Polygons stored as flat coordinate arrays: ring k consists of the points ring_offsets[k] to ring_offsets[k+1]-1
+    of lats/ lons (closed implicitly from the last to the first point), polygon p consists of the rings
+    polygon_offsets[p] to polygon_offsets[p+1]-1 (by default every polygon has exactly one ring).
+    A nan entry splits a ring further into separate rings. The edges from and to the nan entries never match any point.
+    '''
+
+    def __init__(self, ring_offsets, lats, lons, polygon_offsets = None):
+        self.ring_offsets = np.asarray(ring_offsets, dtype = np.int64)
+        self.lats = np.asarray(lats, dtype = np.float64)
+        self.lons = np.asarray(lons, dtype = np.float64)
+        ring_count = len(self.ring_offsets) - 1
+        if polygon_offsets is None:
+            polygon_offsets = np.arange(ring_count + 1)
+        self.polygon_offsets = np.asarray(polygon_offsets, dtype = np.int64)
+        # every point is the start of an edge to the next point of its ring (resp. to the first point of the ring),
+        # rings start at their offset or behind a nan entry and end at the next offset or in front of a nan entry
+        point_count = len(self.lats)
+        ring_sizes = np.diff(self.ring_offsets)
+        is_break = np.isnan(self.lats)
+        is_first = np.zeros(point_count, dtype = bool)
+        is_first[self.ring_offsets[:-1][ring_sizes > 0]] = True
+        is_first[1:] |= is_break[:-1]
+        is_last = np.zeros(point_count, dtype = bool)
+        is_last[self.ring_offsets[1:][ring_sizes > 0] - 1] = True
+        is_last[:-1] |= is_break[1:]
+        positions = np.arange(point_count, dtype = np.int64)
+        ring_starts = np.maximum.accumulate(np.where(is_first, positions, 0)) if point_count else positions
+        self.edge_ends = np.minimum(positions + 1, max(point_count - 1, 0))
+        self.edge_ends[is_last] = ring_starts[is_last]
+        # bounding boxes of the polygons (empty polygons get an empty box)
+        point_counts = self.ring_offsets[self.polygon_offsets[1:]] - self.ring_offsets[self.polygon_offsets[:-1]]
+        starts = self.ring_offsets[self.polygon_offsets[:-1]]
+        non_empty = point_counts > 0
+        self.min_lats, self.max_lats = self._reduce(self.lats, starts, non_empty)
+        self.min_lons, self.max_lons = self._reduce(self.lons, starts, non_empty)
+        self._simplified = {}
+
+    @classmethod
+    def from_lists(cls, lat_rings, lon_rings):
+        '''
+        Create one polygon for each pair of ring lists [ring1_lats, ring2_lats, ..] resp. [ring1_lons, ring2_lons, ..].
+        '''
+        polygon_offsets = np.zeros(len(lat_rings) + 1, dtype = np.int64)
+        polygon_offsets[1:] = np.cumsum([len(rings) for rings in lat_rings])
+        lat_lists = [ring for rings in lat_rings for ring in rings]
+        ring_offsets = np.zeros(len(lat_lists) + 1, dtype = np.int64)
+        ring_offsets[1:] = np.cumsum([len(lat_list) for lat_list in lat_lists])
+        lats = np.array([lat for lat_list in lat_lists for lat in lat_list], dtype = np.float64)
+        lons = np.array([lon for rings in lon_rings for lon_list in rings for lon in lon_list], dtype = np.float64)
+        return cls(ring_offsets, lats, lons, polygon_offsets)
+
+    def _reduce(self, values, starts, non_empty):
+        mins = np.full(len(starts), np.inf)
+        maxs = np.full(len(starts), -np.inf)
+        if non_empty.any():
+            # fmin and fmax skip the nan entries between rings
+            mins[non_empty] = np.fmin.reduceat(values, starts[non_empty])
+            maxs[non_empty] = np.fmax.reduceat(values, starts[non_empty])
+        return mins, maxs
+
+    def __len__(self):
+        return len(self.polygon_offsets) - 1
+
+    def edges(self, polygon):
+        '''
+        Return the edges of all rings of a polygon as arrays (start_lats, start_lons, end_lats, end_lons).
+        '''
+        start = self.ring_offsets[self.polygon_offsets[polygon]]
+        end = self.ring_offsets[self.polygon_offsets[polygon + 1]]
+        ends = self.edge_ends[start:end]
+        return self.lats[start:end], self.lons[start:end], self.lats[ends], self.lons[ends]
+
+    def simplified(self, tolerance):
+        '''
+        Return the polygons with rings simplified to **tolerance** metres (see Simplify.simplify), cached per tolerance.
+        Every point of the original rings is at most the tolerance away from the simplified ones.
+        '''
+        if tolerance not in self._simplified:
+            point_idx = np.flatnonzero(simplify(self.lats, self.lons, self.ring_offsets, tolerance))
+            self._simplified[tolerance] = PolygonSet(np.searchsorted(point_idx, self.ring_offsets), self.lats[point_idx],
+                                                     self.lons[point_idx], self.polygon_offsets)
+        return self._simplified[tolerance]
+
+    def contains(self, polygon, lats, lons, rule = 'even-odd', include_boundary = True, coarse_tolerance = None):
+        '''
+        Return a boolean array, which tells for each point whether it lies inside the polygon (see Geometry.points_in_polygon).
+        With **coarse_tolerance** (metres), the points are classified against the simplified rings (see simplified) first,
+        which have far less edges. Only points near their boundary (within twice the tolerance, in degrees of longitude at the
+        latitude farthest from the equator) can be classified differently at full resolution, so only those are tested again.
+        '''
+        if not coarse_tolerance:
+            return points_in_polygon(lats, lons, *self.edges(polygon), rule = rule, include_boundary = include_boundary)
+        lats = np.asarray(lats, dtype = np.float64)
+        lons = np.asarray(lons, dtype = np.float64)
+        max_lat = np.nanmax(np.abs(self.lats)) if len(self.lats) else 0.0
+        band = 2.0 * coarse_tolerance / (METRES_PER_DEGREE * max(np.cos(np.radians(max_lat)), 1e-6))
+        classes = classify_points(lats, lons, *self.simplified(coarse_tolerance).edges(polygon), rule = rule, tolerance = band)
+        inside = classes == INSIDE
+        near = np.flatnonzero(classes == BOUNDARY)
+        if len(near):
+            inside[near] = points_in_polygon(lats[near], lons[near], *self.edges(polygon), rule = rule, include_boundary = include_boundary)
+        return inside
+
+    def build_index(self):
+        return GridIndex(self.min_lats, self.min_lons, self.max_lats, self.max_lons)
+
+def spatial_join(lats, lons, polygons, index = None, rule = 'even-odd', include_boundary = True, coarse_tolerance = None):
+    '''
+    Bulk spatial join of points and polygons: return the arrays (point_idx, polygon_idx) of all pairs where the point
+    (lats[point_idx], lons[point_idx]) lies inside the polygon, sorted by polygon and point.
+    All points are queried at once against the bounding box index of the polygons (built if not given),
+    only the candidates that lie in a bounding box are tested exactly against the polygon,
+    all candidates of one polygon in a single call of the point-in-polygon kernel (see Geometry.classify_points).
+    With **coarse_tolerance**, the candidates are tested against the simplified polygons first (see PolygonSet.contains).
+    '''
+    if index is None:
+        index = polygons.build_index()
+    lats = np.asarray(lats, dtype = np.float64)
+    lons = np.asarray(lons, dtype = np.float64)
+    point_idx, polygon_idx = index.query_points(lats, lons)
+    order = np.lexsort((point_idx, polygon_idx))
+    point_idx, polygon_idx = point_idx[order], polygon_idx[order]
+    inside = np.zeros(len(point_idx), dtype = bool)
+    # candidates are sorted by polygon, so test the candidates of each polygon in one batch
+    bounds = np.flatnonzero(np.diff(polygon_idx)) + 1
+    for (start, end) in zip(np.append(0, bounds), np.append(bounds, len(polygon_idx))):
+        if end > start:
+            candidates = point_idx[start:end]
+            inside[start:end] = polygons.contains(polygon_idx[start], lats[candidates], lons[candidates], rule = rule,
+                                                  include_boundary = include_boundary, coarse_tolerance = coarse_tolerance)
+    return point_idx[inside], polygon_idx[inside]
@@ -1,38 +1,242 @@
 import os
+import itertools
 import pandas as pd
 import numpy as np
 import time
-import matplotlib.pyplot as plt
+import Profiler
 from PIL import Image
+from Dataset import decode_strings, resolve_polylines
+from Geometry import polyline_lengths, segment_lengths, take_polylines
+from Renderer import render_streets, image_size, pixel_size
+from Simplify import LevelsOfDetail
+from SpatialIndex import KDTree
+from Routing import RoutingGraph, graph_key, network_topology
 
 class Streets(object):
 
-    def __init__(self, bounds, streets, node_coords, add_length = True):
-        # street_info = {..., street_id: [street_type, is_oneway, street_postal_code, street_name], ...}
-        street_info = {street_id: streets[street_id][:4] for street_id in streets.keys()}
-        # street_nodes = {..., street_id: [node1, node2, ..], ...}
-        street_nodes = {street_id: streets[street_id][4:] for street_id in streets.keys()}
-        self.street_data = pd.DataFrame(street_info, index = ['type', 'is_oneway', 'postal_code', 'name']).T
+    def __init__(self, bounds, streets, node_coords, add_length = True, metric = 'haversine'):
+        with Profiler.stage('DataFrame construction', len(streets)):
+            # street_info = {..., street_id: [street_type, is_oneway, street_postal_code, street_name], ...}
+            street_info = {street_id: streets[street_id][:4] for street_id in streets.keys()}
+            # street_nodes = {..., street_id: [node1, node2, ..], ...}
+            street_nodes = {street_id: streets[street_id][4:] for street_id in streets.keys()}
+            self.street_data = pd.DataFrame(street_info, index = ['type', 'is_oneway', 'postal_code', 'name']).T
         # collect all possible street types in a set
         self.street_types = set(self.street_data['type'])
-        self.street_nodes = street_nodes
-        # collect all nodes that define any street in a set
-        self.street_nodes_set = set()
-        for node_list in self.street_nodes.values():
-            self.street_nodes_set.update(node_list)
-        # collect the coordinates of all street nodes in a dict
-        self.node_coords = {}
-        for node in self.street_nodes_set:
-            if not node in self.node_coords.keys():
-                if (node in node_coords.keys()):
-                    self.node_coords[node] = node_coords[node]
+        self._street_nodes = street_nodes
+        self._street_nodes_set = None
+        self._node_coords = None
+        self.dataset = None
+        self._set_bounds(bounds)
+        # store the geometry of all streets as flat coordinate arrays (in the order of street_data)
+        node_lists = [street_nodes[street_id] for street_id in self.street_data.index]
+        street_offsets = np.zeros(len(node_lists) + 1, dtype = np.int64)
+        street_offsets[1:] = np.cumsum([len(node_list) for node_list in node_lists])
+        point_node_ids = np.fromiter(itertools.chain.from_iterable(node_lists), dtype = np.int64, count = street_offsets[-1])
+        node_ids = np.array(list(node_coords.keys()), dtype = np.int64)
+        coords = np.array([tuple(coords)[:2] for coords in node_coords.values()], dtype = np.float64).reshape(-1, 2)
+        order = np.argsort(node_ids)
+        self._set_geometry(street_offsets, point_node_ids, node_ids[order], coords[order, 0], coords[order, 1])
+        # optional: add column with street lengths to the street_data dataframe
+        if add_length:
+            self.add_lengths(metric)
+
+    @classmethod
+    def from_dataset(cls, dataset, add_length = True, metric = 'haversine'):
+        '''
+        Create Streets from the (memory-mapped) arrays of a binary Dataset, without building dicts of all streets and nodes.
+        The dicts street_nodes, street_nodes_set and node_coords are only built when they are accessed.
+        '''
+        self = cls.__new__(cls)
+        self.dataset = dataset
+        type_names = np.array(dataset.street_type_names, dtype = object)
+        with Profiler.stage('DataFrame construction', len(dataset.street_ids)):
+            self.street_data = pd.DataFrame({'type': type_names[np.asarray(dataset.street_types)],
+                                             'is_oneway': np.asarray(dataset.street_oneway),
+                                             'postal_code': decode_strings(dataset.street_postal_data, dataset.street_postal_offsets),
+                                             'name': decode_strings(dataset.street_name_data, dataset.street_name_offsets)},
+                                            index = dataset.street_ids.astype(str), columns = ['type', 'is_oneway', 'postal_code', 'name'])
+        self.street_types = set(dataset.street_type_names)
+        self._street_nodes = None
+        self._street_nodes_set = None
+        self._node_coords = None
+        self._set_bounds(dataset.get_bounds())
+        self._set_geometry(dataset.street_node_offsets, dataset.street_node_ids, dataset.node_ids, dataset.node_lats, dataset.node_lons)
+        if add_length and metric == 'haversine':
+            # use the lengths stored in the dataset
+            self.metric = metric
+            self.street_data['lengths'] = np.asarray(dataset.street_lengths)
+        elif add_length:
+            self.add_lengths(metric)
+        return self
+
+    @classmethod
+    def from_database(cls, database, bbox = None, street_types = None, add_length = True, metric = 'haversine'):
+        '''
+        Create Streets from the streets of a Database that intersect the **bbox** (minlat, minlon, maxlat, maxlon) and are of
+        one of the **street_types** (all streets if None), only those streets and their nodes are loaded.
+        With a bbox, it is used as bounds of the map excerpt (e.g. for plots).
+        '''
+        self = cls.__new__(cls)
+        self.dataset = None
+        streets = database.query_streets(bbox, street_types)
+        self.street_data = pd.DataFrame({'type': streets['types'], 'is_oneway': np.array(streets['oneway'], dtype = np.int8),
+                                         'postal_code': streets['postal_codes'], 'name': streets['names']},
+                                        index = [str(street_id) for street_id in streets['ids']], columns = ['type', 'is_oneway', 'postal_code', 'name'])
+        self.street_types = set(database.street_type_names)
+        offsets = streets['node_offsets'].tolist()
+        node_ids = streets['node_ids'].astype(str).tolist()
+        self._street_nodes = { street_id: node_ids[offsets[k]:offsets[k+1]] for (k, street_id) in enumerate(self.street_data.index) }
+        self._street_nodes_set = None
+        self._node_coords = None
+        self._set_bounds(dict(zip(['minlat', 'minlon', 'maxlat', 'maxlon'], bbox)) if bbox is not None else database.get_bounds())
+        # coordinates of all nodes that are known (sorted by id, as _set_geometry needs them)
+        found = ~np.isnan(streets['lats'])
+        node_ids, idx = np.unique(streets['node_ids'][found], return_index = True)
+        self._set_geometry(streets['node_offsets'], streets['node_ids'], node_ids, streets['lats'][found][idx], streets['lons'][found][idx])
+        if add_length and metric == 'haversine':
+            # use the lengths stored in the database
+            self.metric = metric
+            self.street_data['lengths'] = np.array(streets['lengths'], dtype = np.float64)
+        elif add_length:
+            self.add_lengths(metric)
+        return self
+
+    def _set_bounds(self, bounds):
         # save min/ max coordinates of the map excerpt
         self.minlat, self.minlon =  np.float_(bounds['minlat']), np.float_(bounds['minlon'])
         self.maxlat, self.maxlon =  np.float_(bounds['maxlat']), np.float_(bounds['maxlon'])
-        # optional: add column with street lengths to the street_data dataframe
-        if add_length:
-            self.street_data['lengths'] = self.street_data.index
-            self.street_data['lengths'] = self.street_data['lengths'].apply(lambda x: self.get_street_length(x))
+
+    def _set_geometry(self, street_offsets, point_node_ids, node_ids, node_lats, node_lons):
+        '''
+        Resolve the coordinates of all street nodes at once (node_ids must be sorted) and store them as flat arrays:
+        street k consists of the points street_offsets[k] to street_offsets[k+1]-1 of street_lats/ street_lons/ street_point_ids.
+        Nodes without coordinates are left out.
+        '''
+        self.node_ids = np.asarray(node_ids, dtype = np.int64)
+        self.node_lats = np.asarray(node_lats, dtype = np.float64)
+        self.node_lons = np.asarray(node_lons, dtype = np.float64)
+        with Profiler.stage('street geometry', len(point_node_ids)):
+            self.street_offsets, self.street_point_ids, self.street_lats, self.street_lons = resolve_polylines(
+                street_offsets, point_node_ids, self.node_ids, self.node_lats, self.node_lons)
+        self._lods = None
+        self._graph = None
+        self._segment_index = None
+
+    @property
+    def lods(self):
+        # simplified street geometries, each level of detail is computed when it is used first (see Simplify.LevelsOfDetail)
+        if self._lods is None:
+            self._lods = LevelsOfDetail(self.street_lats, self.street_lons, self.street_offsets)
+        return self._lods
+
+    @property
+    def segment_index(self):
+        # KD-tree over all street segments (see SpatialIndex.KDTree) and the street of each segment, built on first use
+        if self._segment_index is None:
+            with Profiler.stage('segment index', len(self.street_lats)):
+                is_start = np.zeros(len(self.street_lats), dtype = bool)
+                is_start[self.street_offsets[:-1][self.street_offsets[:-1] < len(self.street_lats)]] = True
+                ends = np.flatnonzero(~is_start[1:]) + 1
+                segment_streets = np.searchsorted(self.street_offsets, ends, side = 'right') - 1
+                self._segment_index = (KDTree(self.street_lats[ends - 1], self.street_lons[ends - 1],
+                                              self.street_lats[ends], self.street_lons[ends]), segment_streets)
+        return self._segment_index
+
+    def nearest_streets(self, lats, lons, k = 1, radius = None, verbose = True):
+        '''
+        Find the **k** nearest streets of all points (lats, lons) at once, or with **radius** all streets within radius metres
+        (at most k of them, if k is given), measured to the closest segment of each street.
+        Returns a DataFrame with one row per pair of point (its position in lats/ lons) and street:
+        ['point', 'rank', 'street', 'type', 'name', 'distance'], sorted by point and distance in metres.
+        '''
+        lats, lons = np.atleast_1d(lats), np.atleast_1d(lons)
+        tree, segment_streets = self.segment_index
+
+        def distinct(point_idx, segments, distances):
+            # only the closest segment of each street (pairs are sorted by point and distance)
+            streets = segment_streets[segments]
+            _, first = np.unique(point_idx * len(self.street_data) + streets, return_index = True)
+            first.sort()
+            ranks = np.arange(len(first)) - np.searchsorted(point_idx[first], point_idx[first])
+            return point_idx[first], streets[first], distances[first], ranks
+
+        with Profiler.stage('nearest streets', len(lats)):
+            if radius is None:
+                # several segments can belong to the same street, so query more of them until there are k streets
+                k, segment_count = k or 1, k or 1
+                while True:
+                    segments, distances = tree.query(lats, lons, segment_count)
+                    point_idx, column = np.nonzero(segments >= 0)
+                    point_idx, streets, distances, ranks = distinct(point_idx, segments[point_idx, column], distances[point_idx, column])
+                    if segment_count >= len(tree) or (np.bincount(point_idx, minlength = len(lats)) >= k).all():
+                        break
+                    segment_count *= 2
+            else:
+                point_idx, streets, distances, ranks = distinct(*tree.query_radius(lats, lons, radius))
+            if k:
+                point_idx, streets, distances, ranks = (array[ranks < k] for array in (point_idx, streets, distances, ranks))
+        result = pd.DataFrame({'point': point_idx, 'rank': ranks + 1, 'street': self.street_data.index[streets],
+                               'type': self.street_data['type'].values[streets], 'name': self.street_data['name'].values[streets],
+                               'distance': distances}, columns = ['point', 'rank', 'street', 'type', 'name', 'distance'])
+        if verbose:
+            print('\nThe nearest streets of the given points are:\n')
+            print(result.to_string(index = False))
+        return result
+
+    def routing_graph(self, directory = None):
+        '''
+        Return the routing graph of the streets (see Routing.RoutingGraph). It is saved to **directory** (by default the
+        subdirectory 'routing' of the dataset, if the streets were loaded from one) and loaded from there in later runs,
+        as long as it was built from the same street geometry.
+        '''
+        if self._graph is not None:
+            return self._graph
+        if directory is None and self.dataset is not None:
+            directory = os.path.join(self.dataset.npy_dir, 'routing')
+        oneway = pd.to_numeric(self.street_data['is_oneway']).values.astype(bool)
+        graph = RoutingGraph.load(directory) if directory and os.path.isdir(directory) else None
+        if graph is None or graph.key != graph_key(self.street_offsets, self.street_point_ids, self.street_lats, self.street_lons, oneway):
+            graph = RoutingGraph.from_streets(self.street_offsets, self.street_point_ids, self.street_lats, self.street_lons, oneway)
+            if directory:
+                print("Saving routing graph to '%s'..." % directory)
+                graph.save(directory)
+        self._graph = graph
+        return graph
+
+    @property
+    def street_nodes(self):
+        # street_nodes = {..., street_id: [node1, node2, ..], ...}
+        if self._street_nodes is None:
+            offsets = self.dataset.street_node_offsets.tolist()
+            node_ids = self.dataset.street_node_ids.astype(str).tolist()
+            self._street_nodes = { street_id: node_ids[offsets[k]:offsets[k+1]] for (k, street_id) in enumerate(self.street_data.index) }
+        return self._street_nodes
+
+    @property
+    def street_nodes_set(self):
+        # collect all nodes that define any street in a set
+        if self._street_nodes_set is None:
+            self._street_nodes_set = set()
+            for node_list in self.street_nodes.values():
+                self._street_nodes_set.update(node_list)
+        return self._street_nodes_set
+
+    @property
+    def node_coords(self):
+        # node_coords = {..., node_id: (node_lat, node_lon), ...}
+        if self._node_coords is None:
+            self._node_coords = dict(zip(self.node_ids.astype(str).tolist(), zip(self.node_lats.tolist(), self.node_lons.tolist())))
+        return self._node_coords
+
+    def add_lengths(self, metric = 'haversine'):
+        '''
+        Add column with the lengths of all streets to the street_data dataframe, computed in one vectorized pass.
+        metric: 'haversine' (metres on a sphere), 'ellipsoidal' (metres on the WGS84 ellipsoid) or 'planar' (degrees).
+        '''
+        self.metric = metric
+        with Profiler.stage('length computation', len(self.street_lats)):
+            self.street_data['lengths'] = polyline_lengths(self.street_lats, self.street_lons, self.street_offsets, metric)
 
     def print_street_types(self):
         print('Possible street types are...\n')
@@ -42,43 +246,30 @@ class Streets(object):
         '''
         default: return single list of coordinate tuples for a single street with id way_id.
         if as_lists = True: return a list of two lists (separate lat-coordinates resp. lon-coordinates) for a single street with id way_id. '''
-        assert(street_id in self.street_nodes)
-        way_nodes = self.street_nodes[street_id]
-        street_coords = []
+        assert(street_id in self.street_data.index)
+        k = self.street_data.index.get_loc(street_id)
+        start, end = self.street_offsets[k], self.street_offsets[k+1]
+        lat_coords = self.street_lats[start:end].tolist()
+        lon_coords = self.street_lons[start:end].tolist()
         if as_lists:
-            lat_coords = []
-            lon_coords = []
-        for node_id in way_nodes:
-            if node_id in self.node_coords:
-                node_lat, node_lon = self.node_coords[node_id]
-            else:
-                node_lat, node_lon = 0, 0
-            if as_lists:
-                lat_coords.append(node_lat)
-                lon_coords.append(node_lon)
-            else:
-                street_coords.append( (node_lat, node_lon) )
-        if as_lists:
-            street_coords = [lat_coords, lon_coords]
-        return street_coords
+            return [lat_coords, lon_coords]
+        return list(zip(lat_coords, lon_coords))
 
-    def get_street_length(self, street_id):
+    def get_street_length(self, street_id, metric = None):
         '''
-        Compute and return the length of a street with id street_id.
+        Compute and return the length of a street with id street_id (by default in the metric of the lengths column).
         '''
-        coords = self.get_street_coords(street_id)
-        street_length = 0
-        for n in range( len(coords)-1 ):
-            diff_coords = np.subtract(np.float_(coords[n+1]), np.float_(coords[n]))
-            path_length = np.sqrt( diff_coords[0]**2 + diff_coords[0]**2 )
-            street_length += path_length
-        return street_length
+        lat_coords, lon_coords = self.get_street_coords(street_id, as_lists = True)
+        if len(lat_coords) < 2:
+            return 0.0
+        return segment_lengths(lat_coords, lon_coords, metric or getattr(self, 'metric', 'haversine')).sum()
 
-    def analyze_street_lengths(self, stat, street_type = None):
+    def analyze_street_lengths(self, stat, street_type = None, verbose = True):
         '''
         Compute and return a specific statistic of street lengths.
         stat: which statistic to use, possibilities: 'max', 'min', 'median', 'average'.
         street_type: optional, compute statistic only for the desired street types.
+        verbose: print the result.
         '''
         assert(stat in ['max', 'min', 'median', 'average'])
         if not street_type:
@@ -91,11 +282,13 @@ class Streets(object):
         # compute desired statistic
         if stat == 'median':
             result = length_data.median()
-            print('The median of street lengths is %s.\n' %result)
+            if verbose:
+                print('The median of street lengths is %s.\n' %result)
             return result
         if stat == 'average':
             result = length_data.mean()
-            print('The average of street lengths is %s.\n' %result)
+            if verbose:
+                print('The average of street lengths is %s.\n' %result)
             return result
         if stat == 'max':
             stat_idx = length_data.idxmax()
@@ -103,92 +296,146 @@ class Streets(object):
             stat_idx = length_data.idxmin()
         stat_value = length_data[stat_idx]
         stat_row = self.street_data.loc[stat_idx, :]
-        print('\nThe result of computing %s of street lengths is %s.\n' %(stat, stat_value))
+        if verbose:
+            print('\nThe result of computing %s of street lengths is %s.\n' %(stat, stat_value))
         return stat_value, stat_idx, stat_row
 
-    def plot(self, street_type = None, dpi = 200):
+    def plot(self, street_type = None, dpi = 200, width = None, height = None, styles = None, style_by_type = True):
+        '''
+        Render the streets (optionally only those of type street_type) in a single pass into one in-memory image
+        and save it to './images/Streets_<time>.png'. Returns the path of the image.
+        width/ height: size in pixels (a missing side follows the aspect ratio of the map excerpt,
+        without both the width of a 6.4 inch figure at dpi is used), dpi is stored in the png file.
+        style_by_type: color and line width of each street depend on its type (see Renderer.STREET_STYLES or styles).
+        The streets are drawn at the level of detail that deviates at most half a pixel from their full geometry.
+        '''
         print('\nPlotting streets...')
-        counter = 0
-        count_file = 0
-        plt.rc('lines', linewidth=0.1, color='black')
-        fig = plt.figure()
-        fig_plot = fig.add_subplot(1, 1, 1)
-        fig_plot.axis([0, 0.5, 0, 0.2])
-        fig_plot.axis('off')
+        dpi = int(dpi or 100)
         if street_type:
             assert(street_type in self.street_types)
-            street_ids = list(self.street_data.loc[ self.street_data['type'] == street_type ].index)
-            street_nodes = { id: self.street_nodes[id] for id in street_ids }
+            selected = np.flatnonzero((self.street_data['type'] == street_type).values)
         else:
-            street_nodes = self.street_nodes
-        street_total = len(street_nodes)
-        # get current time
+            selected = np.arange(len(self.street_data))
+        bounds = (self.minlat, self.minlon, self.maxlat, self.maxlon)
+        width, height = image_size(bounds, width, height, dpi)
+        with Profiler.stage('simplification', len(self.street_lats)):
+            point_idx, offsets = self.lods.take(selected, self.lods.tolerance_for(pixel_size(bounds, width)))
+        types = self.street_data['type'].values[selected] if style_by_type else None
+        with Profiler.stage('render', len(point_idx)):
+            image = render_streets(self.street_lats[point_idx], self.street_lons[point_idx], offsets, bounds, types = types,
+                                   width = width, height = height, dpi = dpi, styles = styles)
         time_now = time.strftime('%d.%m.%Y_%H.%M.%S')
-        # set paths of the temporary directory to store single images
         out_dir = os.path.join('./', 'images/')
-        print('outdir:\t %s' % out_dir)
         if not os.path.isdir(out_dir):
             os.mkdir(out_dir)
-        for street_id in street_nodes:
-            counter += 1
-            x_coords = []
-            y_coords = []
-            for (lat, lon) in self.get_street_coords(street_id):
-                (y_0, x_0) = (np.float_(lat) - self.minlat, np.float_(lon) - self.minlon)
-                x_coords.append(x_0)
-                y_coords.append(y_0)
-            fig_plot.plot(x_coords , y_coords, color = 'k')
-            if counter >= 10000:
-                plt.savefig( (os.path.join('./images/', 'street-layer_%s_%s.png' % (time_now, count_file))),
-                                dpi = dpi, linewith = 1, frameon=False, transparent = True)
-                plt.close()
-                fig = plt.figure()
-                fig_plot = fig.add_subplot(1, 1, 1)
-                fig_plot.axis('off')
-                fig_plot.axis([0, 0.5, 0, 0.2])
-                count_file +=1
-                counter = 0
-            processed_streets_count = counter + (count_file * 10000)
-            if processed_streets_count == street_total:
-                fig.savefig( (os.path.join('./images/','street-layer_%s_%s.png' % (time_now, count_file))),
-                                dpi = dpi, linewith = 1, frameon=False, transparent = False )   # bbox_inches='tight'
-                plt.close()
-                break
-        self.merge_plots(time_now, count_file)
+        out_file = os.path.join(out_dir, 'Streets_%s.png' % time_now)
         print("Saving street image to file 'Streets_%s.png'..." % time_now)
-        for k in range(count_file + 1):
-            current_file = os.path.join('./images/','street-layer_%s_%s.png' % (time_now, k))
-            if os.path.exists(current_file):
-                os.remove(current_file)
+        with Profiler.stage('png write'):
+            Image.fromarray(image).save(out_file, dpi = (dpi, dpi))
         print('Done.')
-        return os.path.join('./images/', 'Streets_%s.png' % time_now)
-
-    def merge_plots(self, time_now, count_file):
-        # open images
-        src0 = Image.open(os.path.join('./images/','street-layer_%s_%s.png' % (time_now, count_file)))
-        for k in range(count_file - 1):
-            src1 = Image.open(os.path.join('./images/','street-layer_%s_%s.png' % (time_now, k)))
-            src0.paste(src1, (0, 0), src1)
-        src0.save(os.path.join('./images/', 'Streets_%s.png' % time_now))
+        return out_file
 
-    def get_oneway_quota(self, street_type = None):
+    def get_oneway_quota(self, street_type = None, verbose = True):
         if not street_type:
             oneway_data = self.street_data['is_oneway']
         else:
             assert(street_type in self.street_types)
             oneway_data = self.street_data.loc[self.street_data['type'] == street_type]['is_oneway']
         total_number = len(oneway_data)
-        # depending on the used pandas version, two different functions must be called to convert values of oneway_data to int
-        if pd.__version__ < str(0.17):
-            oneway_number = oneway_data.convert_objects(convert_numeric=True).sum()
-        else:
+        # pandas before 0.17 has no to_numeric, but convert_objects to convert the values of oneway_data to int
+        if hasattr(pd, 'to_numeric'):
             oneway_number = pd.to_numeric(oneway_data).sum()
+        else:
+            oneway_number = oneway_data.convert_objects(convert_numeric=True).sum()
         quota = oneway_number / total_number
-        print('Oneway quota is %s %%.\n' % (quota*100))
-        print('The total count of oneway streets is %s out of %s streets in total.' %(oneway_number, total_number))
+        if verbose:
+            print('Oneway quota is %s %%.\n' % (quota*100))
+            print('The total count of oneway streets is %s out of %s streets in total.' %(oneway_number, total_number))
         return quota, oneway_number, total_number
 
-    def run_streets(self, print_types=None, stat=None, street_type=None, plot=False, dpi=None, oneway=False):
+    def route(self, from_coords, to_coords, directory = None, verbose = True):
+        '''
+        Compute the shortest route (respecting oneway streets) between the junctions closest to the points
+        **from_coords** and **to_coords** (lat, lon). Returns (length in metres, node ids of the junctions, street ids),
+        the length is inf if there is no route. directory: see routing_graph.
+        '''
+        graph = self.routing_graph(directory)
+        source, target = graph.nearest_vertex(*from_coords), graph.nearest_vertex(*to_coords)
+        with Profiler.stage('shortest path'):
+            distance, vertices, edges = graph.shortest_path(source, target)
+        # the streets along the route, each one only once per passage
+        street_ids = [street_id for (k, street_id) in enumerate(self.street_data.index[graph.edge_streets[edges]])
+                      if k == 0 or street_id != self.street_data.index[graph.edge_streets[edges[k-1]]]]
+        node_ids = graph.node_ids[vertices].tolist()
+        if verbose:
+            if np.isinf(distance):
+                print('\nThere is no route from node %s to node %s.\n' % (graph.node_ids[source], graph.node_ids[target]))
+            else:
+                print('\nThe shortest route from node %s to node %s is %.1f metres long and passes %s junctions.' %
+                      (graph.node_ids[source], graph.node_ids[target], distance, len(node_ids)))
+                print('It follows the streets: %s\n' % ', '.join('%s (%s)' % (street_id, self.street_data.loc[street_id, 'name'])
+                                                                for street_id in street_ids))
+        return distance, node_ids, street_ids
+
+    def reachable(self, coords, max_distance, directory = None, verbose = True):
+        '''
+        Find all junctions that can be reached (respecting oneway streets) within **max_distance** metres from the junction
+        closest to the point **coords** (lat, lon). Returns the arrays (node ids, distances in metres), sorted by distance.
+        directory: see routing_graph.
+        '''
+        graph = self.routing_graph(directory)
+        source = graph.nearest_vertex(*coords)
+        with Profiler.stage('reachability'):
+            vertices, distances = graph.reachable(source, max_distance)
+        if verbose:
+            print('\n%s of %s junctions can be reached from node %s within %s metres.\n' %
+                  (len(vertices), graph.vertex_count(), graph.node_ids[source], max_distance))
+        return graph.node_ids[vertices], distances
+
+    def topology(self, street_type = None, verbose = True):
+        '''
+        Analyze the topology of the street network (optionally only of the streets of type street_type, see
+        Routing.network_topology): node degrees, junctions (degree >= 3), dead ends (degree 1) and connected components.
+        Returns a dict with the arrays 'node_ids', 'degrees', 'components' over all nodes, the 'degree_counts' (number of
+        nodes per degree), the node ids of the 'junctions' and 'dead_ends' and the 'component_sizes' (largest first).
+        '''
+        if street_type:
+            assert(street_type in self.street_types)
+            selected = np.flatnonzero((self.street_data['type'] == street_type).values)
+        else:
+            selected = np.arange(len(self.street_data))
+        point_idx, offsets = take_polylines(self.street_offsets, selected)
+        result = network_topology(offsets, self.street_point_ids[point_idx])
+        degrees = result['degrees']
+        result['degree_counts'] = np.bincount(degrees)
+        result['junctions'] = result['node_ids'][degrees >= 3]
+        result['dead_ends'] = result['node_ids'][degrees == 1]
+        result['component_sizes'] = np.sort(np.bincount(result['components'])[np.unique(result['components'])])[::-1]
+        if verbose:
+            sizes = result['component_sizes']
+            print('\nThe street network has %s nodes and %s segments.' % (len(degrees), degrees.sum() // 2))
+            print('Degree distribution (degree: nodes): %s' % ', '.join('%s: %s' % (degree, count)
+                                                                        for (degree, count) in enumerate(result['degree_counts']) if count))
+            print('%s junctions, %s dead ends.' % (len(result['junctions']), len(result['dead_ends'])))
+            if len(sizes):
+                print('%s connected components, the largest one has %s nodes (%.1f %%), %s components have less than 10 nodes.\n' %
+                      (len(sizes), sizes[0], sizes[0] * 100.0 / len(degrees), (sizes < 10).sum()))
+        return result
+
+    def topology_by_type(self):
+        '''
+        Summary of the topology of the streets of each type (see topology), as DataFrame indexed by the street types.
+        '''
+        rows = {}
+        for street_type in sorted(self.street_types):
+            result = self.topology(street_type, verbose = False)
+            sizes = result['component_sizes']
+            rows[street_type] = [len(result['node_ids']), len(result['junctions']), len(result['dead_ends']), len(sizes),
+                                 sizes[0] if len(sizes) else 0]
+        return pd.DataFrame.from_dict(rows, orient = 'index', columns = ['nodes', 'junctions', 'dead_ends', 'components', 'largest_component'])
+
+    def run_streets(self, print_types=None, stat=None, street_type=None, plot=False, dpi=None, oneway=False, width=None, height=None,
+                    route=None, reachable=None, routing_dir=None, topology=False, nearest=None, k=None, radius=None):
         if street_type:
             print('\nChosen street_type is %s' %street_type)
         else:
@@ -198,11 +445,29 @@ class Streets(object):
         if stat:
             if not stat in ['max', 'min', 'median', 'average']:
                 print("Given statistic %s is not valid. Use one of 'max', 'min', 'mean', 'average'.\n")
-            self.analyze_street_lengths(stat, street_type)
+            with Profiler.stage('analyze_street_lengths'):
+                self.analyze_street_lengths(stat, street_type)
         if plot:
-            self.plot(street_type, dpi)
+            with Profiler.stage('plot'):
+                self.plot(street_type, dpi, width, height)
         if oneway:
-            self.get_oneway_quota(street_type)
+            with Profiler.stage('get_oneway_quota'):
+                self.get_oneway_quota(street_type)
+        if topology:
+            with Profiler.stage('topology analysis'):
+                self.topology(street_type)
+                if not street_type:
+                    print('Topology of the streets of each type:\n')
+                    print(self.topology_by_type())
+        if nearest is not None:
+            with Profiler.stage('nearest_streets'):
+                self.nearest_streets(nearest[0], nearest[1], k, radius)
+        if route:
+            with Profiler.stage('route'):
+                self.route(route[:2], route[2:], routing_dir)
+        if reachable:
+            with Profiler.stage('reachable'):
+                self.reachable(reachable[:2], reachable[2], routing_dir)
 
 #############################################################################################################################
 
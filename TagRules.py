@@ -0,0 +1,170 @@
+import json
+
+# element types and the attribute columns that can be kept for them,
+# list columns (all node refs of a way resp. all way members of a relation) are appended to the end of a row
+ELEMENT_TYPES = ['node', 'way', 'relation']
+ATTRIBUTE_COLUMNS = {'node': ['@id', '@lat', '@lon'], 'way': ['@id', '@nodes'], 'relation': ['@id', '@ways']}
+LIST_COLUMNS = ['@nodes', '@ways']
+
+# The tables that collect_data needs for the cameras, streets and postal areas. Their columns are fixed,
+# a rule file may only change which elements they match (keys match and require).
+DEFAULT_RULES = {
+    'cameras': {'element': 'node', 'match': {'man_made': ['surveillance']}, 'keep': ['@id', '@lat', '@lon']},
+    'streets': {'element': 'way', 'match': {'highway': None}, 'keep': ['@id', 'highway', 'oneway=yes', 'postal_code', 'name', '@nodes']},
+    'postal_areas': {'element': 'relation', 'match': {'boundary': ['postal_code']}, 'require': ['postal_code'], 'keep': ['@id', 'postal_code', '@ways']},
+}
+
+def load_rules(rule_file = None):
+    '''
+    Read the rules of the json file **rule_file** and return them together with the DEFAULT_RULES. The file holds an object
+    {..., table_name: rule, ...}, where each rule is an object with
+        - **element**: 'node', 'way' or 'relation'
+        - **match**: {..., key: [value1, value2, ..] or null, ...}, an element matches if it has any of the tags (null: any value)
+        - **require** (optional): [key1, key2, ..], keys that must be present with a non-empty value in addition
+        - **keep**: the columns of the table, each one an attribute ('@id', '@lat', '@lon', '@nodes' or '@ways'),
+          a tag key (its value, None if missing) or 'key=value' (1 if the element has this tag, 0 otherwise)
+    Rules named like the default tables only replace their match and require.
+    '''
+    rules = {name: dict(rule) for (name, rule) in DEFAULT_RULES.items()}
+    if rule_file:
+        with open(rule_file, 'r') as read_file:
+            file_rules = json.load(read_file)
+        for name, rule in file_rules.items():
+            if name in DEFAULT_RULES:
+                assert(rule.get('element', DEFAULT_RULES[name]['element']) == DEFAULT_RULES[name]['element']), 'Table %s must match %ss' % (name, DEFAULT_RULES[name]['element'])
+                rules[name]['match'] = rule.get('match', DEFAULT_RULES[name]['match'])
+                # the keys that collect_data relies on stay required
+                rules[name]['require'] = sorted(set(rule.get('require', []) + DEFAULT_RULES[name].get('require', [])))
+            else:
+                rules[name] = rule
+    for name, rule in rules.items():
+        _check_rule(name, rule)
+    return rules
+
+def _check_rule(name, rule):
+    element = rule.get('element')
+    assert(element in ELEMENT_TYPES), 'Unknown element %s of table %s' % (element, name)
+    assert(rule.get('match')), 'Table %s does not match any tag' % name
+    for column in rule.get('keep', []):
+        if column.startswith('@'):
+            assert(column in ATTRIBUTE_COLUMNS[element]), 'Unknown column %s of table %s' % (column, name)
+    list_columns = [column for column in rule.get('keep', []) if column in LIST_COLUMNS]
+    assert(not list_columns or rule['keep'][-1] in LIST_COLUMNS and len(list_columns) == 1), 'Table %s may only have one list column at its end' % name
+
+class RuleSet(object):
+    '''
+    Tag rules (see load_rules) compiled into a dispatch table {element: {key: {value: [table indices]}}} (value None for any value),
+    so the tables matched by an element are found with one dictionary lookup per tag.
+    '''
+
+    def __init__(self, rules = DEFAULT_RULES):
+        self.names = list(rules)
+        self.elements = [rules[name]['element'] for name in self.names]
+        self.requires = [list(rules[name].get('require', [])) for name in self.names]
+        self.columns = [list(rules[name].get('keep', [])) for name in self.names]
+        # columns compiled to (kind, key, value) with kind 'list', 'attribute', 'flag' or 'tag'
+        self.getters = [[_compile_column(column) for column in columns] for columns in self.columns]
+        self.dispatch = {element: {} for element in ELEMENT_TYPES}
+        for index, name in enumerate(self.names):
+            for key, values in rules[name]['match'].items():
+                entry = self.dispatch[self.elements[index]].setdefault(key, {})
+                for value in (values if values is not None else [None]):
+                    entry.setdefault(value, []).append(index)
+        self.default = {name: self.names.index(name) for name in DEFAULT_RULES}
+        # indices of the additional tables of each element type
+        self.extra = {element: [index for index, name in enumerate(self.names) if self.elements[index] == element and name not in DEFAULT_RULES]
+                      for element in ELEMENT_TYPES}
+        # all keys of the rules of each element type (an element needs one of them to match any table)
+        self.keys = {element: set(self.dispatch[element]) for element in ELEMENT_TYPES}
+
+    def match(self, element, tags):
+        '''
+        Return the indices of all tables matched by an element of type **element** with its **tags** [(key, value), ...].
+        '''
+        dispatch = self.dispatch[element]
+        matched = []
+        for (key, value) in tags:
+            entry = dispatch.get(key)
+            if entry is not None:
+                matched += entry.get(value, ())
+                matched += entry.get(None, ())
+        if not matched:
+            return matched
+        matched = sorted(set(matched))
+        if any(self.requires[index] for index in matched):
+            values = dict(tags)
+            matched = [index for index in matched if all(values.get(key) for key in self.requires[index])]
+        return matched
+
+    def row(self, index, tags, attributes):
+        '''
+        Return the row of table **index** for an element with its **tags** and its **attributes** {'@id': .., ...}.
+        '''
+        values = dict(tags)
+        row = []
+        for (kind, key, value) in self.getters[index]:
+            if kind == 'tag':
+                row.append(values.get(key))
+            elif kind == 'flag':
+                row.append(1 if values.get(key) == value else 0)
+            elif kind == 'attribute':
+                row.append(attributes[key])
+            else:
+                row += attributes[key]
+        return tuple(row)
+
+def _compile_column(column):
+    if column in LIST_COLUMNS:
+        return ('list', column, None)
+    if column.startswith('@'):
+        return ('attribute', column, None)
+    if '=' in column:
+        key, value = column.split('=', 1)
+        return ('flag', key, value)
+    return ('tag', column, None)
+
+# The following functions interpret the tags of an element independent of the input format (xml or pbf)
+# by the active tag rules, which are set by parseXML_singleRun.collect_data (and by the initializer of its worker processes).
+_RULES = RuleSet()
+
+def set_rules(rules):
+    global _RULES
+    _RULES = rules
+
+def active_rules():
+    return _RULES
+
+def is_camera(tags):
+    # a node is a camera if it matches the rule of the cameras table (by default it is tagged as man_made = surveillance)
+    # most nodes have no tags at all, so they are sorted out first
+    return bool(tags) and _RULES.default['cameras'] in _RULES.match('node', tags)
+
+def table_rows(element, tags, attributes):
+    '''
+    Return the ('row', (table, row)) tuples of all additional tables of the rules that are matched by an element
+    of type **element** with its **tags** [(key, value), ...] and its **attributes** (see RuleSet.row).
+    '''
+    extra = _RULES.extra[element]
+    return [ ('row', (_RULES.names[index], _RULES.row(index, tags, attributes))) for index in _RULES.match(element, tags) if index in extra ]
+
+def street_info(way_id, tags, way_nodes):
+    '''
+    Return the output tuple of parseXML_singleRun._get_street for a way with its **tags** [(key, value), ...] and its **way_nodes**.
+    '''
+    streets = _RULES.default['streets']
+    if streets in _RULES.match('way', tags):
+        # it is a highway/ street, return all way data (type, is_oneway, postal_code, name) including all its nodes
+        return (True,) + _RULES.row(streets, tags, {'@id': way_id, '@nodes': way_nodes})
+    # if it is no highway, return only is_highway (Bool), id and its corresponding nodes
+    return (False, way_id, None, None, None, None) + tuple(way_nodes)
+
+def postal_info(relation_id, tags, member_ways):
+    '''
+    Return the output tuple of parseXML_singleRun._get_relation for a relation with its **tags** [(key, value), ...] and its way members **member_ways**.
+    '''
+    postal_areas = _RULES.default['postal_areas']
+    if postal_areas in _RULES.match('relation', tags):
+        # it is a postal area (with a postal code), return the postal area data
+        return _RULES.row(postal_areas, tags, {'@id': relation_id, '@ways': member_ways})
+    # no postal area
+    return None
@@ -0,0 +1,182 @@
+import os
+import json
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import Profiler
+from Geometry import EARTH_RADIUS, take_polylines
+from Renderer import STREET_STYLES, DEFAULT_STYLE, draw_streets
+from SpatialIndex import GridIndex
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798        # latitude limit of the web mercator projection
+CACHE_FILE = 'tiles.json'           # content hashes of all rendered tiles, stored in the tile directory
+COMPRESS_LEVEL = 1                  # zlib level of the png tiles, encoding dominates the rendering time at higher levels
+
+def mercator(lats, lons):
+    '''
+    Project coordinates to normalized web mercator coordinates (x, y) in [0, 1], where y grows southwards like the tile rows.
+    The tile (zoom, x, y) covers x/2^zoom to (x+1)/2^zoom and y/2^zoom to (y+1)/2^zoom.
+    '''
+    phi = np.radians(np.clip(np.asarray(lats, dtype = np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lons, dtype = np.float64) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(phi) + 1.0 / np.cos(phi)) / np.pi) / 2.0
+    return x, y
+
+def tile_bounds(zoom, x, y):
+    '''
+    Return the bounds (minlat, minlon, maxlat, maxlon) of the tile (zoom, x, y).
+    '''
+    n = 2.0**zoom
+    lons = np.array([x, x + 1]) / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.array([y + 1, y]) / n))))
+    return lats[0], lons[0], lats[1], lons[1]
+
+def tile_range(bounds, zoom):
+    '''
+    Return the ranges (x0, x1, y0, y1) of the tile columns and rows (inclusive) that cover the map excerpt **bounds**.
+    '''
+    minlat, minlon, maxlat, maxlon = bounds
+    (x0, x1), (y1, y0) = mercator([minlat, maxlat], [minlon, maxlon])
+    n = 2**zoom
+    clip = lambda value: int(min(max(np.floor(value * n), 0), n - 1))
+    return clip(x0), clip(x1), clip(y0), clip(y1)
+
+def _street_boxes(xs, ys, offsets):
+    # bounding boxes (min_y, min_x, max_y, max_x) of all streets, empty streets get an empty box
+    offsets = np.asarray(offsets, dtype = np.int64)
+    non_empty = offsets[1:] > offsets[:-1]
+    boxes = [np.full(len(offsets) - 1, np.inf), np.full(len(offsets) - 1, np.inf),
+             np.full(len(offsets) - 1, -np.inf), np.full(len(offsets) - 1, -np.inf)]
+    if non_empty.any():
+        starts = offsets[:-1][non_empty]
+        boxes[0][non_empty], boxes[1][non_empty] = np.minimum.reduceat(ys, starts), np.minimum.reduceat(xs, starts)
+        boxes[2][non_empty], boxes[3][non_empty] = np.maximum.reduceat(ys, starts), np.maximum.reduceat(xs, starts)
+    return boxes
+
+# data of the streets in each worker process, set once by _init_worker
+_TILE_DATA = {}
+
+def _init_worker(data):
+    _TILE_DATA.clear()
+    _TILE_DATA.update(data)
+
+def _render_tile(task):
+    '''
+    Render the tile (zoom, x, y) of a task to out_file, unless its content hash equals old_hash and the file exists.
+    Only the streets whose bounding box touches the tile (extended by the widest line) are taken from the index.
+    Returns (zoom, x, y, hash, status) with status 'rendered', 'cached' or 'empty' (hash is None for empty tiles).
+    '''
+    zoom, x, y, old_hash, out_file = task
+    data = _TILE_DATA
+    tile_size = data['tile_size']
+    scale = 2.0**zoom
+    margin = data['margin'] / (scale * tile_size)
+    street_idx = data['index'].query_box(y / scale - margin, x / scale - margin, (y + 1) / scale + margin, (x + 1) / scale + margin)
+    if not len(street_idx):
+        if os.path.exists(out_file):
+            os.remove(out_file)
+        return zoom, x, y, None, 'empty'
+    level_xs, level_ys, level_offsets = data['levels'][zoom]
+    point_idx, offsets = take_polylines(level_offsets, street_idx)
+    xs = level_xs[point_idx] * scale * tile_size - x * tile_size
+    ys = level_ys[point_idx] * scale * tile_size - y * tile_size
+    types = data['types'][street_idx] if data['types'] is not None else None
+    # the content of a tile only depends on its pixel coordinates, the street types and the styles
+    digest = hashlib.sha1()
+    for array in [xs, ys, offsets]:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(('\n'.join(types) if types is not None else '').encode('utf-8'))
+    digest.update(data['style_key'].encode('utf-8'))
+    digest = digest.hexdigest()
+    if digest == old_hash and os.path.exists(out_file):
+        return zoom, x, y, digest, 'cached'
+    image = np.zeros((tile_size, tile_size, 4), dtype = np.uint8)
+    draw_streets(image, xs, ys, offsets, types, data['styles'])
+    out_dir = os.path.dirname(out_file)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    Image.fromarray(image, 'RGBA').save(out_file, compress_level = COMPRESS_LEVEL)
+    return zoom, x, y, digest, 'rendered'
+
+def render_tiles(streets, out_dir = './tiles/', min_zoom = 10, max_zoom = 14, street_types = None, workers = 1,
+                 tile_size = TILE_SIZE, styles = None, style_by_type = True, use_cache = True):
+    '''
+    Render the streets of a Streets object (optionally only those of the given street_types) into a slippy map
+    tile pyramid <out_dir>/<zoom>/<x>/<y>.png (transparent png tiles in web mercator) for all tiles of the zoom levels
+    min_zoom to max_zoom that cover the map excerpt.
+    Each zoom level draws the streets at the level of detail that deviates at most half a pixel (see Streets.lods).
+    The streets are bucketed per tile through a grid index over their bounding boxes and the tiles are rendered in a
+    process pool with the given number of workers. With use_cache, a tile is only rendered again if the content hash
+    of its input (geometry, types and styles) differs from the one stored in <out_dir>/tiles.json.
+    Tiles without any street are not written. Returns a dict {zoom: {'rendered': .., 'cached': .., 'empty': ..}}.
+    '''
+    print('\nRendering tiles of zoom levels %s to %s to %s...' % (min_zoom, max_zoom, out_dir))
+    street_data = streets.street_data
+    if street_types:
+        for street_type in street_types:
+            assert(street_type in streets.street_types), 'Unknown street type %s' % street_type
+        selected = np.flatnonzero(street_data['type'].isin(street_types).values)
+    else:
+        selected = np.arange(len(street_data))
+    with Profiler.stage('tile index', len(selected)):
+        point_idx, offsets = take_polylines(streets.street_offsets, selected)
+        xs, ys = mercator(streets.street_lats[point_idx], streets.street_lons[point_idx])
+        index = GridIndex(*_street_boxes(xs, ys, offsets))
+    # every zoom level gets the level of detail of its pixel size (at the latitude of the excerpt farthest from the equator),
+    # the index of the full geometry is valid for all of them
+    with Profiler.stage('simplification', len(streets.street_lats)):
+        levels = {None: (xs, ys, offsets)}
+        zoom_levels = {}
+        equator_pixel = 2 * np.pi * EARTH_RADIUS * np.cos(np.radians(max(abs(streets.minlat), abs(streets.maxlat)))) / tile_size
+        for zoom in range(min_zoom, max_zoom + 1):
+            tolerance = streets.lods.tolerance_for(equator_pixel / 2.0**zoom)
+            if tolerance not in levels:
+                level_idx, level_offsets = streets.lods.take(selected, tolerance)
+                levels[tolerance] = mercator(streets.street_lats[level_idx], streets.street_lons[level_idx]) + (level_offsets,)
+            zoom_levels[zoom] = levels[tolerance]
+    styles = STREET_STYLES if styles is None else styles
+    data = {'levels': zoom_levels, 'tile_size': tile_size, 'styles': styles,
+            'types': street_data['type'].values[selected].astype(str).astype(object) if style_by_type else None,
+            'index': index,
+            'margin': max([style[1] for style in list(styles.values()) + [DEFAULT_STYLE]]),
+            'style_key': json.dumps(sorted((key, list(style)) for (key, style) in styles.items()) + [style_by_type, tile_size])}
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    cache_path = os.path.join(out_dir, CACHE_FILE)
+    cache = {}
+    if use_cache and os.path.isfile(cache_path):
+        with open(cache_path, 'r') as cache_file:
+            cache = json.load(cache_file)
+    bounds = (streets.minlat, streets.minlon, streets.maxlat, streets.maxlon)
+    tasks = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        x0, x1, y0, y1 = tile_range(bounds, zoom)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                key = '%s/%s/%s' % (zoom, x, y)
+                tasks.append( (zoom, x, y, cache.get(key), os.path.join(out_dir, str(zoom), str(x), '%s.png' % y)) )
+
+    with Profiler.stage('render tiles', len(tasks)):
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (data,)) as executor:
+                results = list(executor.map(_render_tile, tasks, chunksize = max(1, len(tasks) // (workers * 8))))
+        else:
+            _init_worker(data)
+            results = [_render_tile(task) for task in tasks]
+            _TILE_DATA.clear()
+
+    counts = {zoom: {'rendered': 0, 'cached': 0, 'empty': 0} for zoom in range(min_zoom, max_zoom + 1)}
+    new_cache = {key: value for (key, value) in cache.items() if not min_zoom <= int(key.split('/')[0]) <= max_zoom}
+    for (zoom, x, y, digest, status) in results:
+        counts[zoom][status] += 1
+        if digest is not None:
+            new_cache['%s/%s/%s' % (zoom, x, y)] = digest
+    with open(cache_path, 'w') as cache_file:
+        json.dump(new_cache, cache_file)
+    print('\n%6s %10s %10s %10s' % ('zoom', 'rendered', 'cached', 'empty'))
+    for zoom in sorted(counts):
+        print('%6s %10s %10s %10s' % (zoom, counts[zoom]['rendered'], counts[zoom]['cached'], counts[zoom]['empty']))
+    return counts
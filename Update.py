@@ -0,0 +1,246 @@
+import time
+import itertools
+import numpy as np
+import xml.etree.ElementTree as et
+import Profiler
+from NodeStore import NodeStore
+from Geometry import take_polylines
+from Rings import area_rings
+from Dataset import Dataset, write_arrays, street_lengths, camera_areas, decode_strings, flat_lists, string_table, ring_arrays, split_rings
+from parseXML_singleRun import _get_camera, _get_street, _get_relation
+
+def read_changes(osc_file):
+    '''
+    Parse an osmChange file **osc_file** (with create, modify and delete sections) and return the dicts
+        - **nodes** {..., node_id: (is_cam, node_lat, node_lon) or None if deleted, ...}
+        - **ways** {..., way_id: output of _get_street or None if deleted, ...}
+        - **areas** {..., relation_id: (postal_code, [way1, way2, ..]) or None if deleted or no postal area (anymore), ...}
+    Later changes of the same element replace earlier ones.
+    '''
+    nodes, ways, areas = {}, {}, {}
+    action = None
+    for event, elem in et.iterparse(osc_file, events = ('start', 'end')):
+        if event == 'start':
+            if elem.tag in ('create', 'modify', 'delete'):
+                action = elem.tag
+            continue
+        if elem.tag == 'node':
+            if action == 'delete':
+                nodes[elem.attrib['id']] = None
+            else:
+                is_cam, node_id, lat, lon = _get_camera(elem)
+                nodes[node_id] = (is_cam, float(lat), float(lon))
+        elif elem.tag == 'way':
+            ways[elem.attrib['id']] = None if action == 'delete' else _get_street(elem)
+        elif elem.tag == 'relation':
+            output = None if action == 'delete' else _get_relation(elem)
+            areas[elem.attrib['id']] = (output[1], list(output[2:])) if output else None
+        else:
+            continue
+        elem.clear()
+    return nodes, ways, areas
+
+def _ids(keys):
+    return np.array(sorted(int(key) for key in keys), dtype = np.int64)
+
+def _split(offsets, flat):
+    # CSR arrays -> list of lists
+    bounds = np.asarray(offsets).tolist()
+    values = np.asarray(flat).tolist()
+    return [values[start:end] for (start, end) in zip(bounds[:-1], bounds[1:])]
+
+def apply_changes(npy_dir, osc_file, out_dir = None):
+    '''
+    Apply the changes of the osmChange file **osc_file** to the binary dataset in **npy_dir** (written by parseXML with --npy_output)
+    and write the updated dataset to **out_dir** (by default the dataset is updated in place).
+    Only the affected data is recomputed:
+        - streets that were created, modified or deleted, and their nodes
+        - lengths of the changed streets and of all streets with a moved node
+        - cameras that were created, modified or deleted
+        - rings of postal areas whose relation (identified by its id), ways or nodes changed
+        - the assignment of the changed cameras to all areas and of all cameras to the changed areas
+    Coordinates of nodes are taken from the change file or from all nodes stored in the dataset (in datasets without them
+    from the street nodes, area nodes and cameras, so a new street or area can only use nodes that are known in one of them).
+    Returns the output directory.
+    '''
+    start_time = time.time()
+    out_dir = out_dir or npy_dir
+    dataset = Dataset(npy_dir)
+    arrays = dataset.get_arrays()
+    street_types = list(dataset.street_type_names)
+    has_way_nodes = dataset.meta.get('area_way_nodes', False)
+    has_all_nodes = dataset.meta.get('all_nodes', False)
+    # all arrays are copied to memory, so the files can be overwritten
+    del dataset
+    with Profiler.stage('read changes'):
+        node_changes, way_changes, area_changes = read_changes(osc_file)
+    print('Read %s node, %s way and %s relation changes from %s in %.2f s.'
+          % (len(node_changes), len(way_changes), len(area_changes), osc_file, time.time() - start_time))
+    changed_node_ids = _ids(node_changes.keys())
+    deleted_node_ids = _ids(node_id for (node_id, change) in node_changes.items() if change is None)
+    changed_way_ids = _ids(way_changes.keys())
+
+    # coordinates of all known nodes (all nodes of the parsed file if stored, otherwise the street nodes, area nodes and cameras),
+    # overridden by the changed ones, the deleted nodes are removed
+    nodes = NodeStore.from_arrays(arrays['all_node_ids'], arrays['all_node_lats'], arrays['all_node_lons'])
+    if not has_all_nodes:
+        for prefix in ['node', 'area_node', 'camera']:
+            nodes.add_many(arrays[prefix + '_ids'], arrays[prefix + '_lats'], arrays[prefix + '_lons'])
+    moved = [(int(node_id), change[1], change[2]) for (node_id, change) in node_changes.items() if change is not None]
+    if moved:
+        nodes.add_many(*zip(*moved))
+    nodes.finalize()
+    node_keep = ~np.isin(nodes.ids, deleted_node_ids)
+    nodes.ids, nodes.lats, nodes.lons = nodes.ids[node_keep], nodes.lats[node_keep], nodes.lons[node_keep]
+    if has_all_nodes:
+        arrays['all_node_ids'], arrays['all_node_lats'], arrays['all_node_lons'] = nodes.ids, nodes.lats, nodes.lons
+    lookup = nodes.lookup
+
+    # cameras: every changed node is removed and added again if it (still) is a camera
+    camera_keep = ~np.isin(arrays['camera_ids'], changed_node_ids)
+    new_cameras = sorted((int(node_id), change[1], change[2]) for (node_id, change) in node_changes.items() if change and change[0])
+    changed_camera_ids = np.union1d(arrays['camera_ids'][~camera_keep], _ids(str(camera[0]) for camera in new_cameras))
+    camera_ids = np.concatenate([arrays['camera_ids'][camera_keep], np.array([camera[0] for camera in new_cameras], dtype = np.int64)])
+    order = np.argsort(camera_ids, kind = 'stable')
+    arrays['camera_ids'] = camera_ids[order]
+    arrays['camera_lats'] = np.concatenate([arrays['camera_lats'][camera_keep], [camera[1] for camera in new_cameras]])[order]
+    arrays['camera_lons'] = np.concatenate([arrays['camera_lons'][camera_keep], [camera[2] for camera in new_cameras]])[order]
+
+    # streets: changed and deleted streets are removed, changed ones are appended again
+    street_count = len(arrays['street_ids'])
+    street_keep = ~np.isin(arrays['street_ids'], changed_way_ids)
+    new_streets = [output for output in way_changes.values() if output and output[0]]
+    for output in new_streets:
+        if str(output[2]) not in street_types:
+            street_types.append(str(output[2]))
+    kept = np.flatnonzero(street_keep)
+    point_idx, offsets = take_polylines(arrays['street_node_offsets'], kept)
+    new_offsets, new_node_ids = flat_lists([output[6:] for output in new_streets], np.int64)
+    arrays['street_node_offsets'] = np.concatenate([offsets, offsets[-1] + new_offsets[1:]])
+    arrays['street_node_ids'] = np.concatenate([arrays['street_node_ids'][point_idx], new_node_ids])
+    arrays['street_ids'] = np.concatenate([arrays['street_ids'][kept], np.array([output[1] for output in new_streets], dtype = np.int64)])
+    arrays['street_types'] = np.concatenate([arrays['street_types'][kept],
+                                             np.array([street_types.index(str(output[2])) for output in new_streets], dtype = np.int16)])
+    arrays['street_oneway'] = np.concatenate([arrays['street_oneway'][kept], np.array([int(output[3] or 0) for output in new_streets], dtype = np.int8)])
+    for (name, column) in [('street_postal', 4), ('street_name', 5)]:
+        strings = decode_strings(arrays[name + '_data'], arrays[name + '_offsets'])
+        arrays[name + '_data'], arrays[name + '_offsets'] = string_table([strings[k] for k in kept] + [output[column] for output in new_streets])
+
+    # street nodes: all nodes of the streets, with their current coordinates
+    street_node_ids = np.unique(arrays['street_node_ids'])
+    lats, lons, found = lookup(street_node_ids)
+    arrays['node_ids'], arrays['node_lats'], arrays['node_lons'] = street_node_ids[found], lats[found], lons[found]
+
+    # lengths of the new streets and of the kept streets with a changed node
+    street_count_new = len(arrays['street_ids'])
+    touched = np.isin(arrays['street_node_ids'], changed_node_ids)
+    point_streets = np.repeat(np.arange(street_count_new), np.diff(arrays['street_node_offsets']))
+    affected_streets = np.union1d(np.unique(point_streets[touched]), np.arange(len(kept), street_count_new))
+    lengths = np.concatenate([arrays['street_lengths'][kept], np.zeros(len(new_streets))])
+    with Profiler.stage('length computation', len(affected_streets)):
+        lengths[affected_streets] = street_lengths(arrays, affected_streets)
+    arrays['street_lengths'] = lengths
+    print('Streets: %s removed, %s created or modified, %s lengths recomputed.'
+          % (street_count - len(kept), len(new_streets), len(affected_streets)))
+
+    # postal areas: node lists of all area ways, updated by the changed ways
+    postal_codes = decode_strings(arrays['area_code_data'], arrays['area_code_offsets'])
+    area_ways = _split(arrays['area_way_offsets'], arrays['area_way_ids'])
+    rings = split_rings(arrays)
+    way_nodes = dict(zip(arrays['area_way_ids'].tolist(), _split(arrays['area_way_node_offsets'], arrays['area_way_node_ids'])))
+    if not has_way_nodes:
+        print('The dataset has no node lists of the area ways, rings can only be rebuilt from ways of the change file or streets.')
+        way_nodes = {}
+    for (way_id, output) in way_changes.items():
+        if output is None:
+            way_nodes.pop(int(way_id), None)
+        else:
+            way_nodes[int(way_id)] = [int(node_id) for node_id in output[6:]]
+    changed_ways = set(changed_way_ids.tolist())
+    changed_nodes = set(changed_node_ids.tolist())
+    # a changed relation replaces the area of the same relation (areas without a known relation id are matched by postal code),
+    # deleted relations and relations that are no postal area anymore remove it
+    relation_ids = arrays['area_relation_ids'].tolist()
+    old_index = {relation_id: k for (k, relation_id) in enumerate(relation_ids) if relation_id}
+    code_index = {postal_code: k for (k, postal_code) in enumerate(postal_codes) if not relation_ids[k]}
+    replaced, created = {}, []
+    for (relation_id, change) in area_changes.items():
+        k = old_index.get(int(relation_id))
+        if k is None and change is not None:
+            k = code_index.get(change[0])
+        if k is not None:
+            replaced[k] = (int(relation_id), change)
+        elif change is not None:
+            created.append( (int(relation_id), change) )
+    affected_areas = [k for k in range(len(postal_codes)) if k not in replaced and
+                      any(way_id in changed_ways or changed_nodes.intersection(way_nodes.get(way_id, [])) for way_id in area_ways[k])]
+    recompute = set(replaced).union(affected_areas)
+    # areas of the updated dataset: (old index or None, relation id, postal code, ways)
+    entries = []
+    for (k, postal_code) in enumerate(postal_codes):
+        if k not in replaced:
+            entries.append( (k, relation_ids[k], postal_code, area_ways[k]) )
+        elif replaced[k][1] is not None:
+            relation_id, (new_code, ways) = replaced[k]
+            entries.append( (k, relation_id, new_code, [int(way_id) for way_id in ways]) )
+    entries += [(None, relation_id, new_code, [int(way_id) for way_id in ways]) for (relation_id, (new_code, ways)) in created]
+    # index of each old area in the updated dataset, -1 if it was removed or its ring is recomputed
+    area_map = np.full(len(postal_codes), -1, dtype = np.int64)
+    new_ways, new_rings, recomputed = [], [], []
+    street_rows = None
+    for (new_k, (k, relation_id, postal_code, ways)) in enumerate(entries):
+        if k is not None and k not in recompute:
+            area_map[k] = new_k
+            new_ways.append(ways)
+            new_rings.append(rings[k])
+            continue
+        for way_id in ways:
+            if way_id not in way_nodes and way_id not in changed_ways:
+                # fall back to the node list of a street with the same id
+                if street_rows is None:
+                    street_rows = {street_id: row for (row, street_id) in enumerate(arrays['street_ids'].tolist())}
+                if way_id in street_rows:
+                    row = street_rows[way_id]
+                    way_nodes[way_id] = arrays['street_node_ids'][arrays['street_node_offsets'][row]:arrays['street_node_offsets'][row+1]].tolist()
+        lats, lons, ring_offsets, holes, missing_node_ids, open_count = area_rings(ways, way_nodes, lookup)
+        if len(missing_node_ids):
+            print('\t\tPostal area %s: nodes %s not found.' % (postal_code, missing_node_ids.tolist()))
+        new_ways.append(ways)
+        new_rings.append( ([lats[start:end].tolist() for (start, end) in zip(ring_offsets[:-1], ring_offsets[1:])],
+                           [lons[start:end].tolist() for (start, end) in zip(ring_offsets[:-1], ring_offsets[1:])]) )
+        recomputed.append(new_k)
+    print('Postal areas: %s removed, %s created, %s rings recomputed.'
+          % (len([k for k in replaced if replaced[k][1] is None]), len(created), len(recomputed)))
+    arrays['area_code_data'], arrays['area_code_offsets'] = string_table([entry[2] for entry in entries])
+    arrays['area_relation_ids'] = np.array([entry[1] for entry in entries], dtype = np.int64)
+    arrays['area_way_offsets'], arrays['area_way_ids'] = flat_lists(new_ways, np.int64)
+    arrays.update(ring_arrays([lat_rings for (lat_rings, lon_rings) in new_rings], [lon_rings for (lat_rings, lon_rings) in new_rings]))
+    area_way_node_lists = [way_nodes.get(way_id, []) for way_id in itertools.chain.from_iterable(new_ways)]
+    arrays['area_way_node_offsets'], arrays['area_way_node_ids'] = flat_lists(area_way_node_lists if has_way_nodes else [[] for way_id in arrays['area_way_ids']], np.int64)
+    # area nodes: all nodes of the area ways (if known), otherwise the stored ones with their current coordinates
+    if has_way_nodes:
+        area_node_ids = np.unique(arrays['area_way_node_ids'])
+    else:
+        area_node_ids = arrays['area_node_ids']
+    lats, lons, found = lookup(area_node_ids)
+    arrays['area_node_ids'], arrays['area_node_lats'], arrays['area_node_lons'] = area_node_ids[found], lats[found], lons[found]
+
+    # camera assignment: keep the pairs of unchanged cameras and areas, join the changed cameras with all areas
+    # and all cameras with the recomputed areas
+    pair_area = area_map[arrays['camera_area_idx']] if len(area_map) else np.empty(0, dtype = np.int64)
+    pair_keep = (pair_area >= 0) & ~np.isin(arrays['camera_area_ids'], changed_camera_ids)
+    changed_cameras = np.flatnonzero(np.isin(arrays['camera_ids'], changed_camera_ids))
+    with Profiler.stage('spatial join', len(changed_cameras)):
+        camera_idx1, area_idx1 = camera_areas(arrays, cameras = changed_cameras)
+        camera_idx2, area_idx2 = camera_areas(arrays, areas = recomputed)
+    pair_cameras = np.concatenate([np.searchsorted(arrays['camera_ids'], arrays['camera_area_ids'][pair_keep]), camera_idx1, camera_idx2])
+    pair_areas = np.concatenate([pair_area[pair_keep], area_idx1, area_idx2])
+    pairs = np.unique(np.stack([pair_areas, pair_cameras], axis = 1), axis = 0).reshape(-1, 2)
+    arrays['camera_area_idx'] = pairs[:, 0].astype(np.int64)
+    arrays['camera_area_ids'] = arrays['camera_ids'][pairs[:, 1]]
+    print('Cameras: %s changed, %s camera area assignments.' % (len(changed_camera_ids), len(pairs)))
+
+    with Profiler.stage('write npy dataset', len(arrays['street_ids'])):
+        write_arrays(out_dir, arrays, street_types, area_way_nodes = has_way_nodes, all_nodes = has_all_nodes)
+    print('Updated dataset written to %s in %.2f s.' % (out_dir, time.time() - start_time))
+    return out_dir
@@ -2,11 +2,40 @@
 
 import os
 import csv
+import json
+import re
+import sys
+import bz2
+import gzip
+import lzma
 import time
+import pickle
+import shutil
+import itertools
+import queue
+import threading
 import xml.etree.ElementTree as et  # for reading the xml file
+import xml.parsers.expat as expat   # for the low level parse engine
 import numpy as np
+import Profiler
+from NodeStore import NodeStore
+from Rings import area_rings
+from Dataset import build_arrays, write_arrays
+from Database import write_database
+from TagRules import RuleSet, load_rules, set_rules, active_rules, is_camera, table_rows, street_info, postal_info
+from concurrent.futures import ProcessPoolExecutor
 
-def collect_data(FILE = 'map.xml', csv_output = True, max_size = 1000000):
+# compressed input files are decompressed on the fly, file ending: function that wraps the opened file into a decompressing one
+COMPRESSED_FORMATS = {'.bz2': bz2.BZ2File, '.gz': lambda raw_file: gzip.GzipFile(fileobj = raw_file), '.xz': lzma.LZMAFile}
+# parse engines for xml files: ElementTree pull parser (builds the elements) or expat callbacks (extracts only the needed attributes)
+ENGINES = ['etree', 'expat']
+QUEUE_SIZE = 8                      # maximal number of decompressed chunks buffered between decompression and parser
+PROGRESS_INTERVAL = 10.0            # default seconds between two progress reports
+CHECKPOINT_INTERVAL = 600.0         # default seconds between two checkpoints
+CHECKPOINT_RANGE = 1 << 26          # bytes of the file parsed between two possible checkpoints
+
+def collect_data(FILE = 'map.xml', csv_output = True, max_size = 1000000, workers = 1, two_pass = False, npy_output = False, engine = 'etree',
+                 rule_file = None, sqlite_output = False, progress_interval = None, status_file = None, checkpoint_interval = None, resume = False):
     '''
     This function collects all required data out of an OpenStreetMap-like XML-file **FILE**.
     (correct path to it) and returns the following:
@@ -15,197 +44,340 @@ def collect_data(FILE = 'map.xml', csv_output = True, max_size = 1000000):
         - **street_nodes** in form {..., node_id: [node_lat, node_lon], ... }} if node_id refers to a street defining node
         - **streets** dictionary in form {..., street_id: [type, is_oneway, postal_code, name, node1, node2, ..], ... }
         - **postal_areas** dictionary in form {..., postal_code: [way1, way2, way3, ..], ... }
-        - **area_lats** dictionary in form {..., postal_code: [node1_lat, node2_lat, ..], ... }
-        - **area_lons** dictionary in form {..., postal_code: [node1_lon, node2_lon, ..], ... }
+        - **area_lats** dictionary in form {..., postal_code: [[node1_lat, node2_lat, ..], [node5_lat, ..], ..], ... }
+        - **area_lons** dictionary in form {..., postal_code: [[node1_lon, node2_lon, ..], [node5_lon, ..], ..], ... }
+          (the closed rings of the area, outer rings first, see Rings.area_rings)
     It parses the XML-code incrementally in character bunches of length **max_size**.
     If csv output is wanted, it creates a new directory csv_%time with including files bounds.csv, cameras.csv, street_nodes.csv,
-    streets.csv, areas.csv, area_lats.csv, area_lons.csv.
+    streets.csv, areas.csv, area_lats.csv, area_lons.csv (one row per ring of an area).
+    With **workers** > 1 the file is split into shards at element boundaries which are parsed in a process pool,
+    the results are merged in file order, so they are identical to the ones of the serial run.
+    With **two_pass** = True the relations and ways are read in a first pass, which collects the ids of all street and area nodes,
+    and only the coordinates of those nodes (and of cameras) are kept in the second pass over the nodes.
+    Files ending with .pbf are read as OpenStreetMap PBF files (see PBF.py), with **workers** > 1 their blocks are decoded in parallel.
+    Files ending with .bz2, .gz or .xz are decompressed in a background thread while parsing, the chunks of length **max_size**
+    (in bytes of the decompressed stream) are passed to the parser through a bounded queue. Compressed files are parsed serially.
+    **engine** selects how xml files are parsed: 'etree' builds an ElementTree element for each node, way and relation,
+    'expat' extracts the needed attributes directly in expat callbacks (see _read_elements_expat), both give the same results.
+    Which elements are cameras, streets and postal areas is defined by the tag rules of TagRules.DEFAULT_RULES. A json **rule_file**
+    (see TagRules.load_rules) can change them and add more tables (e.g. traffic signals), whose rows are collected in the same pass
+    and written to <table>.csv in the csv directory (which is then also created without csv_output).
+    If **npy_output** is wanted, the data is also written as binary columnar dataset (see Dataset.py) to a new directory npy_%time.
+    If **sqlite_output** is wanted, it is written to a new SQLite database osm_%time.sqlite with r*tree indices (see Database.py).
+    At the end a summary of the passes (duration and peak resident memory) is printed.
+    With **progress_interval** (seconds) resp. a **status_file**, the progress of the parse (consumed bytes of the file,
+    element counts and rates, ETA and memory, see _ProgressReporter) is reported regularly to stderr resp. to the status file.
+    With **checkpoint_interval** (seconds), a serial parse of an uncompressed xml file writes checkpoints of its state to the directory
+    FILE.checkpoint (see _Checkpoint). With **resume** = True, an interrupted parse continues at its last checkpoint (with the same
+    output directories) instead of starting again, the results are identical to the ones of an uninterrupted run.
     '''
 
+    assert(engine in ENGINES), 'Unknown engine %s' % engine
+    read_elements = _ENGINE_READERS[engine]
+    rules = RuleSet(load_rules(rule_file))
+    set_rules(rules)
+    extra_tables = [name for (index, name) in enumerate(rules.names) if any(index in rules.extra[element] for element in rules.extra)]
+
     # init return Data-Types
     bounds = {}
     cameras = {}
     street_nodes = {}
     streets = {}
     postal_areas = {}
+    area_relations = {}     # ids of the relations of the postal areas {..., postal_code: relation_id, ...}
     area_lats = {}
     area_lons = {}
+    tables = {name: [] for name in extra_tables}   # rows of the additional tables of the rule file
 
     # init other Data containers
-    nodes = {}                          # collect all elements with tag 'node' here, dict of form {..., node_id: [node_lat, node_lon], ...}
+    nodes = NodeStore()                 # collect coordinates of all elements with tag 'node' here, compact replacement of a dict {..., node_id: [node_lat, node_lon], ...}
     ways = {}                           # collect all elements with tag 'way' here, dict of form {..., way_id: [node1, node2, ..], ...}
     street_nodes_set = set()            # collect all node_ids that define any street in a set
     area_ways_set = set()               # collect all way_ids that define any postal area border in a set
 
     # get current time
     time_now = time.strftime('%d.%m.%Y_%H.%M.%S')
-
-    # init parser
-    parser = et.XMLPullParser(['start','end'])
+    checkpoint = None
+    resumed = None
+    if checkpoint_interval or resume:
+        if FILE.endswith('.pbf') or _is_compressed(FILE) or two_pass or workers > 1:
+            print('Checkpoints are only written for serial parses of uncompressed xml files, options checkpoint and resume are ignored.')
+        else:
+            checkpoint = _Checkpoint(FILE, checkpoint_interval or CHECKPOINT_INTERVAL, {'rule_file': rule_file, 'csv_output': bool(csv_output)})
+            resumed = checkpoint.load() if resume else None
+            if resumed:
+                # continue writing to the output files of the interrupted parse
+                time_now = resumed['time_now']
+    summary = _ParseSummary()
+    progress = None
+    if progress_interval or status_file:
+        progress = _ProgressReporter(FILE, progress_interval or PROGRESS_INTERVAL, status_file,
+                                     lambda: {'nodes': len(nodes), 'ways': len(ways), 'relations': len(postal_areas)})
 
     try:
-        if csv_output:
-            # set paths of the output files
+        if csv_output or extra_tables:
+            # set paths of the output files and open them to write
             head, tail = os.path.split(FILE)
             out_dir = os.path.join(head, 'csv_%s' % time_now)
             print('outdir:\t %s' % out_dir)
             if not os.path.isdir(out_dir):
                 os.mkdir(out_dir)
-            csv_files = map( lambda x: os.path.join(out_dir, x),
-                             ['bounds.csv', 'cameras.csv', 'street_nodes.csv', 'streets.csv', 'areas.csv',
-                              'area_nodes.csv', 'area_lats.csv', 'area_lons.csv'] )
-        else:
-            csv_files = None
-        with open(FILE, 'r') as read_file:
-            for csv_file in csv_files:
-                # open files to write
-                head, tail = os.path.split(csv_file)
-                if tail == 'bounds.csv':
-                    bound_file = open(csv_file, 'w')
-                if tail == 'cameras.csv':
-                    camera_file = open(csv_file, 'w')
-                if tail == 'street_nodes.csv':
-                    street_node_file = open(csv_file, 'w')
-                if tail == 'streets.csv':
-                    street_file = open(csv_file, 'w')
-                if tail == 'areas.csv':
-                    area_file = open(csv_file, 'w')
-                if tail == 'area_nodes.csv':
-                    area_node_file = open(csv_file, 'w')
-                if tail == 'area_lats.csv':
-                    area_lat_file = open(csv_file, 'w')
-                if tail == 'area_lons.csv':
-                    area_lon_file = open(csv_file, 'w')
-
-            if csv_output:
-                # init csv files to write
-                bounds_csv = csv.writer(bound_file, delimiter=',')
-                camera_csv = csv.writer(camera_file, delimiter=',')
-                street_node_csv = csv.writer(street_node_file, delimiter=',')
-                street_csv = csv.writer(street_file, delimiter=',')
-                area_csv = csv.writer(area_file, delimiter=',')
-                area_node_csv = csv.writer(area_node_file, delimiter=',')
-                area_lat_csv = csv.writer(area_lat_file, delimiter=',')
-                area_lon_csv = csv.writer(area_lon_file, delimiter=',')
-
-            # init parsing variables
-            root = None
-            relevancy_level = 0
-            elements_to_delete = []
-            case_dict = None
-
-            # Start with parsing...
-            rep = 0
-            while True:
-                test_func = None
-                rep += 1
+            csv_files = {}
 
-                line = read_file.read(max_size)
-                if not line:
-                    break
+            def open_csv(name):
+                # after a resume, the rows behind the checkpoint are cut off and the file is continued
+                path = os.path.join(out_dir, '%s.csv' % name)
+                if resumed:
+                    os.truncate(path, resumed['csv_sizes'][name])
+                    csv_files[name] = open(path, 'a')
+                else:
+                    csv_files[name] = open(path, 'w')
+                return csv_files[name]
+            table_files = {name: open_csv(name) for name in extra_tables}
+            table_csvs = {name: csv.writer(table_files[name], delimiter=',') for name in extra_tables}
+        if csv_output:
+            bound_file = open_csv('bounds')
+            camera_file = open_csv('cameras')
+            street_node_file = open_csv('street_nodes')
+            street_file = open_csv('streets')
+            area_file = open_csv('areas')
+            area_node_file = open_csv('area_nodes')
+            area_lat_file = open_csv('area_lats')
+            area_lon_file = open_csv('area_lons')
 
-                # feed the parser
-                parser.feed(line)
-
-                # iterate through all parsed elements
-                for event, elem in parser.read_events():
-
-                    if root is None:
-                        root = elem
-
-                    # get bounds of the given map excerpt
-                    if elem.tag == 'bounds':
-                        if event == "end":
-                            output = []
-                            for key in ['minlat', 'minlon', 'maxlat', 'maxlon']:
-                                bounds[key] = elem.attrib[key]
-                                test_func = None
-                                output.append(elem.attrib[key])
-                            if csv_output:
-                                bounds_csv.writerow(list(output))
-                                bound_file.close()
-                    # process all node tags with _get_camera
-                    if elem.tag == 'node':
-                        test_func = _get_camera
-                        case_dict = cameras
-                    # process all way tags with _get_street
-                    if elem.tag == 'way':
-                        test_func = _get_street
-                        case_dict = streets
-                    # process all relation tags with _get_relation
-                    if elem.tag == 'relation':
-                        test_func = _get_relation
-                        case_dict = postal_areas
-
-                    if not test_func:
-                        continue
-
-                    if event == "start":
-                        if test_func(elem):
-                            # in case of an opening tag:
-                            # increase level if elem consists of required data (otherwise/ on level 0, elem would deleted before having read all its children)
-                            relevancy_level += 1
-                    if event == "end":
-                        # in case of an ending tag:
-                        # have processed complete element, so add it to list of elements to delete
-                        elements_to_delete.append(elem)
-                        if test_func(elem):
-                            # decrease level if elem consists of required data (finally only on level 0, i. e. when all its child tags are read, it will be freed to delete)
-                            relevancy_level -= 1
-                            # get output of test_func
-                            output = test_func(elem)
-                            # in case of a node tag: get node coords and if it refers to a camera add it to the cameras dict
-                            if case_dict == cameras:
-                                is_cam = output[0]
-                                id = output[1]
-                                coordinates = output[2:]
-                                nodes[id] = coordinates
-                                if is_cam:
-                                    assert(id not in cameras)
-                                    cameras[id] = coordinates
-                                    if csv_output:
-                                        camera_csv.writerow(list(output[1:]))
-                            # in case of a way tag:
-                            elif case_dict == streets:
-                                is_highway = output[0]
-                                id = output[1]
-                                info = output[2:6]
-                                way_nodes = output[6:]
-                                assert(id not in streets)
-                                # only if way refers to a street add it to the streets dict
-                                if is_highway:
-                                    streets[id] = info + way_nodes
-                                    # collect all nodes which are defining a street in the street_nodes set
-                                    street_nodes_set.update(set(way_nodes))
-                                    if csv_output:
-                                        street_csv.writerow(list(output[1:]))
-                                # otherwise save only its nodes in ways dict
-                                ways[id] = way_nodes
-                            # in case of a relation tag: get the bounding ways (ids) of an postal area and save it to the postal_areas dict
-                            elif case_dict == postal_areas:
-                                postal_code = output[0]
-                                postal_ways = output[1:]
-                                assert(postal_code not in postal_areas)
-                                postal_areas[postal_code] = postal_ways
-                                # collect all ways which are defining a postal area in the area_ways set
-                                area_ways_set.update(set(postal_ways))
-                                if csv_output:
-                                    area_csv.writerow(list(output))
-
-                # delete elements only when we parsed them completely (including all its children)
-                if relevancy_level == 0:
-                    for elem in elements_to_delete:
-                        elem.clear()
-                        if elem is not root:
-                            root.clear()
-                    elements_to_delete.clear()
+            # init csv files to write
+            bounds_csv = csv.writer(bound_file, delimiter=',')
+            camera_csv = csv.writer(camera_file, delimiter=',')
+            street_node_csv = csv.writer(street_node_file, delimiter=',')
+            street_csv = csv.writer(street_file, delimiter=',')
+            area_csv = csv.writer(area_file, delimiter=',')
+            area_node_csv = csv.writer(area_node_file, delimiter=',')
+            area_lat_csv = csv.writer(area_lat_file, delimiter=',')
+            area_lon_csv = csv.writer(area_lon_file, delimiter=',')
+
+        def store_element(tag, output):
+            # get bounds of the given map excerpt
+            if tag == 'bounds':
+                for key, value in zip(['minlat', 'minlon', 'maxlat', 'maxlon'], output):
+                    bounds[key] = value
+                if csv_output:
+                    bounds_csv.writerow(list(output))
+                    bound_file.close()
+            # in case of a node tag: get node coords and if it refers to a camera add it to the cameras dict
+            elif tag == 'node':
+                is_cam = output[0]
+                id = output[1]
+                coordinates = output[2:]
+                nodes.add(id, *coordinates)
+                if is_cam:
+                    assert(id not in cameras)
+                    cameras[id] = coordinates
+                    if csv_output:
+                        camera_csv.writerow(list(output[1:]))
+            # in case of a way tag:
+            elif tag == 'way':
+                is_highway = output[0]
+                id = output[1]
+                info = output[2:6]
+                way_nodes = output[6:]
+                assert(id not in streets)
+                # only if way refers to a street add it to the streets dict
+                if is_highway:
+                    streets[id] = info + way_nodes
+                    # collect all nodes which are defining a street in the street_nodes set
+                    street_nodes_set.update(set(way_nodes))
+                    if csv_output:
+                        street_csv.writerow(list(output[1:]))
+                # otherwise save only its nodes in ways dict
+                ways[id] = way_nodes
+            # in case of a relation tag: get the bounding ways (ids) of an postal area and save it to the postal_areas dict
+            elif tag == 'relation':
+                postal_code = output[1]
+                postal_ways = output[2:]
+                assert(postal_code not in postal_areas)
+                postal_areas[postal_code] = postal_ways
+                area_relations[postal_code] = output[0]
+                # collect all ways which are defining a postal area in the area_ways set
+                area_ways_set.update(set(postal_ways))
+                if csv_output:
+                    area_csv.writerow(list(output[1:]))
+            # in case of a row of an additional table of the rule file
+            elif tag == 'row':
+                name, row = output
+                tables[name].append(row)
+                table_csvs[name].writerow(list(row))
+
+        def restore_checkpoint():
+            # collect the parts of the loaded checkpoint again, the sets of street nodes and area ways follow from them
+            for part in checkpoint.parts():
+                bounds.update(part['bounds'])
+                for name, items in [('cameras', cameras), ('streets', streets), ('postal_areas', postal_areas), ('area_relations', area_relations), ('ways', ways)]:
+                    items.update(part[name])
+                for name in extra_tables:
+                    tables[name] += part['tables'][name]
+                nodes.add_encoded(*part['nodes'])
+            for street in streets.values():
+                street_nodes_set.update(street[4:])
+            for postal_ways in postal_areas.values():
+                area_ways_set.update(postal_ways)
+            if csv_output and bounds:
+                # the bounds were written before the checkpoint already
+                bound_file.close()
+
+        if FILE.endswith('.pbf'):
+            # PBF files consist of independent blocks, which are decoded (in parallel with workers > 1) and merged in file order
+            from PBF import read_pbf
+            if two_pass:
+                print('PBF files are read in a single pass, option two_pass is ignored.')
+            summary.start('parse pbf: %s workers' % workers)
+            for node_arrays, block_elements in read_pbf(FILE, workers, progress = progress.update if progress else None):
+                nodes.add_many(*node_arrays)
+                for tag, output in block_elements:
+                    store_element(tag, output)
+            summary.stop(len(nodes))
+        elif _is_compressed(FILE):
+            if two_pass or workers > 1:
+                print('Compressed files are parsed serially in one pass, options two_pass and workers are ignored.')
+            summary.start('parse: compressed input')
+            reader = _DecompressReader(FILE, max_size)
+            if progress:
+                # the progress of a compressed file is the one of the compressed bytes
+                progress.position = lambda: reader.compressed_bytes
+            try:
+                for tag, output in read_elements(_ProgressFile(reader, progress) if progress else reader, max_size):
+                    store_element(tag, output)
+            finally:
+                reader.close()
+            summary.stop(len(nodes))
+            # the parser works whenever it does not wait for decompressed data
+            summary.add_stage('read and decompress', reader.busy_time, reader.compressed_bytes, reader.decompressed_bytes)
+            Profiler.record('decompress (background thread)', reader.busy_time, items = reader.decompressed_bytes)
+            summary.add_stage('parse xml', summary.passes[-1][1] - reader.wait_time, reader.decompressed_bytes)
+            print('Parser waited %.2f s for decompressed data, decompression waited %.2f s for free buffers.' % (reader.wait_time, reader.full_time))
+        elif two_pass:
+            if workers > 1:
+                print('The two pass mode parses serially, option workers = %s is ignored.' % workers)
+            # element sections of the file, if it is sorted by element type (nodes, ways, relations) like usual OpenStreetMap files
+            sections = _find_sections(FILE)
+            if sections:
+                first_way, first_relation = sections
+                file_size = os.path.getsize(FILE)
+                node_range, way_range, relation_range = (0, first_way), (first_way, first_relation), (first_relation, file_size)
+            else:
+                print('File is not sorted by element type, every pass has to read the complete file.')
+                node_range = way_range = relation_range = (0, os.path.getsize(FILE))
+            if progress:
+                progress.total = sum(end - start for (start, end) in [node_range, way_range, relation_range])
+
+            # pass 1: get the postal areas (i.e. the ids of all ways that define an area), then the streets and the nodes of the area ways
+            summary.start('pass 1: relations')
+            for tag, output in _read_range(FILE, relation_range, max_size, tags = ('relation',), engine = engine, progress = progress):
+                store_element(tag, output)
+            summary.stop(len(postal_areas))
+            summary.start('pass 1: ways')
+            for tag, output in _read_range(FILE, way_range, max_size, tags = ('way',), engine = engine, progress = progress):
+                if tag == 'row' or output[0] or output[1] in area_ways_set:
+                    store_element(tag, output)
+            summary.stop(len(ways))
+            needed_node_ids = [np.array(list(street_nodes_set), dtype = np.int64)]
+            needed_node_ids += [np.array(ways[way_id], dtype = np.int64) for way_id in area_ways_set if way_id in ways]
+            needed_node_ids = np.unique(np.concatenate(needed_node_ids))
+
+            # pass 2: keep only the coordinates of the needed nodes (and of all cameras)
+            summary.start('pass 2: nodes')
+            node_buffer = ([], [], [])
+            def flush_nodes():
+                node_ids = np.array(node_buffer[0], dtype = np.int64)
+                is_needed = np.isin(node_ids, needed_node_ids, assume_unique = True)
+                nodes.add_many(node_ids[is_needed], np.array(node_buffer[1])[is_needed], np.array(node_buffer[2])[is_needed])
+                for buffer in node_buffer:
+                    buffer.clear()
+            for tag, output in _read_range(FILE, node_range, max_size, tags = ('bounds', 'node'), engine = engine, progress = progress):
+                if tag == 'node' and not output[0]:
+                    node_buffer[0].append(int(output[1]))
+                    node_buffer[1].append(output[2])
+                    node_buffer[2].append(output[3])
+                    if len(node_buffer[0]) >= (1 << 16):
+                        flush_nodes()
+                else:
+                    store_element(tag, output)
+            flush_nodes()
+            summary.stop(len(nodes))
+        elif workers > 1:
+            summary.start('parse: %s workers' % workers)
+            # parse the shards in a process pool and merge their elements in file order
+            shards = _find_shards(FILE, workers * 4)
+            print('Parsing %s shards with %s workers...' % (len(shards), workers))
+            with ProcessPoolExecutor(max_workers = workers, initializer = set_rules, initargs = (rules,)) as pool:
+                shard_args = [(FILE, start, end, max_size, engine) for (start, end) in shards]
+                for (start, end), (node_arrays, shard_elements) in zip(shards, pool.map(_parse_shard, shard_args)):
+                    nodes.add_many(*node_arrays)
+                    for tag, output in shard_elements:
+                        store_element(tag, output)
+                    if progress:
+                        progress.update(end - start)
+            summary.stop(len(nodes))
+        elif checkpoint:
+            summary.start('parse: %s with checkpoints' % engine)
+            file_size = os.path.getsize(FILE)
+            # the file is parsed in consecutive ranges between element boundaries (like the shards of the workers),
+            # behind each of them a checkpoint is written when it is due
+            ranges = _find_shards(FILE, -(-file_size // CHECKPOINT_RANGE))
+            offset = 0
+            if resumed:
+                offset = resumed['offset']
+                assert(offset in [start for (start, end) in ranges]), 'Checkpoint offset %s is no range start' % offset
+                restore_checkpoint()
+                if progress:
+                    progress.consumed = offset
+            saved = {'cameras': len(cameras), 'streets': len(streets), 'postal_areas': len(postal_areas), 'area_relations': len(area_relations),
+                     'ways': len(ways), 'tables': {name: len(tables[name]) for name in extra_tables}, 'node_chunks': nodes.new_chunks()[0]}
+
+            def save_checkpoint(offset):
+                # the items collected since the last checkpoint and the sizes of the flushed csv files
+                part = {'bounds': dict(bounds), 'tables': {name: tables[name][saved['tables'][name]:] for name in extra_tables}}
+                for name, items in [('cameras', cameras), ('streets', streets), ('postal_areas', postal_areas), ('area_relations', area_relations), ('ways', ways)]:
+                    part[name] = list(itertools.islice(items.items(), saved[name], None))
+                node_chunks, part['nodes'] = nodes.new_chunks(saved['node_chunks'])
+                csv_sizes = {}
+                for name, csv_file in (csv_files.items() if csv_output or extra_tables else []):
+                    if not csv_file.closed:
+                        csv_file.flush()
+                        os.fsync(csv_file.fileno())
+                    csv_sizes[name] = os.path.getsize(csv_file.name)
+                checkpoint.save(offset, part, csv_sizes, time_now, out_dir if csv_output or extra_tables else None)
+                saved.update({'cameras': len(cameras), 'streets': len(streets), 'postal_areas': len(postal_areas),
+                              'area_relations': len(area_relations), 'ways': len(ways),
+                              'tables': {name: len(tables[name]) for name in extra_tables}, 'node_chunks': node_chunks})
+                print('Checkpoint at byte %s of %s written.' % (offset, file_size))
+
+            for (start, end) in ranges:
+                if start < offset:
+                    continue
+                for tag, output in _read_range(FILE, (start, end), max_size, engine = engine, progress = progress):
+                    store_element(tag, output)
+                if end < file_size and checkpoint.due():
+                    save_checkpoint(end)
+            summary.stop(len(nodes))
+        else:
+            summary.start('parse: %s' % engine)
+            with open(FILE, 'r') as read_file:
+                for tag, output in read_elements(_ProgressFile(read_file, progress) if progress else read_file, max_size):
+                    store_element(tag, output)
+            summary.stop(len(nodes))
+            summary.add_stage('parse xml', summary.passes[-1][1], os.path.getsize(FILE))
+        if progress:
+            progress.parsed()
+        summary.start('resolve nodes and areas')
 
         # save only coordinates of those nodes that are part of a street (and optional save it to file)
-        street_nodes = { node_id: nodes[node_id] for node_id in street_nodes_set }
+        with Profiler.stage('node resolution', len(street_nodes_set)):
+            street_nodes = _resolve_nodes(nodes, street_nodes_set)
         street_nodes_set.clear()
         if csv_output:
-            for (node_id, coords) in street_nodes.items():
-                street_node_csv.writerow([node_id] + list(coords) )
+            with Profiler.stage('csv write', len(street_nodes)):
+                for (node_id, coords) in street_nodes.items():
+                    street_node_csv.writerow([node_id] + list(coords) )
 
         # save only coordinates of those nodes that are defining a postal area boundary (and optional save it to file)
         area_ways = { way_id: ways[way_id] for way_id in area_ways_set if way_id in ways}
@@ -218,40 +390,38 @@ def collect_data(FILE = 'map.xml', csv_output = True, max_size = 1000000):
         area_ways.clear()
 
         # collect coordinates to all area nodes in dict
-        area_nodes = { node_id: nodes[node_id] for node_id in area_nodes_set if node_id in nodes}
+        with Profiler.stage('node resolution', len(area_nodes_set)):
+            area_nodes = _resolve_nodes(nodes, area_nodes_set)
         area_nodes_set.clear()
         if csv_output:
-            for (node_id, coords) in area_nodes.items():
-                area_node_csv.writerow([node_id] + list(coords))
-
-        # for each postal_code area save all its defining node coords in two dicts (separately for all its lat resp. lon coordinates)
-        # form will be e. g. area_lats = { ..., postal_code1: [node1_lat, node2_lat, ..], ...}
-        for postal_code in postal_areas.keys():
-            print('\nNew Postal code: %s' % postal_code)
-            postal_node_lats = []
-            postal_node_lons = []
-            for way_id in postal_areas[postal_code]:
-                if way_id in ways:
-                    way_lats = []
-                    way_lons = []
-                    for node_id in ways[way_id]:
-                        if node_id in nodes:
-                            node_lat, node_lon = nodes[node_id]
-                            way_lats.append(np.float_(node_lat))
-                            way_lons.append(np.float_(node_lon))
-                        else:
-                            print('\t\tNode %s NOT in ways[%s].' %(node_id, way_id))
-                    postal_node_lats = list(postal_node_lats) + list(way_lats)
-                    postal_node_lons = list(postal_node_lons) + list(way_lons)
-            area_lats[postal_code] = postal_node_lats
-            area_lons[postal_code] = postal_node_lons
-
-            if csv_output:
-                area_lat_csv.writerow( [postal_code] + list(area_lats[postal_code]) )
-                area_lon_csv.writerow( [postal_code] + list(area_lons[postal_code]) )
+            with Profiler.stage('csv write', len(area_nodes)):
+                for (node_id, coords) in area_nodes.items():
+                    area_node_csv.writerow([node_id] + list(coords))
+
+        # for each postal_code area save the coordinates of its rings in two dicts (separately for all its lat resp. lon coordinates),
+        # the member ways are stitched into closed rings (see Rings.area_rings)
+        # form will be e. g. area_lats = { ..., postal_code1: [[node1_lat, node2_lat, .., node1_lat], [node5_lat, ..]], ...}
+        with Profiler.stage('area ring assembly', len(postal_areas)):
+            for postal_code in postal_areas.keys():
+                print('\nNew Postal code: %s' % postal_code)
+                lats, lons, ring_offsets, holes, missing_node_ids, open_count = area_rings(postal_areas[postal_code], ways, nodes.lookup)
+                area_lats[postal_code] = [lats[start:end].tolist() for (start, end) in zip(ring_offsets[:-1], ring_offsets[1:])]
+                area_lons[postal_code] = [lons[start:end].tolist() for (start, end) in zip(ring_offsets[:-1], ring_offsets[1:])]
+                for node_id in missing_node_ids.tolist():
+                    print('\t\tNode %s NOT in nodes.' % node_id)
+                if open_count:
+                    print('\t\t%s ring(s) not closed by the ways of the area.' % open_count)
+
+                if csv_output:
+                    area_lat_csv.writerows( [postal_code] + ring for ring in area_lats[postal_code] )
+                    area_lon_csv.writerows( [postal_code] + ring for ring in area_lons[postal_code] )
+
+        summary.stop(len(street_nodes) + len(area_nodes))
 
         # close all opened files
         if csv_output:
+            if not bound_file.closed:
+                bound_file.close()
             camera_file.close()
             street_node_file.close()
             street_file.close()
@@ -259,32 +429,658 @@ def collect_data(FILE = 'map.xml', csv_output = True, max_size = 1000000):
             area_node_file.close()
             area_lat_file.close()
             area_lon_file.close()
+        for name in extra_tables:
+            table_files[name].close()
+
+        if npy_output or sqlite_output:
+            summary.start('build arrays')
+            # the node store of the two pass mode holds only the needed nodes, so all nodes are only stored after a full parse
+            arrays, street_types = build_arrays(bounds, cameras, street_nodes, streets, postal_areas, area_nodes, area_lats, area_lons,
+                                                area_way_nodes = ways, nodes = None if two_pass else nodes, area_relations = area_relations)
+            summary.stop(len(streets))
+        if npy_output:
+            summary.start('write npy dataset')
+            npy_dir = os.path.join(os.path.dirname(FILE), 'npy_%s' % time_now)
+            print('npy dir:\t %s' % npy_dir)
+            write_arrays(npy_dir, arrays, street_types, area_way_nodes = bool(ways), all_nodes = not two_pass)
+            summary.stop(len(streets))
+        if sqlite_output:
+            summary.start('write sqlite database')
+            db_file = os.path.join(os.path.dirname(FILE), 'osm_%s.sqlite' % time_now)
+            print('sqlite database:\t %s' % db_file)
+            write_database(db_file, arrays, street_types)
+            summary.stop(len(streets))
 
+        summary.print_summary(cameras = len(cameras), streets = len(streets), street_nodes = len(street_nodes),
+                              postal_areas = len(postal_areas), area_nodes = len(area_nodes),
+                              **{name: len(tables[name]) for name in extra_tables})
+
+        if checkpoint:
+            checkpoint.remove()
+        if progress:
+            progress.report('finished')
         # return required data
         return bounds, cameras, street_nodes, streets, postal_areas, area_nodes, area_lats, area_lons
 
     except MemoryError:
         print('Out of Memory.')
+    finally:
+        summary.close()
+        if progress and progress.state != 'finished':
+            progress.report('failed')
+        set_rules(RuleSet())
+
+def _resolve_nodes(nodes, node_id_set):
+    '''
+    Look up the coordinates of all nodes in **node_id_set** in the NodeStore **nodes** at once
+    and return them as dict {..., node_id: (node_lat, node_lon), ...} (nodes missing in the store are skipped).
+    '''
+    node_id_list = list(node_id_set)
+    lats, lons, found = nodes.lookup(np.array(node_id_list, dtype = np.int64))
+    return { node_id: (lat, lon) for (node_id, lat, lon, is_found)
+                in zip(node_id_list, lats.tolist(), lons.tolist(), found.tolist()) if is_found }
+
+def _read_elements(read_file, max_size, tags = ('bounds', 'node', 'way', 'relation')):
+    '''
+    Parse the XML-code of the opened **read_file** incrementally in bunches of length **max_size**
+    and yield a tuple (tag, output) for each completely parsed bounds, node, way or relation element (out of **tags**),
+    where output is the (truthy) result of _get_camera, _get_street resp. _get_relation.
+    '''
+    # init parser
+    parser = et.XMLPullParser(['start','end'])
+
+    # init parsing variables
+    root = None
+    relevancy_level = 0
+    elements_to_delete = []
+
+    # Start with parsing...
+    while True:
+        with Profiler.stage('read') as current:
+            line = read_file.read(max_size)
+            current.items = len(line)
+        if not line:
+            break
+
+        # feed the parser
+        with Profiler.stage('xml feed', len(line)):
+            parser.feed(line)
+
+        # iterate through all parsed elements (the time includes storing them, while this generator waits)
+        with Profiler.stage('element extraction'):
+            for event, elem in parser.read_events():
+                test_func = None
+
+                if root is None:
+                    root = elem
+
+                if elem.tag not in tags:
+                    # skip the element, but free it when it is parsed completely
+                    if event == "end" and elem.tag in ('node', 'way', 'relation'):
+                        elements_to_delete.append(elem)
+                    continue
+
+                # get bounds of the given map excerpt
+                if elem.tag == 'bounds':
+                    if event == "end":
+                        yield 'bounds', tuple(elem.attrib[key] for key in ['minlat', 'minlon', 'maxlat', 'maxlon'])
+                # process all node tags with _get_camera
+                if elem.tag == 'node':
+                    test_func = _get_camera
+                # process all way tags with _get_street
+                if elem.tag == 'way':
+                    test_func = _get_street
+                # process all relation tags with _get_relation
+                if elem.tag == 'relation':
+                    test_func = _get_relation
+
+                if not test_func:
+                    continue
+
+                if event == "start":
+                    if test_func(elem):
+                        # in case of an opening tag:
+                        # increase level if elem consists of required data (otherwise/ on level 0, elem would deleted before having read all its children)
+                        relevancy_level += 1
+                if event == "end":
+                    # in case of an ending tag:
+                    # have processed complete element, so add it to list of elements to delete
+                    elements_to_delete.append(elem)
+                    if test_func(elem):
+                        # decrease level if elem consists of required data (finally only on level 0, i. e. when all its child tags are read, it will be freed to delete)
+                        relevancy_level -= 1
+                        # get output of test_func
+                        yield elem.tag, test_func(elem)
+                    # rows of the additional tables of the rule file
+                    if active_rules().extra[elem.tag]:
+                        for element in _get_rows(elem):
+                            yield element
+
+        # delete elements only when we parsed them completely (including all its children)
+        if relevancy_level == 0:
+            for elem in elements_to_delete:
+                elem.clear()
+                if elem is not root:
+                    root.clear()
+            elements_to_delete.clear()
+    # raises a ParseError if the document is not complete (e.g. a truncated file)
+    parser.close()
+
+class _ExpatHandler(object):
+    '''
+    State machine for the expat callbacks of _read_elements_expat. It keeps the attributes of the current top level
+    node, way or relation and collects its tags and node resp. way member references, when the element ends its output
+    (the same as the one of _get_camera, _get_street resp. _get_relation) is appended to **elements**.
+    '''
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.elements = []
+        self.current = None             # tag of the current element out of self.tags (None outside of such elements)
+        self.attrib = None
+        self.element_tags = []
+        self.refs = []
+
+    def start(self, name, attrib):
+        if self.current is not None:
+            # child of the current element
+            if name == 'tag':
+                if 'k' in attrib and 'v' in attrib:
+                    self.element_tags.append( (attrib['k'], attrib['v']) )
+            elif name == 'nd':
+                if self.current == 'way':
+                    assert('ref' in attrib)
+                    self.refs.append(attrib['ref'])
+            elif name == 'member':
+                if self.current == 'relation' and attrib.get('type') == 'way':
+                    self.refs.append(attrib['ref'])
+        elif name in self.tags:
+            if name == 'bounds':
+                self.elements.append( ('bounds', tuple(attrib[key] for key in ['minlat', 'minlon', 'maxlat', 'maxlon'])) )
+            else:
+                self.current = name
+                self.attrib = attrib
+                self.element_tags = []
+                self.refs = []
+
+    def end(self, name):
+        if name != self.current:
+            return
+        attrib = self.attrib
+        if name == 'node':
+            self.elements.append( ('node', (is_camera(self.element_tags), attrib['id'], np.float64(attrib['lat']), np.float64(attrib['lon']))) )
+        elif name == 'way':
+            self.elements.append( ('way', street_info(attrib['id'], self.element_tags, self.refs)) )
+        else:
+            output = postal_info(attrib['id'], self.element_tags, self.refs)
+            if output:
+                self.elements.append( ('relation', output) )
+        if active_rules().extra[name]:
+            if name == 'node':
+                attributes = {'@id': attrib['id'], '@lat': float(attrib['lat']), '@lon': float(attrib['lon'])}
+            else:
+                attributes = {'@id': attrib['id'], '@nodes': self.refs, '@ways': self.refs}
+            self.elements += table_rows(name, self.element_tags, attributes)
+        self.current = None
+
+def _read_elements_expat(read_file, max_size, tags = ('bounds', 'node', 'way', 'relation')):
+    '''
+    Same as _read_elements, but the XML-code is parsed with expat callbacks, which only pick the attributes of the elements
+    and of their tag, nd and member children that are needed for the output, no element objects are built and freed.
+    '''
+    handler = _ExpatHandler(tags)
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    while True:
+        with Profiler.stage('read') as current:
+            line = read_file.read(max_size)
+            current.items = len(line)
+        if not line:
+            break
+        try:
+            with Profiler.stage('expat parse and extraction', len(line)):
+                parser.Parse(line, False)
+        except expat.ExpatError:
+            # hand out the elements in front of the error first
+            for element in handler.elements:
+                yield element
+            raise
+        elements, handler.elements = handler.elements, []
+        for element in elements:
+            yield element
+    # the final call raises an error if the document is not complete (e.g. a truncated file)
+    parser.Parse(b'', True)
+    for element in handler.elements:
+        yield element
+
+# an element boundary is the start of any top level node, way or relation tag
+_ELEMENT_START = re.compile(rb'<(?:node|way|relation)[\s/>]')
+
+def _find_shards(FILE, shard_count, window = 1 << 16):
+    '''
+    Split **FILE** into at most **shard_count** byte ranges [(start, end), ...] of about equal size,
+    where each range (but the first) starts at an element boundary.
+    '''
+    file_size = os.path.getsize(FILE)
+    boundaries = [0]
+    with open(FILE, 'rb') as read_file:
+        for k in range(1, shard_count):
+            offset = max(file_size * k // shard_count, boundaries[-1] + 1)
+            if offset >= file_size:
+                break
+            read_file.seek(offset)
+            # search the next element start behind offset, keep some overlap for a tag split between two windows
+            while True:
+                chunk = read_file.read(window)
+                match = _ELEMENT_START.search(chunk)
+                if match or len(chunk) < window:
+                    break
+                offset += window - 16
+                read_file.seek(offset)
+            if not match:
+                break
+            boundaries.append(offset + match.start())
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
+
+class _ParseSummary(object):
+    '''
+    Collect duration, peak resident memory and item count of the single passes of collect_data and print them as a table.
+    The passes are also recorded as stages of an active profiler (see Profiler.py).
+    '''
+
+    def __init__(self):
+        self.passes = []
+        self.stages = []
+        self.current = None
+        self.stage = None
+
+    def start(self, name):
+        Profiler.reset_peak_memory()
+        self.stage = Profiler.stage(name).__enter__()
+        self.current = (name, time.time())
+
+    def stop(self, items):
+        name, start_time = self.current
+        self.passes.append( (name, time.time() - start_time, Profiler.peak_memory(), items) )
+        self.current = None
+        self.close(items)
+
+    def close(self, items = None):
+        # end the profiler stage of the current pass (also if it failed)
+        if self.stage is not None:
+            self.stage.items = items
+            self.stage.__exit__(None, None, None)
+            self.stage = None
+
+    def add_stage(self, name, seconds, bytes_in, bytes_out = None):
+        # throughput of a stage of the input pipeline (bytes_out only for stages that change the size, like decompression)
+        self.stages.append( (name, seconds, bytes_in, bytes_out) )
+
+    def print_summary(self, **counts):
+        print('\nParse summary:')
+        print('\t%-28s %10s %14s %12s' % ('pass', 'seconds', 'peak RSS (MB)', 'items'))
+        for name, seconds, peak, items in self.passes:
+            print('\t%-28s %10.2f %14.1f %12s' % (name, seconds, peak / 2.0**20, items))
+        if self.stages:
+            print('\n\t%-28s %10s %10s %10s %10s' % ('stage', 'seconds', 'MB in', 'MB/s in', 'MB out'))
+            for name, seconds, bytes_in, bytes_out in self.stages:
+                rate = bytes_in / 2.0**20 / seconds if seconds > 0 else float('inf')
+                mb_out = '%10.1f' % (bytes_out / 2.0**20) if bytes_out is not None else '%10s' % '-'
+                print('\t%-28s %10.2f %10.1f %10.1f %s' % (name, seconds, bytes_in / 2.0**20, rate, mb_out))
+        for key in counts:
+            print('\t%s: %s' % (key, counts[key]))
+
+def _is_compressed(FILE):
+    return os.path.splitext(FILE)[1] in COMPRESSED_FORMATS
+
+class _DecompressReader(object):
+    '''
+    File-like reader of the decompressed content of a .bz2, .gz or .xz file.
+    A background thread decompresses the file in chunks of **chunk_size** bytes and puts them into a queue of at most
+    **queue_size** chunks, so decompression and parsing overlap (the decompressors release the GIL) and the
+    decompressed file is never stored completely. The thread records its busy time and the byte counts,
+    the reader records how long it waited for data (wait_time) and the thread how long it waited for space (full_time).
+    '''
+
+    def __init__(self, FILE, chunk_size, queue_size = QUEUE_SIZE):
+        self.file_name = FILE
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize = queue_size)
+        self.buffer = b''
+        self.finished = False
+        self.stopped = False
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self.full_time = 0.0
+        self.thread = threading.Thread(target = self._decompress)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _decompress(self):
+        decompressor = COMPRESSED_FORMATS[os.path.splitext(self.file_name)[1]]
+        try:
+            with open(self.file_name, 'rb') as raw_file, decompressor(raw_file) as stream:
+                while not self.stopped:
+                    start = time.time()
+                    data = stream.read(self.chunk_size)
+                    self.busy_time += time.time() - start
+                    self.compressed_bytes = raw_file.tell()
+                    if not data:
+                        break
+                    self.decompressed_bytes += len(data)
+                    self._put(data)
+        except Exception as error:
+            # the error is raised again in the reading thread
+            self._put(error)
+        self._put(None)
+
+    def _put(self, item):
+        start = time.time()
+        while not self.stopped:
+            try:
+                self.queue.put(item, timeout = 0.1)
+                break
+            except queue.Full:
+                continue
+        self.full_time += time.time() - start
+
+    def read(self, size):
+        while len(self.buffer) < size and not self.finished:
+            start = time.time()
+            item = self.queue.get()
+            self.wait_time += time.time() - start
+            if item is None:
+                self.finished = True
+            elif isinstance(item, Exception):
+                self.finished = True
+                raise item
+            else:
+                self.buffer = self.buffer + item if self.buffer else item
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        # stop the thread, also if the parser did not read everything
+        self.stopped = True
+        self.thread.join()
+
+class _ShardReader(object):
+    '''
+    File-like reader of the byte range [start, end) of a file, which is wrapped into an artificial root element
+    (without the opening tag for the first shard, that already contains the root of the document, and without the
+    closing tag for the last shard, that already contains the end of the document).
+    '''
+
+    def __init__(self, FILE, start, end, is_first, is_last):
+        self.file = open(FILE, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+        self.prefix = b'' if is_first else b'<osm>'
+        self.suffix = b'' if is_last else b'</osm>'
+
+    def read(self, size):
+        if self.prefix:
+            data, self.prefix = self.prefix, b''
+            return data
+        if self.remaining > 0:
+            data = self.file.read(min(size, self.remaining))
+            self.remaining -= len(data)
+            if data:
+                return data
+            self.remaining = 0
+        data, self.suffix = self.suffix, b''
+        return data
+
+    def close(self):
+        self.file.close()
+
+def _read_range(FILE, byte_range, max_size, tags = ('bounds', 'node', 'way', 'relation'), engine = 'etree', progress = None):
+    '''
+    Yield the (tag, output) tuples of _read_elements for the byte range (start, end) of **FILE**,
+    which must start at the beginning of the file or at an element boundary.
+    A range that reaches the end of the file already contains the closing root tag, so it gets no artificial one
+    and every parse error (also of a truncated file) is raised.
+    The read bytes are reported to a _ProgressReporter **progress**.
+    '''
+    start, end = byte_range
+    reader = _ShardReader(FILE, start, end, start == 0, end >= os.path.getsize(FILE))
+    try:
+        for element in _ENGINE_READERS[engine](_ProgressFile(reader, progress) if progress else reader, max_size, tags):
+            yield element
+    finally:
+        reader.close()
+
+class _ProgressFile(object):
+    '''
+    File-like wrapper of **read_file** that reports the size of every read chunk to a _ProgressReporter.
+    '''
+
+    def __init__(self, read_file, progress):
+        self.read_file = read_file
+        self.progress = progress
+
+    def read(self, size):
+        data = self.read_file.read(size)
+        self.progress.update(len(data))
+        return data
+
+class _ProgressReporter(object):
+    '''
+    Report the progress of collect_data every **interval** seconds: the consumed bytes against the size of the file **FILE**
+    (total, for compressed files the compressed bytes read so far, see position), the element counts {name: count} returned by
+    **counts** and their rates since the last report, the elapsed time, the ETA and the current resident memory.
+    A report is a line on stderr or, with a **status_file**, a json object that replaces the file (so a job scheduler that
+    polls it always reads a complete one). update is called once per read chunk and only looks at the clock.
+    '''
+
+    def __init__(self, FILE, interval, status_file, counts):
+        self.file_name = FILE
+        self.interval = interval
+        self.status_file = status_file
+        self.counts = counts
+        self.total = os.path.getsize(FILE)
+        self.consumed = 0
+        self.position = None            # function returning the consumed bytes, if they differ from the sizes passed to update
+        self.state = 'parsing'
+        self.start_time = time.time()
+        self.next_time = self.start_time + interval
+        self.last_time, self.last_counts = self.start_time, {}
+
+    def update(self, size):
+        self.consumed += size
+        if time.time() >= self.next_time:
+            self.report()
+
+    def parsed(self):
+        # the file is parsed completely (read characters of text files may be less than the bytes of the file)
+        self.consumed = self.total
+        self.position = None
+        self.report('resolving and writing')
+
+    def report(self, state = None):
+        now = time.time()
+        self.state = state or self.state
+        consumed = min(self.position() if self.position else self.consumed, self.total)
+        fraction = float(consumed) / self.total if self.total else 1.0
+        elapsed = now - self.start_time
+        eta = elapsed * (1 - fraction) / fraction if self.state == 'parsing' and fraction > 0 else None
+        counts = self.counts()
+        rates = {name: (count - self.last_counts.get(name, 0)) / max(now - self.last_time, 1e-6) for (name, count) in counts.items()}
+        self.last_time, self.last_counts = now, counts
+        self.next_time = now + self.interval
+        memory = Profiler.current_memory()
+        if self.status_file:
+            status = {'file': self.file_name, 'state': self.state, 'fraction': fraction, 'bytes': consumed, 'total_bytes': self.total,
+                      'elapsed_seconds': elapsed, 'eta_seconds': eta, 'counts': counts, 'rates': rates, 'rss_bytes': memory,
+                      'updated': time.strftime('%d.%m.%Y %H:%M:%S')}
+            with open(self.status_file + '.tmp', 'w') as write_file:
+                json.dump(status, write_file)
+            os.replace(self.status_file + '.tmp', self.status_file)
+        else:
+            sys.stderr.write('[%s] %5.1f %% (%.1f / %.1f MB), %s, elapsed %s, ETA %s, RSS %.1f MB\n'
+                             % (self.state, fraction * 100, consumed / 2.0**20, self.total / 2.0**20,
+                                ', '.join('%s %s (%.0f/s)' % (name, counts[name], rates[name]) for name in counts),
+                                _format_seconds(elapsed), _format_seconds(eta) if eta is not None else '-', memory / 2.0**20))
+            sys.stderr.flush()
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return '%d:%02d:%02d' % (minutes // 60, minutes % 60, seconds)
+
+class _Checkpoint(object):
+    '''
+    Checkpoints of a serial parse of **FILE** in the directory FILE.checkpoint, written at element boundaries at most every
+    **interval** seconds (see due). Every checkpoint appends a part part_<k>.pkl with what was collected since the previous one
+    (new dict items, table rows and node arrays, pickled with numpy arrays as binary) and then replaces state.json, which holds
+    the byte offset to continue at, the number of parts, the flushed sizes of all csv files and the output time stamp.
+    state.json is replaced last and atomically, so an interrupt while writing a checkpoint leaves the previous one valid.
+    A checkpoint only matches a resume with the same file (size and modification time) and the same **options**.
+    '''
+
+    def __init__(self, FILE, interval, options):
+        self.file_name = FILE
+        self.directory = FILE + '.checkpoint'
+        self.interval = interval
+        self.options = options
+        self.state = None               # the state of the last written (or loaded) checkpoint
+        self.last_time = time.time()
+
+    def _file_info(self):
+        file_stat = os.stat(self.file_name)
+        return {'size': file_stat.st_size, 'mtime': file_stat.st_mtime}
+
+    def load(self):
+        '''
+        Return the state of the last checkpoint of the file, None if there is none that matches the file and the options.
+        '''
+        state_file = os.path.join(self.directory, 'state.json')
+        if not os.path.isfile(state_file):
+            print('No checkpoint %s found, starting from the beginning.' % self.directory)
+            return None
+        with open(state_file, 'r') as read_file:
+            state = json.load(read_file)
+        if state['file'] != self._file_info() or state['options'] != self.options:
+            print('Checkpoint %s does not match the file or the options, starting from the beginning.' % self.directory)
+            return None
+        self.state = state
+        print('Resuming from checkpoint %s at byte %s (%.1f %%).' % (self.directory, state['offset'], 100.0 * state['offset'] / state['file']['size']))
+        return state
+
+    def parts(self):
+        # the parts of the loaded checkpoint in the order they were written
+        for k in range(self.state['parts']):
+            with open(os.path.join(self.directory, 'part_%s.pkl' % k), 'rb') as read_file:
+                yield pickle.load(read_file)
+
+    def due(self):
+        return time.time() - self.last_time >= self.interval
+
+    def save(self, offset, part, csv_sizes, time_now, out_dir):
+        '''
+        Write the **part** collected since the last checkpoint and the state of a checkpoint at byte **offset**.
+        '''
+        if self.state is None:
+            # a new parse replaces the checkpoints of an earlier one
+            shutil.rmtree(self.directory, ignore_errors = True)
+            os.mkdir(self.directory)
+        k = self.state['parts'] if self.state else 0
+        with open(os.path.join(self.directory, 'part_%s.pkl' % k), 'wb') as write_file:
+            pickle.dump(part, write_file, protocol = pickle.HIGHEST_PROTOCOL)
+            write_file.flush()
+            os.fsync(write_file.fileno())
+        state = {'file': self._file_info(), 'options': self.options, 'offset': offset, 'parts': k + 1,
+                 'csv_sizes': csv_sizes, 'time_now': time_now, 'out_dir': out_dir, 'written': time.strftime('%d.%m.%Y %H:%M:%S')}
+        state_file = os.path.join(self.directory, 'state.json')
+        with open(state_file + '.tmp', 'w') as write_file:
+            json.dump(state, write_file)
+            write_file.flush()
+            os.fsync(write_file.fileno())
+        os.replace(state_file + '.tmp', state_file)
+        self.state = state
+        self.last_time = time.time()
+
+    def remove(self):
+        # the parse is complete, its checkpoints are not needed anymore
+        shutil.rmtree(self.directory, ignore_errors = True)
+
+def _find_sections(FILE, window = 1 << 24):
+    '''
+    Scan the raw bytes of **FILE** for the first way and the first relation.
+    If all nodes are in front of all ways and all ways are in front of all relations,
+    return the byte offsets (first_way, first_relation) of the sections, None otherwise.
+    Missing sections start at the end of the file resp. at the following section.
+    '''
+    first_way = None
+    first_relation = None
+    offset = 0
+    tail = b''
+    with open(FILE, 'rb') as read_file:
+        while True:
+            data = read_file.read(window)
+            if not data:
+                break
+            # keep some overlap for a tag split between two windows
+            chunk = tail + data
+            base = offset - len(tail)
+            if first_way is None:
+                pos = chunk.find(b'<way')
+                if pos >= 0:
+                    first_way = base + pos
+            if first_relation is None:
+                pos = chunk.find(b'<relation')
+                if pos >= 0:
+                    first_relation = base + pos
+            # test for nodes behind the first way resp. for nodes and ways behind the first relation
+            if first_way is not None and chunk.find(b'<node', max(first_way - base, 0)) >= 0:
+                return None
+            if first_relation is not None and chunk.find(b'<way', max(first_relation - base, 0)) >= 0:
+                return None
+            offset += len(data)
+            tail = chunk[-16:]
+    if first_relation is None:
+        first_relation = offset
+    if first_way is None:
+        first_way = first_relation
+    return first_way, first_relation
+
+def _parse_shard(args):
+    '''
+    Worker function for the parallel parse of one shard.
+    Return the arrays (node_ids, lats, lons) of all nodes that are no camera and the list of (tag, output) tuples of all other elements.
+    '''
+    FILE, start, end, max_size, engine = args
+    node_ids, node_lats, node_lons = [], [], []
+    elements = []
+    for tag, output in _read_range(FILE, (start, end), max_size, engine = engine):
+        if tag == 'node' and not output[0]:
+            node_ids.append(int(output[1]))
+            node_lats.append(output[2])
+            node_lons.append(output[3])
+        else:
+            elements.append( (tag, output) )
+    node_arrays = (np.array(node_ids, dtype = np.int64), np.array(node_lats, dtype = np.float64), np.array(node_lons, dtype = np.float64))
+    return node_arrays, elements
+
+# generator functions of the parse engines
+_ENGINE_READERS = {'etree': _read_elements, 'expat': _read_elements_expat}
 
 def _get_camera(elem):
     '''
     Input:
     * elem: xml element
     Output:
-    * None if elem is no camera
-    * (cam_id, cam_lat, cam_lon) else
+    * None if elem is no node
+    * (is_cam, node_id, node_lat, node_lon) else
     '''
     # only elements of type node are candidates for cameras
     if elem.tag == 'node':
-        is_cam = False
-        for child in elem:
-            # test by node's tags and attributes if element is a cam
-            if ( (child.tag == 'tag')
-                    and (all( key in child.attrib for key in ('k', 'v') )) ):
-                if ( (child.attrib['k'] == 'man_made')
-                        and (child.attrib['v'] == 'surveillance') ):
-                    # it is a cam
-                    is_cam = True
+        # test by node's tags if element is a cam
+        is_cam = is_camera(_get_tags(elem))
         # get node data (id and coordinates)
         id = elem.attrib['id']
         lat = elem.attrib['lat']
@@ -301,50 +1097,18 @@ def _get_street(elem):
     * elem: xml element
     Output:
     * None if elem is no way
-    * If it is a way and even a highway/ street: (way_id, way_type, way_oneway, way_postal, way_name, node1, node2, ...)
-    * If it is a way and no highway/ street: (way_id, node1, node2, ...)
+    * If it is a way and even a highway/ street: (is_highway, way_id, way_type, way_oneway, way_postal, way_name, node1, node2, ...)
+    * If it is a way and no highway/ street: (is_highway, way_id, None, None, None, None, node1, node2, ...)
     '''
     # only elements of type way are candidates for streets
     if elem.tag == 'way':
-        is_highway = False
-        highway_type = None
-        is_oneway = 0
-        postal_code = None
-        name = None
-        id = None
         way_nodes =[]
         for child in elem:
             if child.tag == 'nd':
                 # collect all nodes of the way in way_nodes
                 assert('ref' in child.attrib)
                 way_nodes.append(child.attrib['ref'])
-            # test by way's tags and attributes if element is a street
-            if ( (child.tag == 'tag')
-                    and (all( key in child.attrib for key in ('k', 'v') )) ):
-                if child.attrib['k'] == 'highway':
-                    # it is a highway/ street, get its street type
-                    highway_type = child.attrib['v']
-                    is_highway = True
-                if is_highway:
-                    # get additional data (name, is_oneway, postal_code) in case of a highway
-                    if child.attrib['k'] == 'name':
-                        name = child.attrib['v']
-                    if ( 'oneway' in child.attrib.values() and (child.attrib['k'] == 'oneway')
-                            and (child.attrib['v'] == 'yes') ):
-                        # return the id, lat and long of the cam
-                        is_oneway = 1
-                    if ( 'postal_code' in child.attrib.values() and child.attrib['k'] == 'postal_code'):
-                        postal_code = child.attrib['v']
-        # independent of being a highway get element's id
-        id = elem.attrib['id']
-        if is_highway:
-            # return all way data including all its nodes
-            way_info = (is_highway, id, highway_type, is_oneway, postal_code, name) + tuple(way_nodes)
-        else:
-            # if it is no highway, return only is_highway (Bool), id and its corresponding nodes
-            way_info = (is_highway, id, None, None, None, None) + tuple(way_nodes)
-        way_nodes.clear()
-        return way_info
+        return street_info(elem.attrib['id'], _get_tags(elem), way_nodes)
     else:
         # no way
         return None
@@ -355,41 +1119,37 @@ def _get_relation(elem):
     * elem: xml element
     Output:
     * None if elem is no postal code area
-    * (postal_code, way1, way2, ...) else
+    * (relation_id, postal_code, way1, way2, ...) else
     '''
-    # only elements of type relation are candidates for cameras
+    # only elements of type relation are candidates for postal areas
     if elem.tag == 'relation':
         buffer_ways =[]
-        is_boundary = False
-        postal_code = None
         for child in elem:
             # get all boundary ways of the area
             if child.tag == 'member':
                 if ('type' in child.attrib and child.attrib['type'] == 'way'):
-                    way_id = child.attrib['ref']
-                    buffer_ways.append(way_id)
-            # test by child's tags and attributes if element is a postal area
-            if ( (child.tag == 'tag')
-                    and (all( key in child.attrib for key in ('k', 'v') )) ):
-                if child.attrib['k'] == 'boundary':
-                    if child.attrib['v'] == 'postal_code':
-                        # it is a postal area
-                        is_boundary = True
-                if is_boundary:
-                    if child.attrib['k'] == 'postal_code':
-                        postal_code = child.attrib['v']
-        if postal_code:
-            postal_info = (postal_code,) + tuple(buffer_ways)
-            buffer_ways.clear()
-            # return the postal area data
-            return postal_info
-        else:
-            # no postal area
-            return None
+                    buffer_ways.append(child.attrib['ref'])
+        return postal_info(elem.attrib['id'], _get_tags(elem), buffer_ways)
     else:
-        # no cam
+        # no postal area
         return None
 
+def _get_tags(elem):
+    # list of (key, value) of all complete tags of an element, in document order
+    return [ (child.attrib['k'], child.attrib['v']) for child in elem
+             if child.tag == 'tag' and 'k' in child.attrib and 'v' in child.attrib ]
+
+def _get_rows(elem):
+    # rows of the additional tables of the rule file for an xml element
+    attributes = {'@id': elem.attrib['id']}
+    if elem.tag == 'node':
+        attributes['@lat'], attributes['@lon'] = float(elem.attrib['lat']), float(elem.attrib['lon'])
+    elif elem.tag == 'way':
+        attributes['@nodes'] = [child.attrib['ref'] for child in elem if child.tag == 'nd']
+    else:
+        attributes['@ways'] = [child.attrib['ref'] for child in elem if child.tag == 'member' and child.attrib.get('type') == 'way']
+    return table_rows(elem.tag, _get_tags(elem), attributes)
+
 #####################################################################################################################
 
 if __name__ == '__main__':
@@ -0,0 +1,64 @@
+import os
+import sys
+import random
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def write_osm(path, node_count = 2000, seed = 1, outside_cameras = 0):
+    '''
+    Write a synthetic OpenStreetMap xml file to **path**: random nodes (every 37th one a camera), streets between random
+    nodes (every third one oneway) and four square postal areas, each one made of two ways, which cover the map excerpt.
+    **outside_cameras** more cameras are placed around the excerpt, outside of all postal areas.
+    '''
+    rand = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6" generator="test">',
+             ' <bounds minlat="52.4" minlon="13.1" maxlat="52.6" maxlon="13.5"/>']
+    for node_id in range(1, node_count + 1):
+        lat, lon = 52.4 + rand.random() * 0.2, 13.1 + rand.random() * 0.4
+        if node_id % 37 == 0:
+            lines.append(' <node id="%d" lat="%.7f" lon="%.7f">\n  <tag k="man_made" v="surveillance"/>\n </node>' % (node_id, lat, lon))
+        else:
+            lines.append(' <node id="%d" lat="%.7f" lon="%.7f"/>' % (node_id, lat, lon))
+    next_id = node_count + 1
+    for k in range(outside_cameras):
+        lat, lon = (52.35, 52.65)[k % 2] + rand.random() * 0.02, 13.1 + rand.random() * 0.4
+        lines.append(' <node id="%d" lat="%.7f" lon="%.7f">\n  <tag k="man_made" v="surveillance"/>\n </node>' % (next_id, lat, lon))
+        next_id += 1
+    corners = []
+    for area in range(4):
+        lat, lon = 52.4 + (area // 2) * 0.1, 13.1 + (area % 2) * 0.2
+        ids = []
+        for (corner_lat, corner_lon) in [(lat, lon), (lat, lon + 0.2), (lat + 0.1, lon + 0.2), (lat + 0.1, lon)]:
+            lines.append(' <node id="%d" lat="%.7f" lon="%.7f"/>' % (next_id, corner_lat, corner_lon))
+            ids.append(next_id)
+            next_id += 1
+        corners.append(ids)
+    way_id = 1
+    for street in range(node_count // 10):
+        lines.append(' <way id="%d">' % way_id)
+        lines += ['  <nd ref="%d"/>' % node_id for node_id in rand.sample(range(1, node_count + 1), rand.randint(2, 8))]
+        lines.append('  <tag k="highway" v="%s"/>' % rand.choice(['residential', 'primary', 'secondary', 'service']))
+        if street % 3 == 0:
+            lines.append('  <tag k="oneway" v="yes"/>')
+        lines.append('  <tag k="name" v="Street %d"/>' % street)
+        lines.append(' </way>')
+        way_id += 1
+    for (area, ids) in enumerate(corners):
+        for part in [ids[:3], ids[2:] + ids[:1]]:
+            lines.append(' <way id="%d">' % way_id)
+            lines += ['  <nd ref="%d"/>' % node_id for node_id in part]
+            lines.append(' </way>')
+            way_id += 1
+        lines.append(' <relation id="%d">' % (area + 1))
+        lines += ['  <member type="way" ref="%d" role="outer"/>' % (way_id - k) for k in (2, 1)]
+        lines.append('  <tag k="boundary" v="postal_code"/>\n  <tag k="postal_code" v="1%04d"/>' % area)
+        lines.append(' </relation>')
+    lines.append('</osm>')
+    with open(path, 'w') as write_file:
+        write_file.write('\n'.join(lines) + '\n')
+    return path
+
+@pytest.fixture
+def osm_file(tmp_path):
+    return write_osm(str(tmp_path / 'map.xml'))
@@ -0,0 +1,43 @@
+import pytest
+import parseXML_singleRun
+from NodeStore import NodeStore
+
+def test_len_does_not_merge_chunks():
+    nodes = NodeStore()
+    nodes.add_many([3, 1], [52.0, 52.1], [13.0, 13.1])
+    chunk_count, _ = nodes.new_chunks()
+    nodes.add_many([2], [52.2], [13.2])
+    assert len(nodes) == 3
+    _, (ids, _, _) = nodes.new_chunks(chunk_count)
+    assert ids.tolist() == [2]
+
+def test_new_chunks_of_finalized_store_raise():
+    nodes = NodeStore()
+    nodes.add_many([1], [52.0], [13.0])
+    nodes.finalize()
+    with pytest.raises(ValueError):
+        nodes.new_chunks(0)
+
+def test_resume_with_progress(osm_file, monkeypatch, capsys):
+    monkeypatch.setattr(parseXML_singleRun, 'CHECKPOINT_RANGE', 1 << 14)
+    full = parseXML_singleRun.collect_data(osm_file, False, 100000)
+    save = parseXML_singleRun._Checkpoint.save
+    saved = []
+
+    def interrupted_save(self, *args, **kwargs):
+        # interrupt the parse right behind its third checkpoint
+        save(self, *args, **kwargs)
+        saved.append(args[0])
+        if len(saved) == 3:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(parseXML_singleRun._Checkpoint, 'save', interrupted_save)
+    with pytest.raises(KeyboardInterrupt):
+        parseXML_singleRun.collect_data(osm_file, False, 100000, checkpoint_interval = 1e-9, progress_interval = 1e-9)
+    monkeypatch.setattr(parseXML_singleRun._Checkpoint, 'save', save)
+    resumed = parseXML_singleRun.collect_data(osm_file, False, 100000, resume = True, progress_interval = 1e-9)
+    assert 'Resuming from checkpoint' in capsys.readouterr().out
+    bounds, cameras, street_nodes, streets, postal_areas, area_nodes, area_lats, area_lons = resumed
+    assert street_nodes == full[2]
+    assert (bounds, cameras, streets, postal_areas) == (full[0], full[1], full[3], full[4])
+    assert (area_lats, area_lons) == (full[6], full[7])
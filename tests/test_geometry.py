@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from Geometry import classify_points, points_in_polygon, OUTSIDE, INSIDE, BOUNDARY
+
+def ring_edges(*rings):
+    # edges (start_lats, start_lons, end_lats, end_lons) of closed rings given as [(lat, lon), ..] without repeated first point
+    starts = np.array([point for ring in rings for point in ring], dtype = np.float64)
+    ends = np.array([point for ring in rings for point in ring[1:] + ring[:1]], dtype = np.float64)
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+OUTER = [(0.0, 0.0), (0.0, 4.0), (4.0, 4.0), (4.0, 0.0)]
+HOLE = [(1.0, 1.0), (1.0, 2.0), (2.0, 2.0), (2.0, 1.0)]
+
+def classify(points, *rings, **kwargs):
+    lats, lons = zip(*points)
+    return classify_points(lats, lons, *ring_edges(*rings), **kwargs).tolist()
+
+@pytest.mark.parametrize('max_pairs', [1, 1 << 22])
+def test_points_on_the_boundary(max_pairs):
+    # vertices, points on horizontal and vertical edges and points on the edges of the hole
+    boundary = [(0.0, 0.0), (4.0, 4.0), (0.0, 2.0), (4.0, 1.5), (2.5, 0.0), (3.0, 4.0), (1.0, 1.5), (1.5, 2.0), (2.0, 2.0)]
+    assert classify(boundary, OUTER, HOLE, max_pairs = max_pairs) == [BOUNDARY] * len(boundary)
+    inside_outside = [(3.0, 3.0), (1.5, 1.5), (0.0, 5.0), (-1e-6, 2.0), (2.0, 4.000001), (5.0, 5.0)]
+    assert classify(inside_outside, OUTER, HOLE, max_pairs = max_pairs) == [INSIDE, OUTSIDE, OUTSIDE, OUTSIDE, OUTSIDE, OUTSIDE]
+
+def test_points_on_a_diagonal_edge():
+    triangle = [(0.0, 0.0), (0.0, 3.0), (3.0, 0.0)]
+    assert classify([(1.5, 1.5), (1.0, 2.0), (1.0, 1.0), (2.0, 2.0)], triangle) == [BOUNDARY, BOUNDARY, INSIDE, OUTSIDE]
+    # the tolerance (degrees) decides how close to an edge a point is on the boundary
+    assert classify([(1.5, 1.50001)], triangle) == [OUTSIDE]
+    assert classify([(1.5, 1.50001)], triangle, tolerance = 1e-4) == [BOUNDARY]
+
+def test_include_boundary():
+    lats, lons = [0.0, 2.0, 3.0, 1.5], [2.0, 3.0, 5.0, 1.5]
+    assert points_in_polygon(lats, lons, *ring_edges(OUTER, HOLE)).tolist() == [True, True, False, False]
+    assert points_in_polygon(lats, lons, *ring_edges(OUTER, HOLE), include_boundary = False).tolist() == [False, True, False, False]
+
+def test_rules_for_holes():
+    # the hole with the same orientation as the outer ring is filled by the nonzero rule, one with the opposite orientation is not
+    point = [(1.5, 1.5)]
+    assert classify(point, OUTER, HOLE, rule = 'even-odd') == [OUTSIDE]
+    assert classify(point, OUTER, HOLE, rule = 'nonzero') == [INSIDE]
+    assert classify(point, OUTER, HOLE[::-1], rule = 'nonzero') == [OUTSIDE]
@@ -0,0 +1,46 @@
+import glob
+import os
+import numpy as np
+import pytest
+import parseXML_singleRun
+import OpenStreetMap
+from Database import Database
+from Dataset import Dataset
+from PostalAreas import PostalAreas
+from conftest import write_osm
+
+# query points inside the map excerpt and around it, where cameras outside of all postal areas are the nearest ones
+QUERY_LATS = [52.5, 52.45, 52.41, 52.59, 52.34, 52.68]
+QUERY_LONS = [13.3, 13.2, 13.11, 13.49, 13.0, 13.6]
+
+@pytest.fixture
+def outputs(tmp_path):
+    osm_file = write_osm(str(tmp_path / 'map.xml'), outside_cameras = 8)
+    parseXML_singleRun.collect_data(osm_file, False, 100000, npy_output = True, sqlite_output = True)
+    directory = str(tmp_path)
+    return glob.glob(os.path.join(directory, 'npy_*'))[0], glob.glob(os.path.join(directory, 'osm_*.sqlite'))[0]
+
+def test_query_cameras(outputs):
+    npy_dir, db_file = outputs
+    dataset = Dataset(npy_dir)
+    ids, lats, lons = Database(db_file).query_cameras()
+    assert ids == sorted(np.asarray(dataset.camera_ids).tolist())
+    inside = Database(db_file).query_cameras((52.4, 13.1, 52.5, 13.3))[1]
+    assert 0 < len(inside) < len(ids) and all(52.4 <= lat <= 52.5 for lat in inside)
+    # the cameras outside of the postal areas are not loaded with the areas
+    assert len(Database(db_file).query_areas()['cameras'][0]) == len(ids) - 8
+
+def test_nearest_cameras_of_database_and_dataset_agree(outputs):
+    npy_dir, db_file = outputs
+    expected = PostalAreas.from_dataset(Dataset(npy_dir)).nearest_cameras(QUERY_LATS, QUERY_LONS, k = 3, verbose = False)
+    result = PostalAreas.from_database(Database(db_file), all_cameras = True).nearest_cameras(QUERY_LATS, QUERY_LONS, k = 3, verbose = False)
+    assert result['camera'].tolist() == expected['camera'].tolist()
+    assert np.allclose(result['distance'], expected['distance'])
+
+def test_nearest_option_of_database_and_dataset_agree(outputs, capsys):
+    npy_dir, db_file = outputs
+    nearest = (QUERY_LATS, QUERY_LONS)
+    OpenStreetMap.postals_program(None, npy_dir, False, None, None, None, nearest, 3, None)
+    expected = capsys.readouterr().out.split('nearest cameras')[-1]
+    OpenStreetMap.postals_program(None, None, False, None, db_file, None, nearest, 3, None)
+    assert capsys.readouterr().out.split('nearest cameras')[-1] == expected
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from NodeStore import NodeStore
+
+@pytest.mark.parametrize('fixed_point', [True, False])
+def test_lookup_present_and_missing_ids(fixed_point):
+    # small chunks, so the nodes are spread over several chunks and added unsorted
+    nodes = NodeStore(chunk_size = 2, fixed_point = fixed_point)
+    for (node_id, lat, lon) in [(30, 52.5, 13.3), (10, 52.1234567, 13.7654321), ('20', -33.9, 151.2)]:
+        nodes.add(node_id, lat, lon)
+    nodes.add_many([50, 40], [1.5, -1.5], [2.5, -2.5])
+    lats, lons, found = nodes.lookup([40, 15, 10, 60, 30, 0, 20])
+    assert found.tolist() == [True, False, True, False, True, False, True]
+    assert lats[found].tolist() == [-1.5, 52.1234567, 52.5, -33.9]
+    assert lons[found].tolist() == [-2.5, 13.7654321, 13.3, 151.2]
+    assert np.isnan(lats[~found]).all() and np.isnan(lons[~found]).all()
+    assert nodes.get('10') == (52.1234567, 13.7654321)
+    assert nodes.get(11, 'missing') == 'missing'
+    assert len(nodes) == 5
+
+def test_lookup_after_more_nodes_and_duplicates():
+    nodes = NodeStore(chunk_size = 4)
+    nodes.add_many([1, 2, 3], [1.0, 2.0, 3.0], [1.0, 2.0, 3.0])
+    assert nodes.lookup([2])[2].tolist() == [True]
+    # nodes added after a lookup are merged with the finalized ones, the last coordinates of an id win
+    nodes.add(2, 20.0, 20.0)
+    nodes.add(4, 4.0, 4.0)
+    lats, lons, found = nodes.lookup([4, 2, 5])
+    assert found.tolist() == [True, True, False]
+    assert lats[:2].tolist() == [4.0, 20.0]
+    assert nodes.ids.tolist() == [1, 2, 3, 4]
+
+def test_lookup_in_empty_store():
+    lats, lons, found = NodeStore().lookup([1, 2])
+    assert not found.any() and np.isnan(lats).all()
+    assert NodeStore().get(1) is None
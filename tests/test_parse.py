@@ -0,0 +1,47 @@
+import pytest
+import parseXML_singleRun
+from conftest import write_osm
+
+ENGINE_ERRORS = (parseXML_singleRun.et.ParseError, parseXML_singleRun.expat.ExpatError)
+MODES = [{}, {'workers': 2}, {'two_pass': True}]
+
+def corrupt_way(path, way_id):
+    # give a node reference of the way a duplicate attribute, which is no well-formed xml
+    with open(path) as read_file:
+        text = read_file.read()
+    position = text.index('<way id="%d">' % way_id)
+    with open(path, 'w') as write_file:
+        write_file.write(text[:position] + text[position:].replace('<nd ref', '<nd ref="1" ref', 1))
+    return path
+
+def truncate(path, size):
+    with open(path) as read_file:
+        text = read_file.read()
+    with open(path, 'w') as write_file:
+        write_file.write(text[:len(text) - size])
+    return path
+
+@pytest.fixture
+def large_osm_file(tmp_path):
+    return write_osm(str(tmp_path / 'large.xml'), node_count = 20000)
+
+@pytest.mark.parametrize('engine', parseXML_singleRun.ENGINES)
+@pytest.mark.parametrize('mode', MODES)
+def test_modes_agree(large_osm_file, engine, mode):
+    serial = parseXML_singleRun.collect_data(large_osm_file, False, 100000)
+    result = parseXML_singleRun.collect_data(large_osm_file, False, 100000, engine = engine, **mode)
+    assert (result[2], result[3], result[4]) == (serial[2], serial[3], serial[4])
+
+@pytest.mark.parametrize('engine', parseXML_singleRun.ENGINES)
+@pytest.mark.parametrize('mode', MODES)
+def test_malformed_way_near_the_end_raises(large_osm_file, engine, mode):
+    corrupt_way(large_osm_file, 1900)
+    with pytest.raises(ENGINE_ERRORS):
+        parseXML_singleRun.collect_data(large_osm_file, False, 100000, engine = engine, **mode)
+
+@pytest.mark.parametrize('engine', parseXML_singleRun.ENGINES)
+@pytest.mark.parametrize('mode', MODES)
+def test_truncated_file_raises(large_osm_file, engine, mode):
+    truncate(large_osm_file, 200)
+    with pytest.raises(ENGINE_ERRORS):
+        parseXML_singleRun.collect_data(large_osm_file, False, 100000, engine = engine, **mode)
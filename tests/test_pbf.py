@@ -0,0 +1,47 @@
+import numpy as np
+import PBF
+
+def varint(value):
+    value &= (1 << 64) - 1
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def field(number, value):
+    # varints for ints, length delimited for bytes
+    if isinstance(value, bytes):
+        return varint(number << 3 | 2) + varint(len(value)) + value
+    return varint(number << 3) + varint(value)
+
+def packed_signed(values):
+    return b''.join(varint((value << 1) ^ (value >> 63)) for value in values)
+
+def dense_block(lats, lons, lat_offset, lon_offset, granularity = 100):
+    # PrimitiveBlock with one group of DenseNodes 1, 2, ...; the second node is a camera
+    strings = field(1, b'') + field(1, b'man_made') + field(1, b'surveillance')
+    ids = [1] + [1] * (len(lats) - 1)
+    keys_vals = [0, 1, 2, 0] + [0] * (len(lats) - 2)
+    dense = field(1, packed_signed(ids)) + field(8, packed_signed(np.diff(lats, prepend = 0).tolist())) \
+        + field(9, packed_signed(np.diff(lons, prepend = 0).tolist())) + field(10, b''.join(varint(value) for value in keys_vals))
+    return field(1, strings) + field(2, field(2, dense)) + field(17, granularity) + field(19, lat_offset) + field(20, lon_offset)
+
+def test_int64():
+    assert PBF.int64(5) == 5
+    assert PBF.int64((1 << 64) - 3) == -3
+
+def test_decode_block_offsets():
+    lats, lons = [1000, -2000, 3000], [-4000, 5000, 6000]
+    lat_offset, lon_offset = 1500000000, -2500000000
+    (ids, node_lats, node_lons), elements = PBF.decode_block(dense_block(lats, lons, lat_offset, lon_offset))
+    expected_lats = (lat_offset + 100 * np.array(lats)) / 1e9
+    expected_lons = (lon_offset + 100 * np.array(lons)) / 1e9
+    assert ids.tolist() == [1, 3]
+    assert np.array_equal(node_lats, expected_lats[[0, 2]])
+    assert np.array_equal(node_lons, expected_lons[[0, 2]])
+    assert elements == [('node', (True, '2', expected_lats[1], expected_lons[1]))]
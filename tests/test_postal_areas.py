@@ -0,0 +1,9 @@
+from Data import Data
+from PostalAreas import PostalAreas
+
+def test_camera_counts_are_sorted(osm_file):
+    data = Data(xml = osm_file)
+    postals = PostalAreas(*data.get_areas(), data.get_cameras())
+    counts = postals.get_camera_counts(verbose = False)
+    assert counts.tolist() == sorted(counts.tolist(), reverse = True)
+    assert counts.sum() == sum(len(cams) for cams in postals.cams_to_areas.values())
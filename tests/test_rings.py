@@ -0,0 +1,113 @@
+import os
+import glob
+import numpy as np
+import parseXML_singleRun
+from Data import Data
+from Dataset import Dataset
+from Database import Database
+from PostalAreas import PostalAreas
+from Rings import assemble_rings, area_rings, ring_holes
+
+def write_area_with_hole(path):
+    # postal area 10000: an outer square made of two ways and a square hole, with a camera in each of them
+    squares = [(1, 52.0, 13.0, 1.0), (5, 52.4, 13.4, 0.2)]
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6">', ' <bounds minlat="51.9" minlon="12.9" maxlat="53.1" maxlon="14.1"/>']
+    for (first_id, lat, lon, size) in squares:
+        for (k, (corner_lat, corner_lon)) in enumerate([(lat, lon), (lat, lon + size), (lat + size, lon + size), (lat + size, lon)]):
+            lines.append(' <node id="%d" lat="%.7f" lon="%.7f"/>' % (first_id + k, corner_lat, corner_lon))
+    for (camera_id, lat, lon) in [(20, 52.2, 13.2), (21, 52.5, 13.5)]:
+        lines.append(' <node id="%d" lat="%.7f" lon="%.7f">\n  <tag k="man_made" v="surveillance"/>\n </node>' % (camera_id, lat, lon))
+    for (way_id, node_ids) in [(1, [1, 2, 3]), (2, [3, 4, 1]), (3, [5, 6, 7, 8, 5])]:
+        lines.append(' <way id="%d">' % way_id)
+        lines += ['  <nd ref="%d"/>' % node_id for node_id in node_ids]
+        lines.append(' </way>')
+    lines.append(' <relation id="1">')
+    lines += ['  <member type="way" ref="%d" role=""/>' % way_id for way_id in [3, 1, 2]]
+    lines += ['  <tag k="boundary" v="postal_code"/>', '  <tag k="postal_code" v="10000"/>', ' </relation>', '</osm>']
+    with open(path, 'w') as write_file:
+        write_file.write('\n'.join(lines) + '\n')
+    return path
+
+def test_rings_with_hole_in_all_outputs(tmp_path):
+    path = write_area_with_hole(str(tmp_path / 'map.xml'))
+    parseXML_singleRun.collect_data(path, True, 100000, npy_output = True, sqlite_output = True)
+    csv_dir = glob.glob(str(tmp_path / 'csv_*'))[0]
+    with open(os.path.join(csv_dir, 'area_lats.csv')) as read_file:
+        rows = read_file.read().splitlines()
+    assert len(rows) == 2 and 'nan' not in ''.join(rows)
+
+    dataset = Dataset(glob.glob(str(tmp_path / 'npy_*'))[0])
+    assert dataset.area_ring_offsets.tolist() == [0, 2]
+    assert dataset.area_point_offsets.tolist() == [0, 5, 10]
+    assert dataset.area_ring_holes.tolist() == [0, 1]
+    assert not np.isnan(dataset.area_ring_lats).any()
+    database = Database(glob.glob(str(tmp_path / 'osm_*.sqlite'))[0])
+    areas = database.query_areas()
+    assert areas['holes'] == [[False, True]]
+    assert [len(ring) for ring in areas['lats'][0]] == [5, 5]
+
+    data = Data(csv_dir = csv_dir)
+    for postals in [PostalAreas(*data.get_areas(), data.get_cameras()), PostalAreas.from_dataset(dataset), PostalAreas.from_database(database)]:
+        assert postals.get_cams_to_areas() == {'10000': ['20']}
+        assert postals.cams_to_areas == {'10000': ['20']}
+
+def rotations(ring):
+    # all closed node lists of a ring, starting at any node and in both directions
+    nodes = ring[:-1]
+    return [nodes[k:] + nodes[:k] + [nodes[k]] for k in range(len(nodes))] + [(nodes[k:] + nodes[:k] + [nodes[k]])[::-1] for k in range(len(nodes))]
+
+def test_assemble_reversed_and_unordered_ways():
+    # the square 1-2-3-4 made of three ways in the wrong order, the middle one reversed, and a closed way on its own
+    rings, open_count = assemble_rings([[3, 4, 1], [9, 8, 7, 9], [3, 2], [1, 2], [5]])
+    assert open_count == 0 and len(rings) == 2
+    assert rings[0] in rotations([1, 2, 3, 4, 1])
+    assert rings[1] == [9, 8, 7, 9]
+    # the first way lies in the middle of the chain and every other way is reversed
+    rings, open_count = assemble_rings([[2, 3], [5, 4, 3], [2, 1], [5, 6], [1, 6]])
+    assert open_count == 0 and rings[0] in rotations([1, 2, 3, 4, 5, 6, 1])
+
+def test_assemble_open_rings():
+    # a chain whose ends do not meet is closed by a straight edge
+    rings, open_count = assemble_rings([[3, 4], [1, 2], [3, 2]])
+    assert open_count == 1 and len(rings) == 1
+    assert rings[0][0] == rings[0][-1] and sorted(rings[0][:-1]) == [1, 2, 3, 4]
+    assert rings[0][:-1] in [[1, 2, 3, 4], [4, 3, 2, 1]]
+
+def node_lookup(coordinates):
+    # lookup function like NodeStore.lookup for a dictionary {..., node_id: (lat, lon), ...}
+    def lookup(node_ids):
+        found = np.array([node_id in coordinates for node_id in node_ids.tolist()], dtype = bool)
+        lats = np.array([coordinates.get(node_id, (np.nan, np.nan))[0] for node_id in node_ids.tolist()], dtype = np.float64)
+        lons = np.array([coordinates.get(node_id, (np.nan, np.nan))[1] for node_id in node_ids.tolist()], dtype = np.float64)
+        return lats, lons, found
+    return lookup
+
+def test_area_rings_with_holes():
+    # outer square (ways 1, 2, 3, unordered), a hole (ways 4 and 5, both starting at node 5) and a clockwise island in the hole (way 6)
+    coordinates = {1: (0.0, 0.0), 2: (0.0, 10.0), 3: (10.0, 10.0), 4: (10.0, 0.0),
+                   5: (2.0, 2.0), 6: (2.0, 8.0), 7: (8.0, 8.0), 8: (8.0, 2.0),
+                   9: (4.0, 4.0), 10: (4.0, 6.0), 11: (6.0, 6.0), 12: (6.0, 4.0)}
+    way_nodes = {1: [3, 4], 2: [1, 2, 3], 3: [4, 1], 4: [5, 6, 7], 5: [5, 8, 7], 6: [9, 12, 11, 10, 9]}
+    lats, lons, ring_offsets, holes, missing, open_count = area_rings([6, 4, 1, 99, 5, 3, 2], way_nodes, node_lookup(coordinates))
+    assert ring_offsets.tolist() == [0, 5, 10, 15] and open_count == 0 and not len(missing)
+    # outer rings (the square and the island) first, then the hole
+    assert holes.tolist() == [False, False, True]
+    assert ring_holes(lats, lons, ring_offsets).tolist() == holes.tolist()
+    starts, ends = ring_offsets[:-1], ring_offsets[1:] - 1
+    assert (lats[starts] == lats[ends]).all() and (lons[starts] == lons[ends]).all()
+    rings = [set(zip(lats[start:end].tolist(), lons[start:end].tolist())) for (start, end) in zip(starts, ends)]
+    squares = [set(coordinates[k] for k in nodes) for nodes in [[1, 2, 3, 4], [9, 10, 11, 12], [5, 6, 7, 8]]]
+    assert rings[:2] in [squares[:2], squares[1::-1]] and rings[2] == squares[2]
+
+def test_area_rings_with_missing_nodes_and_open_ways():
+    coordinates = {1: (0.0, 0.0), 2: (0.0, 1.0), 3: (1.0, 1.0), 4: (1.0, 0.0)}
+    # node 7 lies outside of the excerpt and the ring of ways 1 and 2 does not close
+    way_nodes = {1: [1, 2, 7, 3], 2: [3, 4], 3: [8, 9, 8]}
+    lats, lons, ring_offsets, holes, missing, open_count = area_rings([1, 2, 3], way_nodes, node_lookup(coordinates))
+    assert open_count == 1
+    assert sorted(missing.tolist()) == [7, 8, 8, 9]
+    # the ring without any known node is left out, the other one keeps its known nodes
+    assert ring_offsets.tolist() == [0, 5] and holes.tolist() == [False]
+    assert lats[0] == lats[-1] and lons[0] == lons[-1]
+    assert set(zip(lats.tolist(), lons.tolist())) == set(coordinates.values())
+    assert ring_holes(lats, lons, ring_offsets).tolist() == [False]
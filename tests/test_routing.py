@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from Routing import RoutingGraph
+from Geometry import EARTH_RADIUS, segment_lengths
+
+# 0.001 degrees along the equator or a meridian in metres
+UNIT = EARTH_RADIUS * np.radians(0.001)
+
+NODES = {1: (0.0, 0.0), 2: (0.0, 0.001), 3: (0.0, 0.002), 4: (0.001, 0.001), 5: (0.001, 0.002), 6: (-0.001, 0.001), 7: (-0.001, 0.0)}
+# (node ids, oneway): the street 1-2-3, the oneway streets 3-5-4 and 4-1 around the block, the dead end 2-6
+# and the oneway street 7-1, which cannot be entered
+STREETS = [([1, 2, 3], False), ([3, 5, 4], True), ([4, 1], True), ([2, 6], False), ([7, 1], True)]
+
+def build_graph(streets = STREETS):
+    street_offsets = np.cumsum([0] + [len(node_ids) for (node_ids, oneway) in streets])
+    point_ids = [node_id for (node_ids, oneway) in streets for node_id in node_ids]
+    lats, lons = [NODES[node_id][0] for node_id in point_ids], [NODES[node_id][1] for node_id in point_ids]
+    return RoutingGraph.from_streets(street_offsets, point_ids, lats, lons, [oneway for (node_ids, oneway) in streets])
+
+def test_graph():
+    graph = build_graph()
+    # node 5 is only a shape point of its street
+    assert graph.node_ids.tolist() == [1, 2, 3, 4, 6, 7]
+    assert graph.vertex(5) is None and graph.vertex(8) is None and graph.vertex(4) == 3
+    # two edges each for the sections 1-2, 2-3 and 2-6, one each for the oneway streets
+    assert graph.edge_count() == 9
+    assert graph.weights[graph.edge_streets == 1].tolist() == pytest.approx([2 * UNIT])
+
+def test_shortest_paths_with_oneway_streets():
+    graph = build_graph()
+    v = {node_id: graph.vertex(node_id) for node_id in [1, 2, 3, 4, 6, 7]}
+    diagonal = segment_lengths([0.001, 0.0], [0.001, 0.0])[0]
+    # from 1 to 4 only around the block, the oneway street 4-1 cannot be used backwards
+    distance, vertices, edges = graph.shortest_path(v[1], v[4])
+    assert distance == pytest.approx(4 * UNIT)
+    assert vertices == [v[1], v[2], v[3], v[4]]
+    assert graph.edge_streets[edges].tolist() == [0, 0, 1]
+    # from 4 to 3 not backwards along the oneway street 3-5-4
+    distance, vertices, edges = graph.shortest_path(v[4], v[3])
+    assert distance == pytest.approx(diagonal + 2 * UNIT)
+    assert vertices == [v[4], v[1], v[2], v[3]]
+    assert graph.edge_streets[edges].tolist() == [2, 0, 0]
+    # 7 can only be left
+    assert graph.shortest_path(v[1], v[7]) == (np.inf, [], [])
+    assert graph.shortest_path(v[7], v[2])[1] == [v[7], v[1], v[2]]
+    assert graph.shortest_path(v[6], v[6]) == (0.0, [v[6]], [])
+
+def test_dijkstra_and_a_star_agree():
+    graph = build_graph()
+    diagonal = segment_lengths([0.001, 0.0], [0.001, 0.0])[0]
+    v = {node_id: graph.vertex(node_id) for node_id in [1, 2, 3, 4, 6, 7]}
+    assert graph.distances(v[6], [v[4], v[1], v[7], v[6]]).tolist() == pytest.approx([4 * UNIT, 2 * UNIT, np.inf, 0.0])
+    assert graph.distances(v[4], [v[6]]).tolist() == pytest.approx([diagonal + 2 * UNIT])
+    matrix = graph.distance_matrix(range(graph.vertex_count()), range(graph.vertex_count()))
+    for source in range(graph.vertex_count()):
+        for target in range(graph.vertex_count()):
+            assert graph.shortest_path(source, target)[0] == pytest.approx(matrix[source, target])
+    # the matrix is not symmetric because of the oneway streets
+    assert matrix[v[1], v[4]] == pytest.approx(4 * UNIT) and matrix[v[4], v[1]] == pytest.approx(diagonal)
+
+def test_reachable():
+    graph = build_graph()
+    v = {node_id: graph.vertex(node_id) for node_id in [1, 2, 3, 4, 6, 7]}
+    vertices, distances = graph.reachable(v[1], 2.5 * UNIT)
+    assert dict(zip(vertices.tolist(), distances.tolist())) == pytest.approx({v[1]: 0.0, v[2]: UNIT, v[3]: 2 * UNIT, v[6]: 2 * UNIT})
+    assert (np.diff(distances) >= 0).all()
+    # without the oneway restriction 4 is reached from 1 over the street 4-1
+    both_ways = build_graph([(node_ids, False) for (node_ids, oneway) in STREETS])
+    vertices, distances = both_ways.reachable(both_ways.vertex(1), 2.5 * UNIT)
+    assert both_ways.vertex(4) in vertices.tolist() and both_ways.vertex(7) in vertices.tolist()
@@ -0,0 +1,65 @@
+import json
+import pytest
+from TagRules import RuleSet, load_rules, DEFAULT_RULES
+
+RULES = dict(DEFAULT_RULES, **{
+    'shops': {'element': 'node', 'match': {'shop': None, 'amenity': ['marketplace']}, 'require': ['name', 'opening_hours'], 'keep': ['@id', 'name', 'shop=bakery']},
+    'parks': {'element': 'way', 'match': {'leisure': ['park']}, 'keep': ['@id', 'name', '@nodes']},
+})
+
+def test_match_with_require():
+    rules = RuleSet(RULES)
+    shops, parks = rules.names.index('shops'), rules.names.index('parks')
+    assert rules.match('node', [('shop', 'bakery'), ('name', 'Baker'), ('opening_hours', '24/7')]) == [shops]
+    assert rules.match('node', [('amenity', 'marketplace'), ('name', 'Market'), ('opening_hours', 'Sa')]) == [shops]
+    # a required key that is missing or has an empty value sorts the element out
+    assert rules.match('node', [('shop', 'bakery'), ('name', 'Baker')]) == []
+    assert rules.match('node', [('shop', 'bakery'), ('name', ''), ('opening_hours', '24/7')]) == []
+    # the value of a matched key must be one of the listed ones, the required keys alone match nothing
+    assert rules.match('node', [('amenity', 'bench'), ('name', 'Bench'), ('opening_hours', '24/7')]) == []
+    assert rules.match('node', [('name', 'Baker'), ('opening_hours', '24/7')]) == []
+    # the require of one table does not sort out the other tables matched by the element
+    camera = rules.default['cameras']
+    assert rules.match('node', [('man_made', 'surveillance'), ('shop', 'kiosk')]) == [camera]
+    assert rules.match('node', [('man_made', 'surveillance'), ('shop', 'kiosk'), ('name', 'K'), ('opening_hours', 'Mo')]) == sorted([camera, shops])
+    # tables without require and tables of other element types
+    assert rules.match('way', [('leisure', 'park')]) == [parks]
+    assert rules.match('relation', [('leisure', 'park')]) == []
+    postal_areas = rules.default['postal_areas']
+    assert rules.match('relation', [('boundary', 'postal_code'), ('postal_code', '10000')]) == [postal_areas]
+    assert rules.match('relation', [('boundary', 'postal_code')]) == []
+
+def test_rows():
+    rules = RuleSet(RULES)
+    shops, parks = rules.names.index('shops'), rules.names.index('parks')
+    tags = [('shop', 'bakery'), ('name', 'Baker'), ('opening_hours', '24/7')]
+    assert rules.row(shops, tags, {'@id': '7', '@lat': '1.0', '@lon': '2.0'}) == ('7', 'Baker', 1)
+    assert rules.row(shops, [('shop', 'kiosk')], {'@id': '8'}) == ('8', None, 0)
+    assert rules.row(parks, [('leisure', 'park')], {'@id': '9', '@nodes': ['1', '2', '1']}) == ('9', None, '1', '2', '1')
+    assert rules.extra == {'node': [shops], 'way': [parks], 'relation': []}
+
+def test_load_rules_keeps_default_require(tmp_path):
+    rule_file = str(tmp_path / 'rules.json')
+    with open(rule_file, 'w') as write_file:
+        json.dump({'postal_areas': {'match': {'boundary': ['postal_code', 'administrative']}, 'require': ['name']},
+                   'shops': RULES['shops']}, write_file)
+    rules = load_rules(rule_file)
+    assert rules['postal_areas']['require'] == ['name', 'postal_code']
+    assert rules['postal_areas']['keep'] == DEFAULT_RULES['postal_areas']['keep']
+    assert rules['shops'] == RULES['shops']
+    rule_set = RuleSet(rules)
+    postal_areas = rule_set.default['postal_areas']
+    assert rule_set.match('relation', [('boundary', 'administrative'), ('postal_code', '10000'), ('name', 'Mitte')]) == [postal_areas]
+    assert rule_set.match('relation', [('boundary', 'administrative'), ('name', 'Mitte')]) == []
+    assert rule_set.match('relation', [('boundary', 'postal_code'), ('postal_code', '10000')]) == []
+
+def test_load_rules_checks_rules(tmp_path):
+    rule_file = str(tmp_path / 'rules.json')
+    for rules in [{'cameras': {'element': 'way', 'match': {'man_made': ['surveillance']}}},
+                  {'trees': {'element': 'node', 'match': {}, 'keep': ['@id']}},
+                  {'trees': {'element': 'node', 'match': {'natural': ['tree']}, 'keep': ['@nodes']}},
+                  {'routes': {'element': 'relation', 'match': {'type': ['route']}, 'keep': ['@ways', '@id']}}]:
+        with open(rule_file, 'w') as write_file:
+            json.dump(rules, write_file)
+        with pytest.raises(AssertionError):
+            load_rules(rule_file)
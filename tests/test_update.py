@@ -0,0 +1,57 @@
+import os
+import re
+import glob
+import numpy as np
+import parseXML_singleRun
+from Dataset import Dataset, split_rings
+from Update import apply_changes
+from conftest import write_osm
+
+RELATION = re.compile(r' <relation id="(\d+)">\n(.*?) </relation>\n', re.S)
+
+def relation(relation_id, members, tags):
+    return ' <relation id="%s">\n%s%s </relation>\n' % (relation_id, members, ''.join('  <tag k="%s" v="%s"/>\n' % tag for tag in tags))
+
+def parse_dataset(path):
+    parseXML_singleRun.collect_data(path, False, 100000, npy_output = True)
+    return glob.glob(os.path.join(os.path.dirname(path), 'npy_*'))[0]
+
+def areas(npy_dir):
+    # {..., relation_id: (postal_code, ways, ring lats, ring lons, cameras), ...}
+    dataset = Dataset(npy_dir)
+    postal_codes = dataset.get_postal_codes()
+    way_bounds, rings = dataset.area_way_offsets.tolist(), split_rings(dataset)
+    result = {}
+    for k, relation_id in enumerate(dataset.area_relation_ids.tolist()):
+        cameras = np.sort(dataset.camera_area_ids[dataset.camera_area_idx == k]).tolist()
+        result[relation_id] = (postal_codes[k], dataset.area_way_ids[way_bounds[k]:way_bounds[k+1]].tolist(), rings[k][0], rings[k][1], cameras)
+    return result
+
+def test_relation_changes_match_full_parse(tmp_path):
+    for name in ['before', 'after']:
+        os.mkdir(str(tmp_path / name))
+    before = write_osm(str(tmp_path / 'before' / 'map.xml'))
+    with open(before) as read_file:
+        text = read_file.read()
+    members = dict(RELATION.findall(text))
+    members = {relation_id: ''.join(line + '\n' for line in body.splitlines() if '<member' in line) for (relation_id, body) in members.items()}
+    postal = lambda code: [('boundary', 'postal_code'), ('postal_code', code)]
+    # relation 1 is deleted (without tags), 2 gets another postal code, 3 loses its tags
+    # and the new relation 5 takes over the postal code and the ways of relation 3
+    changes = ('<?xml version="1.0" encoding="UTF-8"?>\n<osmChange version="0.6">\n<delete>\n <relation id="1"/>\n</delete>\n<modify>\n'
+               + relation(2, members['2'], postal('19999')) + relation(3, members['3'], [('type', 'multipolygon')])
+               + '</modify>\n<create>\n' + relation(5, members['3'], postal('10002')) + '</create>\n</osmChange>\n')
+    osc_file = str(tmp_path / 'changes.osc')
+    with open(osc_file, 'w') as write_file:
+        write_file.write(changes)
+    after = str(tmp_path / 'after' / 'map.xml')
+    changed_relations = {'1': '', '2': relation(2, members['2'], postal('19999')), '3': relation(3, members['3'], [('type', 'multipolygon')])}
+    with open(after, 'w') as write_file:
+        write_file.write(RELATION.sub(lambda match: changed_relations.get(match.group(1), match.group(0)), text)
+                         .replace('</osm>', relation(5, members['3'], postal('10002')) + '</osm>'))
+
+    updated = apply_changes(parse_dataset(before), osc_file, str(tmp_path / 'updated'))
+    expected = areas(parse_dataset(after))
+    assert sorted(expected) == [2, 4, 5]
+    assert expected[2][0] == '19999' and expected[5][0] == '10002'
+    assert areas(updated) == expected